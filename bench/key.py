@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# Copyright (c) 2018 The Bitcoin developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Benchmark signing and verifying with the backends of test_framework.key.
+
+Signs a number of hashes with one key, as the block generators of
+p2p-fullblocktest.py do, and verifies the signatures, with:
+
+- python: PythonBackend
+- secp256k1: Secp256k1Backend, if libsecp256k1 can be loaded
+
+once with a CECKey.sign() or verify() call per hash and once with a single
+sign_many() or verify_many() call. Both backends must give identical
+signatures.
+"""
+
+import argparse
+import hashlib
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from test_framework.key import (
+    CECKey,
+    PythonBackend,
+    Secp256k1Backend,
+)
+
+
+def bench(name, func, count):
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    print("%-24s %8.3f s  %9.0f /s" % (name, elapsed, count / elapsed))
+    return result
+
+
+def run(backend, hashes):
+    key = CECKey(backend)
+    key.set_secretbytes(b"horsebattery")
+    name = backend.name
+    sigs = bench(name + " sign", lambda: [key.sign(h) for h in hashes], len(hashes))
+    assert bench(name + " sign_many", lambda: key.sign_many(hashes), len(hashes)) == sigs
+    assert all(bench(name + " verify", lambda: [key.verify(h, s) for h, s in zip(hashes, sigs)], len(hashes)))
+    assert all(bench(name + " verify_many", lambda: key.verify_many(hashes, sigs), len(hashes)))
+    return sigs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=1000, help="number of hashes")
+    parser.add_argument("--library", default=None, help="path of libsecp256k1, if it is not on the library path")
+    args = parser.parse_args()
+
+    hashes = [hashlib.sha256(b"%d" % i).digest() for i in range(args.count)]
+    print("%d hashes" % args.count)
+    sigs = run(PythonBackend(), hashes)
+    try:
+        backend = Secp256k1Backend(args.library)
+    except OSError as e:
+        print("secp256k1 unavailable: %s" % e)
+        return
+    assert run(backend, hashes) == sigs
+
+
+if __name__ == '__main__':
+    main()
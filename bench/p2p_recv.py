@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# Copyright (c) 2018 The Bitcoin developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Benchmark receiving and framing P2P messages in mininode.NodeConn.
+
+A NodeConn connects to a local listening socket, which streams a number of
+large blocks followed by thousands of small inv and tx messages. The time
+until the NodeConn has delivered every message is measured.
+"""
+
+import argparse
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from test_framework.mininode import (
+    CBlock,
+    CInv,
+    COutPoint,
+    CTransaction,
+    CTxIn,
+    CTxOut,
+    MY_VERSION,
+    NetworkThread,
+    NodeConn,
+    NodeConnCB,
+    logger,
+    msg_block,
+    msg_inv,
+    msg_tx,
+    sha256,
+)
+
+
+class CountingCB(NodeConnCB):
+    """Sets done once expected messages have been delivered."""
+
+    def __init__(self, expected):
+        super().__init__()
+        self.expected = expected
+        self.received = 0
+        self.done = threading.Event()
+
+    def count(self):
+        self.received += 1
+        if self.received == self.expected:
+            self.done.set()
+
+    def on_block(self, conn, message):
+        self.count()
+
+    def on_inv(self, conn, message):
+        self.count()
+
+    def on_tx(self, conn, message):
+        self.count()
+
+
+def frame(conn, message):
+    """Returns the wire encoding of message, as NodeConn.send_message would
+    send it."""
+    data = message.serialize()
+    return (conn.MAGIC_BYTES["regtest"] + message.command +
+            b"\x00" * (12 - len(message.command)) +
+            struct.pack("<I", len(data)) + sha256(sha256(data))[:4] + data)
+
+
+def make_messages(block_size, num_blocks, num_small):
+    tx = CTransaction()
+    tx.vin.append(CTxIn(COutPoint(1, 0), b"\x51"))
+    tx.vout.append(CTxOut(0, b"\x6a" + b"\x00" * block_size))
+    block = CBlock()
+    block.vtx.append(tx)
+    small_tx = CTransaction()
+    small_tx.vin.append(CTxIn(COutPoint(2, 0), b"\x51" * 100))
+    small_tx.vout.append(CTxOut(1000, b"\x51" * 25))
+    messages = [msg_block(block)] * num_blocks
+    for i in range(num_small):
+        if i % 2:
+            messages.append(msg_tx(small_tx))
+        else:
+            messages.append(msg_inv([CInv(1, i)]))
+    return messages
+
+
+def run(messages):
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(1)
+    cb = CountingCB(len(messages))
+    conn = NodeConn("127.0.0.1", listener.getsockname()[1], None, cb, send_version=False)
+    conn.ver_recv = conn.ver_send = MY_VERSION
+    network_thread = NetworkThread()
+    network_thread.start()
+    peer, _ = listener.accept()
+    listener.close()
+    data = [frame(conn, m) for m in messages]
+    size = sum(len(d) for d in data)
+
+    start = time.perf_counter()
+    for d in data:
+        peer.sendall(d)
+    cb.done.wait()
+    elapsed = time.perf_counter() - start
+    peer.close()
+    network_thread.join()
+    print("%-15s %8.3f s  %7.1f MB/s" % ("NodeConn", elapsed, size / elapsed / 1e6))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--block-size", type=float, default=8, help="block size in MB")
+    parser.add_argument("--blocks", type=int, default=4)
+    parser.add_argument("--small", type=int, default=20000, help="number of small inv and tx messages")
+    args = parser.parse_args()
+    logger.disabled = True
+
+    messages = make_messages(int(args.block_size * 1e6), args.blocks, args.small)
+    print("%d blocks of %.1f MB, %d small messages" % (args.blocks, args.block_size, args.small))
+    run(messages)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# Copyright (c) 2018 The Bitcoin developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Benchmark decoding of large RPC responses in authproxy.
+
+Builds a getblock verbosity 2 style response of the requested size and
+measures the decode throughput of:
+
+- legacy: decode to str, json.loads, then json.dumps of the result for the
+  debug log line, as authproxy did before the codec layer
+- json: AuthServiceProxy._parse_response with JSONCodec and debug logging
+  disabled
+- simplejson: the same with SimpleJSONCodec, if simplejson is installed
+"""
+
+import argparse
+import decimal
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from test_framework.authproxy import (
+    AuthServiceProxy,
+    EncodeDecimal,
+    JSONCodec,
+    SimpleJSONCodec,
+)
+
+
+class FakeHTTPResponse():
+    status = 200
+    reason = 'OK'
+
+    def __init__(self, body):
+        self.body = body
+
+    def getheader(self, name, default=None):
+        return 'application/json' if name == 'Content-Type' else default
+
+    def read(self):
+        return self.body
+
+
+def make_response(size):
+    """Returns a JSON-RPC response of about size bytes."""
+    txs = []
+    tx = {
+        "txid": "%064x" % 0,
+        "hash": "%064x" % 0,
+        "version": 1,
+        "size": 225,
+        "locktime": 0,
+        "vin": [{"txid": "%064x" % 1, "vout": 0,
+                 "scriptSig": {"asm": "3045" * 18, "hex": "47" * 72},
+                 "sequence": 4294967295}],
+        "vout": [{"value": decimal.Decimal("12.34567890"), "n": n,
+                  "scriptPubKey": {"asm": "OP_DUP OP_HASH160 " + "ab" * 20 + " OP_EQUALVERIFY OP_CHECKSIG",
+                                   "hex": "76a914" + "ab" * 20 + "88ac",
+                                   "reqSigs": 1, "type": "pubkeyhash",
+                                   "addresses": ["bchreg:qz" + "x" * 40]}}
+                 for n in range(2)],
+        "hex": "01" * 225,
+    }
+    tx_size = len(json.dumps(tx, default=EncodeDecimal))
+    for _ in range(max(1, size // tx_size)):
+        txs.append(tx)
+    block = {"hash": "%064x" % 2, "confirmations": 1, "height": 100,
+             "difficulty": decimal.Decimal("4.656542373906925E-10"),
+             "tx": txs}
+    return json.dumps({"result": block, "error": None, "id": 1},
+                      default=EncodeDecimal).encode('utf-8')
+
+
+def legacy_parse(body):
+    responsedata = body.decode('utf8')
+    response = json.loads(responsedata, parse_float=decimal.Decimal)
+    json.dumps(response["result"], default=EncodeDecimal, ensure_ascii=True)
+    return response
+
+
+def bench(name, parse, body, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        parse(body)
+    elapsed = (time.perf_counter() - start) / iterations
+    print("%-12s %8.1f ms  %7.1f MB/s" % (name, elapsed * 1000, len(body) / elapsed / 1e6))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=float, default=4, help="response size in MB")
+    parser.add_argument("--iterations", type=int, default=10)
+    args = parser.parse_args()
+
+    body = make_response(int(args.size * 1e6))
+    print("response: %.1f MB" % (len(body) / 1e6))
+
+    bench("legacy", legacy_parse, body, args.iterations)
+    codecs = [("json", JSONCodec())]
+    try:
+        codecs.append(("simplejson", SimpleJSONCodec()))
+    except ImportError:
+        print("simplejson not installed, skipping")
+    for name, codec in codecs:
+        proxy = AuthServiceProxy("node0", "http://u:p@127.0.0.1:1", codec=codec)
+        assert proxy._parse_response(FakeHTTPResponse(body), 0) == legacy_parse(body)
+        bench(name, lambda b: proxy._parse_response(FakeHTTPResponse(b), 0), body, args.iterations)
+
+
+if __name__ == '__main__':
+    main()
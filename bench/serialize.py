@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# Copyright (c) 2018 The Bitcoin developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Benchmark serializing and deserializing a large block in mininode.
+
+Builds a block of the requested size out of one input, two output pay to
+pubkey hash transactions and measures the throughput of:
+
+- legacy: the per field struct.pack/unpack and bytes concatenation
+  serializers mininode used before the precompiled struct.Struct core.
+  Appending every transaction to one bytes object is quadratic, so legacy
+  serialize of a 32 MB block takes minutes.
+- mininode: CBlock.serialize() and CBlock.deserialize()
+"""
+
+import argparse
+from io import BytesIO
+import os
+import struct
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from test_framework.mininode import (
+    CBlock,
+    COutPoint,
+    CTransaction,
+    CTxIn,
+    CTxOut,
+)
+
+
+def legacy_ser_compact_size(l):
+    if l < 253:
+        return struct.pack("B", l)
+    elif l < 0x10000:
+        return struct.pack("<BH", 253, l)
+    elif l < 0x100000000:
+        return struct.pack("<BI", 254, l)
+    return struct.pack("<BQ", 255, l)
+
+
+def legacy_deser_compact_size(f):
+    nit = struct.unpack("<B", f.read(1))[0]
+    if nit == 253:
+        nit = struct.unpack("<H", f.read(2))[0]
+    elif nit == 254:
+        nit = struct.unpack("<I", f.read(4))[0]
+    elif nit == 255:
+        nit = struct.unpack("<Q", f.read(8))[0]
+    return nit
+
+
+def legacy_ser_uint256(u):
+    rs = b""
+    for i in range(8):
+        rs += struct.pack("<I", u & 0xFFFFFFFF)
+        u >>= 32
+    return rs
+
+
+def legacy_deser_uint256(f):
+    r = 0
+    for i in range(8):
+        t = struct.unpack("<I", f.read(4))[0]
+        r += t << (i * 32)
+    return r
+
+
+def legacy_ser_tx(tx):
+    r = b""
+    r += struct.pack("<i", tx.nVersion)
+    r += legacy_ser_compact_size(len(tx.vin))
+    for txin in tx.vin:
+        r += legacy_ser_uint256(txin.prevout.hash)
+        r += struct.pack("<I", txin.prevout.n)
+        r += legacy_ser_compact_size(len(txin.scriptSig)) + txin.scriptSig
+        r += struct.pack("<I", txin.nSequence)
+    r += legacy_ser_compact_size(len(tx.vout))
+    for txout in tx.vout:
+        r += struct.pack("<q", txout.nValue)
+        r += legacy_ser_compact_size(len(txout.scriptPubKey)) + txout.scriptPubKey
+    r += struct.pack("<I", tx.nLockTime)
+    return r
+
+
+def legacy_ser_block(block):
+    r = b""
+    r += struct.pack("<i", block.nVersion)
+    r += legacy_ser_uint256(block.hashPrevBlock)
+    r += legacy_ser_uint256(block.hashMerkleRoot)
+    r += struct.pack("<I", block.nTime)
+    r += struct.pack("<I", block.nBits)
+    r += struct.pack("<I", block.nNonce)
+    r += legacy_ser_compact_size(len(block.vtx))
+    for tx in block.vtx:
+        r += legacy_ser_tx(tx)
+    return r
+
+
+def legacy_deser_tx(f):
+    tx = CTransaction()
+    tx.nVersion = struct.unpack("<i", f.read(4))[0]
+    for i in range(legacy_deser_compact_size(f)):
+        txin = CTxIn()
+        txin.prevout.hash = legacy_deser_uint256(f)
+        txin.prevout.n = struct.unpack("<I", f.read(4))[0]
+        txin.scriptSig = f.read(legacy_deser_compact_size(f))
+        txin.nSequence = struct.unpack("<I", f.read(4))[0]
+        tx.vin.append(txin)
+    for i in range(legacy_deser_compact_size(f)):
+        txout = CTxOut()
+        txout.nValue = struct.unpack("<q", f.read(8))[0]
+        txout.scriptPubKey = f.read(legacy_deser_compact_size(f))
+        tx.vout.append(txout)
+    tx.nLockTime = struct.unpack("<I", f.read(4))[0]
+    return tx
+
+
+def legacy_deser_block(data):
+    f = BytesIO(data)
+    block = CBlock()
+    block.nVersion = struct.unpack("<i", f.read(4))[0]
+    block.hashPrevBlock = legacy_deser_uint256(f)
+    block.hashMerkleRoot = legacy_deser_uint256(f)
+    block.nTime = struct.unpack("<I", f.read(4))[0]
+    block.nBits = struct.unpack("<I", f.read(4))[0]
+    block.nNonce = struct.unpack("<I", f.read(4))[0]
+    block.vtx = [legacy_deser_tx(f) for i in range(legacy_deser_compact_size(f))]
+    return block
+
+
+def deser_block(data):
+    block = CBlock()
+    block.deserialize(BytesIO(data))
+    return block
+
+
+def make_block(size):
+    """Returns a block of about size bytes."""
+    block = CBlock()
+    block.hashPrevBlock = 1 << 255
+    block.nBits = 0x207fffff
+    n = 0
+    while n < size:
+        tx = CTransaction()
+        tx.vin.append(CTxIn(COutPoint((n << 128) | 0xabcdef, 1),
+                            b"\x47" + b"\x30" * 71 + b"\x21" + b"\x02" * 33,
+                            0xffffffff))
+        for i in range(2):
+            tx.vout.append(CTxOut(123456789 + i,
+                                  b"\x76\xa9\x14" + b"\xab" * 20 + b"\x88\xac"))
+        block.vtx.append(tx)
+        n += 226
+    return block
+
+
+def bench(name, func, arg, size, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        result = func(arg)
+    elapsed = (time.perf_counter() - start) / iterations
+    print("%-24s %8.3f s  %7.1f MB/s" % (name, elapsed, size / elapsed / 1e6))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=float, default=32, help="block size in MB")
+    parser.add_argument("--iterations", type=int, default=1)
+    args = parser.parse_args()
+
+    block = make_block(int(args.size * 1e6))
+    data = block.serialize()
+    print("block: %.1f MB, %d transactions" % (len(data) / 1e6, len(block.vtx)))
+
+    assert bench("legacy serialize", legacy_ser_block, block, len(data), args.iterations) == data
+    assert bench("mininode serialize", CBlock.serialize, block, len(data), args.iterations) == data
+    assert bench("legacy deserialize", legacy_deser_block, data, len(data), args.iterations).serialize() == data
+    assert bench("mininode deserialize", deser_block, data, len(data), args.iterations).serialize() == data
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# Copyright (c) 2018 The Bitcoin developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Benchmark computing the signature hashes of all inputs of a transaction.
+
+Builds a transaction with many inputs and measures computing the
+SIGHASH_ALL | SIGHASH_FORKID signature hash of every input:
+
+- legacy: hashPrevouts, hashSequence and hashOutputs serialized by bytes
+  concatenation for every input, as SignatureHashForkId did before
+  PrecomputedTransactionData
+- SignatureHashForkId: without txdata, recomputing them for every input
+- txdata: with one PrecomputedTransactionData for the transaction
+
+and the SIGHASH_ALL pre-fork signature hash of every input:
+
+- legacy copy: copying the transaction with CTransaction(txTo), blanking
+  its scriptSigs and serializing it, as SignatureHash did before
+- SignatureHash: writing the modified transaction straight into the hash
+"""
+
+import argparse
+import os
+import struct
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from test_framework.mininode import (
+    COutPoint,
+    CTransaction,
+    CTxIn,
+    CTxOut,
+    hash256,
+    ser_string,
+    ser_uint256,
+    uint256_from_str,
+)
+from test_framework.script import (
+    CScript,
+    OP_CHECKSIG,
+    OP_DUP,
+    OP_EQUALVERIFY,
+    OP_HASH160,
+    OP_CODESEPARATOR,
+    FindAndDelete,
+    PrecomputedTransactionData,
+    SIGHASH_ALL,
+    SIGHASH_FORKID,
+    SignatureHash,
+    SignatureHashForkId,
+)
+
+
+def legacy_sighash(script, txTo, inIdx, hashtype, amount):
+    serialize_prevouts = bytes()
+    for i in txTo.vin:
+        serialize_prevouts += i.prevout.serialize()
+    hashPrevouts = uint256_from_str(hash256(serialize_prevouts))
+    serialize_sequence = bytes()
+    for i in txTo.vin:
+        serialize_sequence += struct.pack("<I", i.nSequence)
+    hashSequence = uint256_from_str(hash256(serialize_sequence))
+    serialize_outputs = bytes()
+    for o in txTo.vout:
+        serialize_outputs += o.serialize()
+    hashOutputs = uint256_from_str(hash256(serialize_outputs))
+
+    ss = bytes()
+    ss += struct.pack("<i", txTo.nVersion)
+    ss += ser_uint256(hashPrevouts)
+    ss += ser_uint256(hashSequence)
+    ss += txTo.vin[inIdx].prevout.serialize()
+    ss += ser_string(script)
+    ss += struct.pack("<q", amount)
+    ss += struct.pack("<I", txTo.vin[inIdx].nSequence)
+    ss += ser_uint256(hashOutputs)
+    ss += struct.pack("<i", txTo.nLockTime)
+    ss += struct.pack("<I", hashtype)
+    return hash256(ss)
+
+
+def legacy_copy_sighash(script, txTo, inIdx, hashtype):
+    txtmp = CTransaction(txTo)
+    for txin in txtmp.vin:
+        txin.scriptSig = b''
+    txtmp.vin[inIdx].scriptSig = FindAndDelete(
+        script, CScript([OP_CODESEPARATOR]))
+    s = txtmp.serialize()
+    s += struct.pack(b"<I", hashtype)
+    return (hash256(s), None)
+
+
+def make_transaction(inputs, outputs):
+    tx = CTransaction()
+    for i in range(inputs):
+        tx.vin.append(CTxIn(COutPoint((i << 128) | 0xabcdef, i % 4), b"", 0xffffffff))
+    for i in range(outputs):
+        tx.vout.append(CTxOut(1000 + i, CScript([OP_DUP, OP_HASH160, b"\xab" * 20, OP_EQUALVERIFY, OP_CHECKSIG])))
+    return tx
+
+
+def bench(name, sighash, tx, script, *args):
+    start = time.perf_counter()
+    hashes = [sighash(script, tx, i, *args) for i in range(len(tx.vin))]
+    elapsed = time.perf_counter() - start
+    print("%-20s %8.3f s  %9.0f inputs/s" % (name, elapsed, len(tx.vin) / elapsed))
+    return hashes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--inputs", type=int, default=1000)
+    parser.add_argument("--outputs", type=int, default=100)
+    args = parser.parse_args()
+
+    tx = make_transaction(args.inputs, args.outputs)
+    script = CScript([OP_DUP, OP_HASH160, b"\xcd" * 20, OP_EQUALVERIFY, OP_CHECKSIG])
+    print("%d inputs, %d outputs" % (args.inputs, args.outputs))
+
+    forkid_args = (SIGHASH_ALL | SIGHASH_FORKID, 5000)
+    hashes = bench("legacy", legacy_sighash, tx, script, *forkid_args)
+    assert bench("SignatureHashForkId", SignatureHashForkId, tx, script, *forkid_args) == hashes
+
+    start = time.perf_counter()
+    txdata = PrecomputedTransactionData(tx)
+    print("%-20s %8.3f s" % ("txdata", time.perf_counter() - start))
+
+    def with_txdata(script, txTo, inIdx, hashtype, amount):
+        return SignatureHashForkId(script, txTo, inIdx, hashtype, amount, txdata)
+    assert bench("txdata per input", with_txdata, tx, script, *forkid_args) == hashes
+
+    # Inputs of the transaction to sign usually have empty scriptSigs, but
+    # SignatureHash must blank them all
+    for txin in tx.vin:
+        txin.scriptSig = b"\x47" + b"\x30" * 71 + b"\x21" + b"\x02" * 33
+    hashes = bench("legacy copy", legacy_copy_sighash, tx, script, SIGHASH_ALL)
+    assert bench("SignatureHash", SignatureHash, tx, script, SIGHASH_ALL) == hashes
+
+
+if __name__ == '__main__':
+    main()
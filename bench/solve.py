@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# Copyright (c) 2018 The Bitcoin developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Benchmark the nonce search of CBlock.solve().
+
+Solves a number of blocks with a target that needs about a million tries on
+average and reports the nonces tried per second by:
+
+- legacy: incrementing nNonce and calling rehash(), as solve() did before
+  the midstate search
+- solve(): the midstate search in this process
+- solve(processes=N): the nonce space split over a pool of N processes
+"""
+
+import argparse
+import copy
+import multiprocessing
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from test_framework.mininode import (
+    CBlock,
+    uint256_from_compact,
+)
+
+
+def legacy_solve(block):
+    block.rehash()
+    target = uint256_from_compact(block.nBits)
+    while block.sha256 > target:
+        block.nNonce += 1
+        block.rehash()
+
+
+def make_blocks(count, nBits):
+    blocks = []
+    for i in range(count):
+        block = CBlock()
+        block.hashPrevBlock = 1 << 255
+        block.hashMerkleRoot = i
+        block.nTime = 1500000000
+        block.nBits = nBits
+        blocks.append(block)
+    return blocks
+
+
+def bench(name, solve, blocks):
+    blocks = copy.deepcopy(blocks)
+    start = time.perf_counter()
+    for block in blocks:
+        solve(block)
+    elapsed = time.perf_counter() - start
+    tries = sum(block.nNonce + 1 for block in blocks)
+    print("%-24s %8.3f s  %9.0f nonces/s" % (name, elapsed, tries / elapsed))
+    return [block.nNonce for block in blocks]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--blocks", type=int, default=4)
+    parser.add_argument("--bits", type=lambda s: int(s, 16), default=0x1e0fffff, help="nBits in hex")
+    parser.add_argument("--processes", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("--skip-legacy", action="store_true")
+    args = parser.parse_args()
+
+    blocks = make_blocks(args.blocks, args.bits)
+    print("%d blocks, nBits %08x, %d cpus" % (args.blocks, args.bits, multiprocessing.cpu_count()))
+    nonces = bench("solve()", CBlock.solve, blocks)
+    if not args.skip_legacy:
+        assert bench("legacy", legacy_solve, blocks) == nonces
+    processes = 2
+    while processes <= args.processes:
+        assert bench("solve(processes=%d)" % processes,
+                     lambda block: block.solve(processes), blocks) == nonces
+        processes *= 2
+
+
+if __name__ == '__main__':
+    main()
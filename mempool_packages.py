@@ -59,11 +59,20 @@ class MempoolPackagesTest(BitcoinTestFramework):
         descendant_fees = 0
         descendant_size = 0
 
+        # Fetch the entry, descendants and ancestors of every transaction
+        # in one pipelined round trip
+        calls = []
+        for x in reversed(chain):
+            calls += [('getmempoolentry', [x]),
+                      ('getmempooldescendants', [x]),
+                      ('getmempoolancestors', [x])]
+        results = self.nodes[0].pipeline(calls)
+
         descendants = []
         ancestors = list(chain)
-        for x in reversed(chain):
+        for i, x in enumerate(reversed(chain)):
+            entry, x_descendants, x_ancestors = results[3 * i:3 * i + 3]
             # Check that getmempoolentry is consistent with getrawmempool
-            entry = self.nodes[0].getmempoolentry(x)
             assert_equal(entry, mempool[x])
 
             # Check that the descendant calculations are correct
@@ -76,14 +85,12 @@ class MempoolPackagesTest(BitcoinTestFramework):
             descendant_count += 1
 
             # Check that getmempooldescendants is correct
-            assert_equal(sorted(descendants), sorted(
-                self.nodes[0].getmempooldescendants(x)))
+            assert_equal(sorted(descendants), sorted(x_descendants))
             descendants.append(x)
 
             # Check that getmempoolancestors is correct
             ancestors.remove(x)
-            assert_equal(sorted(ancestors), sorted(
-                self.nodes[0].getmempoolancestors(x)))
+            assert_equal(sorted(ancestors), sorted(x_ancestors))
 
         # Check that getmempoolancestors/getmempooldescendants correctly handle verbose=true
         v_ancestors = self.nodes[0].getmempoolancestors(chain[-1], True)
@@ -31,20 +31,27 @@ ServiceProxy class:
 - sends Basic HTTP authentication headers
 - parses all JSON numbers that look like floats as Decimal
 - uses standard Python json lib
+- requests to several servers can be made concurrently with asyncio, see
+  AuthServiceProxy.async_request() and gather()
 """
 
+import asyncio
 import base64
 import decimal
 import http.client
 import json
 import logging
 import socket
+import threading
 import time
 import urllib.parse
 import ssl
+import weakref
 
 HTTP_TIMEOUT = 30
 USER_AGENT = "AuthServiceProxy/0.1"
+# Maximum number of concurrent keep-alive connections to one RPC server
+MAX_POOL_CONNECTIONS = 8
 
 log = logging.getLogger("BitcoinRPC")
 
@@ -65,15 +72,416 @@ def EncodeDecimal(o):
     raise TypeError(repr(o) + " is not JSON serializable")
 
 
+class JSONCodec():
+    """Serialises requests to and parses responses from UTF-8 encoded bytes
+    with the json module. JSON numbers that look like floats are parsed as
+    Decimal.
+
+    Other codecs can be plugged in with set_default_codec() or the codec
+    argument of AuthServiceProxy."""
+
+    def dumps(self, obj, ensure_ascii=True):
+        return json.dumps(obj, default=EncodeDecimal, ensure_ascii=ensure_ascii).encode('utf-8')
+
+    def loads(self, data):
+        return json.loads(data, parse_float=decimal.Decimal)
+
+
+class SimpleJSONCodec(JSONCodec):
+    """Parses responses with simplejson's C extension, which builds Decimals
+    without a call back into Python for every number. Requires simplejson
+    to be installed."""
+
+    def __init__(self):
+        import simplejson
+        self.simplejson = simplejson
+
+    def loads(self, data):
+        return self.simplejson.loads(data, use_decimal=True)
+
+
+_default_codec = JSONCodec()
+
+
+def get_default_codec():
+    return _default_codec
+
+
+def set_default_codec(codec):
+    """Set the codec of AuthServiceProxy objects created from now on."""
+    global _default_codec
+    _default_codec = codec
+
+
+class ConnectionPool():
+    """Bounded, thread-safe pool of keep-alive HTTP connections to one server.
+
+    Connections are handed out for one request/response exchange at a time,
+    so several threads can issue RPCs to the same node concurrently."""
+
+    _pools = {}
+    _pools_lock = threading.Lock()
+
+    def __init__(self, scheme, host, port, timeout, maxsize=MAX_POOL_CONNECTIONS, connection=None):
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.maxsize = maxsize
+        self.idle = []
+        self.num_connections = 0
+        self.closed = False
+        self.cond = threading.Condition()
+        if connection is not None:
+            # Only ever use the given connection
+            self.maxsize = 1
+            self.num_connections = 1
+            self.idle.append(connection)
+
+    @classmethod
+    def get_pool(cls, scheme, host, port, timeout):
+        """Return the pool shared by all proxies for this server."""
+        key = (scheme, host, port, timeout)
+        with cls._pools_lock:
+            if key not in cls._pools:
+                cls._pools[key] = cls(scheme, host, port, timeout)
+            return cls._pools[key]
+
+    def get(self):
+        with self.cond:
+            while not self.idle and self.num_connections >= self.maxsize:
+                self.cond.wait()
+            if self.idle:
+                return self.idle.pop()
+            self.num_connections += 1
+        if self.scheme == 'https':
+            return http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout)
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def discard_idle(self):
+        """Close the idle connections, e.g. once the server has restarted."""
+        with self.cond:
+            idle, self.idle = self.idle, []
+            self.num_connections -= len(idle)
+            self.cond.notify_all()
+        for conn in idle:
+            conn.close()
+
+    def close(self):
+        """Remove the pool from get_pool() and close its idle connections,
+        e.g. once the server has stopped. Connections still in use are
+        closed when they are put back."""
+        key = (self.scheme, self.host, self.port, self.timeout)
+        with self._pools_lock:
+            if self._pools.get(key) is self:
+                del self._pools[key]
+        with self.cond:
+            self.closed = True
+        self.discard_idle()
+
+    def put(self, conn, reusable=True):
+        """Return conn to the pool. Connections in an unknown state (e.g.
+        after a timeout) must not be reused and are closed instead."""
+        with self.cond:
+            if reusable and not self.closed:
+                self.idle.append(conn)
+            else:
+                conn.close()
+                self.num_connections -= 1
+            self.cond.notify()
+
+
+class AsyncConnectionPool():
+    """Keep-alive asyncio connections to one server, see gather().
+
+    Connections belong to the event loop which opened them, so every event
+    loop has its own pools; get_pool() returns the one of the running loop."""
+
+    # Pools by event loop, then by server
+    _pools = weakref.WeakKeyDictionary()
+
+    def __init__(self, scheme, host, port, timeout):
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.idle = []
+
+    @classmethod
+    def get_pool(cls, scheme, host, port, timeout):
+        """Return the pool of the running event loop for this server."""
+        pools = cls._pools.setdefault(asyncio.get_running_loop(), {})
+        key = (scheme, host, port, timeout)
+        if key not in pools:
+            pools[key] = cls(scheme, host, port, timeout)
+        return pools[key]
+
+    @classmethod
+    def close_all(cls, loop):
+        """Close the connections of all pools of loop."""
+        for pool in cls._pools.pop(loop, {}).values():
+            for streams in pool.idle:
+                streams[1].close()
+            pool.idle = []
+
+    async def get(self):
+        if self.idle:
+            return self.idle.pop()
+        return await self.connect()
+
+    async def connect(self):
+        ssl_context = None
+        if self.scheme == 'https':
+            ssl_context = ssl._create_unverified_context()
+        return await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port, ssl=ssl_context), self.timeout)
+
+    def put(self, streams, reusable=True):
+        if reusable:
+            self.idle.append(streams)
+        else:
+            streams[1].close()
+
+
+class _AsyncHTTPResponse():
+    """Response read by _read_async_response(), with the subset of the
+    http.client.HTTPResponse interface used by _parse_response()."""
+
+    def __init__(self, status, reason, headers, body):
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+        self.will_close = headers.get('connection', '').lower() == 'close'
+
+    def getheader(self, name, default=None):
+        return self.headers.get(name.lower(), default)
+
+    def read(self):
+        return self.body
+
+
+async def _read_async_response(reader):
+    status_line = await reader.readline()
+    if not status_line:
+        # The server closed the idle keep-alive connection
+        raise ConnectionResetError("connection closed by server")
+    parts = status_line.decode('iso-8859-1').rstrip('\r\n').split(' ', 2)
+    status = int(parts[1])
+    reason = parts[2] if len(parts) > 2 else ''
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, value = line.decode('iso-8859-1').split(':', 1)
+        headers[name.strip().lower()] = value.strip()
+    if 'content-length' in headers:
+        body = await reader.readexactly(int(headers['content-length']))
+    elif headers.get('transfer-encoding', '').lower() == 'chunked':
+        chunks = []
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            if size == 0:
+                # Skip the trailer
+                while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                break
+            chunks.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+        body = b''.join(chunks)
+    else:
+        body = await reader.read()
+        headers['connection'] = 'close'
+    return _AsyncHTTPResponse(status, reason, headers, body)
+
+
+# Event loops running the coroutines passed to gather(), one per thread
+_event_loops = threading.local()
+
+
+def _run_gather(coroutines):
+    loop = getattr(_event_loops, 'loop', None)
+    if loop is None:
+        loop = _event_loops.loop = asyncio.new_event_loop()
+
+    async def gather_all():
+        return await asyncio.gather(*coroutines, return_exceptions=True)
+    return loop.run_until_complete(gather_all())
+
+
+def _run_gather_in_thread(coroutines):
+    """Run coroutines on a new thread with its own event loop, which is
+    closed afterwards."""
+    outcome = []
+
+    def run():
+        try:
+            outcome.append(_run_gather(coroutines))
+        except BaseException as e:
+            outcome.append(e)
+        finally:
+            loop = _event_loops.loop
+            AsyncConnectionPool.close_all(loop)
+            loop.close()
+    thread = threading.Thread(target=run)
+    thread.start()
+    thread.join()
+    if isinstance(outcome[0], BaseException):
+        raise outcome[0]
+    return outcome[0]
+
+
+def gather(coroutines):
+    """Run coroutines, e.g. AuthServiceProxy.async_request() calls to several
+    nodes, concurrently and return their results in order.
+
+    All coroutines run to completion; the first exception raised by any of
+    them is then re-raised.
+
+    Each thread runs the coroutines on an event loop of its own. A thread
+    which is already running an event loop, e.g. a mininode callback or a
+    nested call, can not block on a second one, so there the coroutines run
+    on a helper thread."""
+    coroutines = list(coroutines)
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        results = _run_gather(coroutines)
+    else:
+        results = _run_gather_in_thread(coroutines)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return results
+
+
+class _PipelineFile():
+    """File object shared by the responses read off one pipelined socket.
+
+    HTTPResponse closes its file once a response has been read; this must
+    not close the buffer, which may already hold the following responses."""
+
+    def __init__(self, fp):
+        self.fp = fp
+
+    def __getattr__(self, name):
+        return getattr(self.fp, name)
+
+    def close(self):
+        pass
+
+
+class _PipelineSocket():
+    def __init__(self, fp):
+        self.fp = fp
+
+    def makefile(self, mode):
+        return self.fp
+
+
+class RPCFuture():
+    """Result of one call queued in an RPCBatch, available once the batch
+    has been sent."""
+
+    def __init__(self, method):
+        self.method = method
+        self._response = None
+
+    def done(self):
+        return self._response is not None
+
+    def _set_response(self, response):
+        self._response = response
+
+    def exception(self):
+        """Return the JSONRPCException of a failed call, or None."""
+        try:
+            self.result()
+        except JSONRPCException as e:
+            return e
+        return None
+
+    def result(self):
+        """Return the result of the call, raising JSONRPCException if it
+        failed."""
+        if self._response is None:
+            raise RuntimeError("%s: batch has not been sent" % self.method)
+        return AuthServiceProxy._get_result(self._response)
+
+
+class RPCBatch():
+    """Queues RPCs made through normal attribute syntax and sends them to
+    the server as one JSON-RPC batch request.
+
+    Each queued call returns an RPCFuture. The batch is sent when the with
+    block exits without an exception, or explicitly by send():
+
+        with node.batch() as batch:
+            txs = [batch.getrawtransaction(txid, 1) for txid in txids]
+        txs = [tx.result() for tx in txs]
+    """
+
+    def __init__(self, proxy):
+        self._proxy = proxy
+        self._requests = []
+        self._futures = {}
+
+    def __getattr__(self, name):
+        if name.startswith('__') and name.endswith('__'):
+            # Python internal stuff
+            raise AttributeError
+        rpc = getattr(self._proxy, name)
+
+        def queue(*args, **argsn):
+            request = rpc.get_request(*args, **argsn)
+            future = RPCFuture(name)
+            self._requests.append(request)
+            self._futures[request['id']] = future
+            return future
+        return queue
+
+    def __len__(self):
+        return len(self._requests)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.send()
+
+    def send(self):
+        """Send all queued calls in one HTTP request and resolve their
+        futures. The batch can be reused afterwards."""
+        if not self._requests:
+            return
+        requests, futures = self._requests, self._futures
+        self._requests, self._futures = [], {}
+        responses = self._proxy.batch(requests)
+        if isinstance(responses, dict):
+            # The server rejected the batch as a whole
+            responses = [dict(responses, id=request['id']) for request in requests]
+        for response in responses:
+            future = futures.pop(response['id'], None)
+            if future is not None:
+                future._set_response(response)
+        for future in futures.values():
+            future._set_response({'error': {
+                'code': -343, 'message': 'missing JSON-RPC batch response'}})
+
+
 class AuthServiceProxy():
     __id_count = 0
+    __id_lock = threading.Lock()
 
-    # ensure_ascii: escape unicode as \uXXXX, passed to json.dumps
-    def __init__(self, node_name, service_url, service_name=None, timeout=HTTP_TIMEOUT, connection=None, ensure_ascii=True):
+    # ensure_ascii: escape unicode as \uXXXX, passed to codec.dumps
+    def __init__(self, node_name, service_url, service_name=None, timeout=HTTP_TIMEOUT, connection=None, ensure_ascii=True, codec=None):
         self.__node_name = node_name
         self.__service_url = service_url
         self._service_name = service_name
         self.ensure_ascii = ensure_ascii  # can be toggled on the fly by tests
+        self.codec = get_default_codec() if codec is None else codec
         self.__url = urllib.parse.urlparse(service_url)
         port = 80 if self.__url.port is None else self.__url.port
         user = None if self.__url.username is None else self.__url.username.encode(
@@ -82,17 +490,31 @@ class AuthServiceProxy():
             'utf8')
         authpair = user + b':' + passwd
         self.__auth_header = b'Basic ' + base64.b64encode(authpair)
+        # Serialised once, sent with every request
+        self.__headers = {'Host': self.__url.hostname,
+                          'User-Agent': USER_AGENT,
+                          'Authorization': self.__auth_header,
+                          'Content-type': 'application/json'}
         ssl._create_default_https_context = ssl._create_unverified_context
 
         if connection:
-            # Callables re-use the connection of the original proxy
-            self.__conn = connection
-        elif self.__url.scheme == 'https':
-            self.__conn = http.client.HTTPSConnection(
-                self.__url.hostname, port, timeout=timeout)
+            # Use only the given connection
+            self.__pool = ConnectionPool(self.__url.scheme, self.__url.hostname, port, timeout,
+                                         connection=connection)
         else:
-            self.__conn = http.client.HTTPConnection(
-                self.__url.hostname, port, timeout=timeout)
+            self.__pool = ConnectionPool.get_pool(
+                self.__url.scheme, self.__url.hostname, port, timeout)
+        self.__async_pool_key = (self.__url.scheme, self.__url.hostname, port, timeout)
+
+    def _derive(self, service_url, service_name):
+        """Create a proxy sharing url, headers and connections with this one."""
+        proxy = object.__new__(AuthServiceProxy)
+        proxy.__dict__.update(self.__dict__)
+        if service_url != self.__service_url:
+            proxy.__service_url = service_url
+            proxy.__url = urllib.parse.urlparse(service_url)
+        proxy._service_name = service_name
+        return proxy
 
     def __getattr__(self, name):
         if name.startswith('__') and name.endswith('__'):
@@ -100,52 +522,75 @@ class AuthServiceProxy():
             raise AttributeError
         if self._service_name is not None:
             name = "%s.%s" % (self._service_name, name)
-        return AuthServiceProxy(self.__node_name, self.__service_url, name, connection=self.__conn)
+        return self._derive(self.__service_url, name)
 
     def _request(self, method, path, postdata):
         '''
         Do a HTTP request, with retry if we get disconnected (e.g. due to a timeout).
         This is a workaround for https://bugs.python.org/issue3566 which is fixed in Python 3.5.
         '''
-        headers = {'Host': self.__url.hostname,
-                   'User-Agent': USER_AGENT,
-                   'Authorization': self.__auth_header,
-                   'Content-type': 'application/json'}
+        conn = self.__pool.get()
+        reusable = False
         try:
-            self.__conn.request(method, path, postdata, headers)
-            return self._get_response()
-        except http.client.BadStatusLine as e:
-            if e.line == "''":  # if connection was closed, try again
-                self.__conn.close()
-                self.__conn.request(method, path, postdata, headers)
-                return self._get_response()
-            else:
-                raise
-        except (BrokenPipeError, ConnectionResetError):
-            # Python 3.5+ raises BrokenPipeError instead of BadStatusLine when the connection was reset
-            # ConnectionResetError happens on FreeBSD with Python 3.4
-            self.__conn.close()
-            self.__conn.request(method, path, postdata, headers)
-            return self._get_response()
+            # A pooled keep-alive connection may have been closed by the
+            # server since its last request, e.g. because the node restarted
+            reused = conn.sock is not None
+            try:
+                conn.request(method, path, postdata, self.__headers)
+                response = self._get_response(conn)
+            except http.client.RemoteDisconnected:
+                # The server closed the connection without a response. This
+                # is a BadStatusLine, so it must be handled first.
+                if reused:
+                    # The other idle connections to the server are most
+                    # likely stale too
+                    self.__pool.discard_idle()
+                conn.close()
+                conn.request(method, path, postdata, self.__headers)
+                response = self._get_response(conn)
+            except http.client.BadStatusLine as e:
+                if e.line != "''":  # if connection was closed, try again
+                    raise
+                conn.close()
+                conn.request(method, path, postdata, self.__headers)
+                response = self._get_response(conn)
+            except (BrokenPipeError, ConnectionResetError):
+                # Python 3.5+ raises BrokenPipeError instead of BadStatusLine when the connection was reset
+                # ConnectionResetError happens on FreeBSD with Python 3.4
+                if reused:
+                    self.__pool.discard_idle()
+                conn.close()
+                conn.request(method, path, postdata, self.__headers)
+                response = self._get_response(conn)
+            reusable = True
+            return response
+        finally:
+            self.__pool.put(conn, reusable)
 
     def get_request(self, *args, **argsn):
-        AuthServiceProxy.__id_count += 1
+        with AuthServiceProxy.__id_lock:
+            AuthServiceProxy.__id_count += 1
+            request_id = AuthServiceProxy.__id_count
 
-        log.debug("--%02s--->[%s] %s %s" % (AuthServiceProxy.__id_count, self.__node_name, self._service_name,
-                                   json.dumps(args, default=EncodeDecimal, ensure_ascii=self.ensure_ascii)))
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("--%02s--->[%s] %s %s" % (request_id, self.__node_name, self._service_name,
+                                       json.dumps(args, default=EncodeDecimal, ensure_ascii=self.ensure_ascii)))
         if args and argsn:
             raise ValueError(
                 'Cannot handle both named and positional arguments')
         return {'version': '1.1',
                 'method': self._service_name,
                 'params': args or argsn or [],
-                'id': AuthServiceProxy.__id_count}
+                'id': request_id}
 
     def __call__(self, *args, **argsn):
-        postdata = json.dumps(self.get_request(
-            *args, **argsn), default=EncodeDecimal, ensure_ascii=self.ensure_ascii)
-        response = self._request(
-            'POST', self.__url.path, postdata.encode('utf-8'))
+        postdata = self.codec.dumps(self.get_request(
+            *args, **argsn), ensure_ascii=self.ensure_ascii)
+        response = self._request('POST', self.__url.path, postdata)
+        return self._get_result(response)
+
+    @staticmethod
+    def _get_result(response):
         if response['error'] is not None:
             raise JSONRPCException(response['error'])
         elif 'result' not in response:
@@ -155,22 +600,123 @@ class AuthServiceProxy():
             return response['result']
 
     def batch(self, rpc_call_list):
-        postdata = json.dumps(
-            list(rpc_call_list), default=EncodeDecimal, ensure_ascii=self.ensure_ascii)
-        log.debug("--> " + postdata)
-        return self._request('POST', self.__url.path, postdata.encode('utf-8'))
+        postdata = self.codec.dumps(
+            list(rpc_call_list), ensure_ascii=self.ensure_ascii)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("--> " + postdata.decode('utf-8'))
+        return self._request('POST', self.__url.path, postdata)
+
+    def pipeline(self, calls):
+        """Send several RPCs back to back on one keep-alive connection before
+        reading any response (HTTP/1.1 pipelining).
+
+        calls is a list of (method, params) tuples. Returns the list of
+        results, raising JSONRPCException for the first failed call once all
+        responses have been read."""
+        requests = []
+        for method, params in calls:
+            proxy = self._derive(self.__service_url, method)
+            if isinstance(params, dict):
+                request = proxy.get_request(**params)
+            else:
+                request = proxy.get_request(*params)
+            requests.append(b''.join(self._serialize_request(request)))
+        conn = self.__pool.get()
+        reusable = False
+        try:
+            try:
+                responses, reusable = self._pipeline_exchange(conn, b''.join(requests), len(requests))
+            except (BrokenPipeError, ConnectionResetError):
+                # The server closed the idle keep-alive connection; this
+                # includes http.client.RemoteDisconnected
+                conn.close()
+                responses, reusable = self._pipeline_exchange(conn, b''.join(requests), len(requests))
+        finally:
+            self.__pool.put(conn, reusable)
+        return [self._get_result(response) for response in responses]
+
+    def close(self):
+        """Close the pooled connections to the server, e.g. once the node
+        has stopped. Proxies made afterwards get a new pool."""
+        self.__pool.close()
+
+    async def async_request(self, request):
+        """Coroutine sending a request built by get_request() and returning
+        its result. Must be run through gather()."""
+        head, body = self._serialize_request(request)
+        pool = AsyncConnectionPool.get_pool(*self.__async_pool_key)
+        streams = await pool.get()
+        reusable = False
+        try:
+            try:
+                response, reusable = await self._async_exchange(pool, streams, head + body)
+            except (BrokenPipeError, ConnectionResetError, asyncio.IncompleteReadError):
+                # The server closed the idle keep-alive connection
+                streams[1].close()
+                streams = await pool.connect()
+                response, reusable = await self._async_exchange(pool, streams, head + body)
+        finally:
+            pool.put(streams, reusable)
+        return self._get_result(response)
+
+    async def _async_exchange(self, pool, streams, data):
+        reader, writer = streams
+        req_start_time = time.time()
+        writer.write(data)
+        await writer.drain()
+        try:
+            http_response = await asyncio.wait_for(
+                _read_async_response(reader), pool.timeout)
+        except asyncio.TimeoutError:
+            raise JSONRPCException({
+                'code': -344,
+                'message': '%r RPC took longer than %f seconds. Consider '
+                           'using larger timeout for calls that take '
+                           'longer to return.' % (self._service_name,
+                                                  pool.timeout)})
+        return self._parse_response(http_response, req_start_time), not http_response.will_close
 
-    def _get_response(self):
+    def _pipeline_exchange(self, conn, data, count):
+        """Send data and read count responses off conn. Returns the parsed
+        responses and whether the server keeps the connection open."""
+        if conn.sock is None:
+            conn.connect()
         req_start_time = time.time()
+        conn.sock.sendall(data)
+        fp = _PipelineFile(conn.sock.makefile('rb'))
         try:
-            http_response = self.__conn.getresponse()
+            responses = []
+            for _ in range(count):
+                http_response = http.client.HTTPResponse(
+                    _PipelineSocket(fp), method='POST')
+                http_response.begin()
+                responses.append(self._parse_response(http_response, req_start_time))
+            return responses, not http_response.will_close
+        finally:
+            fp.fp.close()
+
+    def _serialize_request(self, request):
+        body = self.codec.dumps(request, ensure_ascii=self.ensure_ascii)
+        head = "POST %s HTTP/1.1\r\n" % (self.__url.path or '/')
+        head += "".join("%s: %s\r\n" % (k, v.decode('ascii') if isinstance(v, bytes) else v)
+                        for k, v in self.__headers.items())
+        head += "Content-Length: %d\r\n\r\n" % len(body)
+        return head.encode('ascii'), body
+
+    def _get_response(self, conn):
+        req_start_time = time.time()
+        try:
+            http_response = conn.getresponse()
         except socket.timeout as e:
             raise JSONRPCException({
                 'code': -344,
                 'message': '%r RPC took longer than %f seconds. Consider '
                            'using larger timeout for calls that take '
                            'longer to return.' % (self._service_name,
-                                                  self.__conn.timeout)})
+                                                  conn.timeout)})
+        return self._parse_response(http_response, req_start_time)
+
+    def _parse_response(self, http_response, req_start_time):
         if http_response is None:
             raise JSONRPCException({
                 'code': -342, 'message': 'missing HTTP response from server'})
@@ -180,15 +726,20 @@ class AuthServiceProxy():
             raise JSONRPCException({
                 'code': -342, 'message': 'non-JSON HTTP response with \'%i %s\' from server' % (http_response.status, http_response.reason)})
 
-        responsedata = http_response.read().decode('utf8')
-        response = json.loads(responsedata, parse_float=decimal.Decimal)
+        responsedata = http_response.read()
+        response = self.codec.loads(responsedata)
+        if not log.isEnabledFor(logging.DEBUG):
+            # Formatting the log line would cost as much as parsing
+            return response
         elapsed = time.time() - req_start_time
-        if "error" in response and response["error"] is None:
+        if isinstance(response, list):
+            log.debug("<-- [%s][%.6f] %s" % (self.__node_name, elapsed, responsedata.decode('utf8')))
+        elif "error" in response and response["error"] is None:
             log.debug("<-%02s----[%s][%.6f] %s" % (response["id"], self.__node_name, elapsed, json.dumps(
                 response["result"], default=EncodeDecimal, ensure_ascii=self.ensure_ascii)))
         else:
-            log.debug("<=%02s======[%s] [%.6f] %s" % (response["id"], self.__node_name, elapsed, responsedata))
+            log.debug("<=%02s======[%s] [%.6f] %s" % (response["id"], self.__node_name, elapsed, responsedata.decode('utf8')))
         return response
 
     def __truediv__(self, relative_uri):
-        return AuthServiceProxy(self.__node_name, "{}/{}".format(self.__service_url, relative_uri), self._service_name, connection=self.__conn)
+        return self._derive("{}/{}".format(self.__service_url, relative_uri), self._service_name)
@@ -40,14 +40,15 @@ class BlockStore():
             return None
         return value
 
-    # lookup an entry and return it as a CBlock
+    # lookup an entry and return it as a CBlock. Its transactions are only
+    # decoded when vtx is accessed.
     def get_block(self, blockhash):
         ret = None
         serialized_block = self.get(blockhash)
         if serialized_block is not None:
             f = BytesIO(serialized_block)
             ret = CBlock()
-            ret.deserialize(f)
+            ret.deserialize(f, lazy=True)
             ret.calc_sha256()
         return ret
 
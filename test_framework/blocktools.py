@@ -7,7 +7,7 @@
 from .mininode import *
 from .script import CScript, OP_TRUE, OP_CHECKSIG, OP_RETURN, OP_PUSHDATA2, OP_DUP, OP_HASH160, OP_EQUALVERIFY
 from .mininode import CTransaction, CTxOut, CTxIn
-from .util import satoshi_round
+from .util import satoshi_round, send_raw_transactions
 from .txtools import pad_tx
 
 # Create a block (with regtest difficulty)
@@ -125,6 +125,9 @@ def create_confirmed_utxos(node, count, age=101):
     addr2 = node.getnewaddress()
     if iterations <= 0:
         return utxos
+    # One round-trip each to create, sign and send all transactions
+    batch = node.batch()
+    raw_txs = []
     for i in range(iterations):
         t = utxos.pop()
         inputs = []
@@ -132,15 +135,19 @@ def create_confirmed_utxos(node, count, age=101):
         outputs = {}
         outputs[addr1] = satoshi_round(t['amount'] / 2)
         outputs[addr2] = satoshi_round(t['amount'] / 2)
-        raw_tx = node.createrawtransaction(inputs, outputs)
-        ctx = FromHex(CTransaction(), raw_tx)
+        raw_txs.append(batch.createrawtransaction(inputs, outputs))
+    batch.send()
+    signed_txs = []
+    for raw_tx in raw_txs:
+        ctx = FromHex(CTransaction(), raw_tx.result())
         fee = node.calculate_fee(ctx) // 2
         ctx.vout[0].nValue -= fee
         # Due to possible truncation, we go ahead and take another satoshi in
         # fees to ensure the transaction gets through
         ctx.vout[1].nValue -= fee + 1
-        signed_tx = node.signrawtransaction(ToHex(ctx))["hex"]
-        node.sendrawtransaction(signed_tx)
+        signed_txs.append(batch.signrawtransaction(ToHex(ctx)))
+    batch.send()
+    send_raw_transactions(node, [signed_tx.result()["hex"] for signed_tx in signed_txs])
 
     while (node.getmempoolinfo()['size'] > 0):
         node.generate(1)
@@ -164,9 +171,10 @@ def mine_big_block(node, utxos=None):
 
 def send_big_transactions(node, utxos, num, fee_multiplier):
     from .cashaddr import decode
-    txids = []
     padding = "1"*(512*127)
     addrHash = decode(node.getnewaddress())[2]
+    batch = node.batch()
+    signresults = []
 
     for _ in range(num):
         ctx = CTransaction()
@@ -180,8 +188,8 @@ def send_big_transactions(node, utxos, num, fee_multiplier):
                    CScript([OP_DUP, OP_HASH160, addrHash, OP_EQUALVERIFY, OP_CHECKSIG])))
         # Create a proper fee for the transaction to be mined
         ctx.vout[1].nValue -= int(fee_multiplier * node.calculate_fee(ctx))
-        signresult = node.signrawtransaction(
-            ToHex(ctx), None, None, "NONE|FORKID")
-        txid = node.sendrawtransaction(signresult["hex"], True)
-        txids.append(txid)
-    return txids
+        signresults.append(batch.signrawtransaction(
+            ToHex(ctx), None, None, "NONE|FORKID"))
+    batch.send()
+    return send_raw_transactions(
+        node, [signresult.result()["hex"] for signresult in signresults], True)
@@ -19,9 +19,10 @@ TestNode behaves as follows:
 
 from .mininode import *
 from .blockstore import BlockStore, TxStore
-from .util import p2p_port, wait_until
+from .util import p2p_port
 import inspect
 import logging
+import time
 
 logger = logging.getLogger("TestFramework.comptool")
 
@@ -202,32 +203,34 @@ class TestManager():
         self.connections = []
         self.test_nodes = []
 
+    def wait_for_test_nodes(self, predicate, timeout=60, command=None):
+        """Waits until predicate(node) holds for every test node, waking up
+        as soon as a message of type command arrives (see
+        NodeConnCB.wait_for). Each node is checked under its own lock, so
+        deliveries to the others are not held up."""
+        deadline = time.time() + timeout
+        for node in self.test_nodes:
+            node.wait_for(lambda: predicate(node),
+                          timeout=max(0, deadline - time.time()), command=command)
+
     def wait_for_disconnections(self):
-        def disconnected():
-            return all(node.closed for node in self.test_nodes)
-        wait_until(disconnected, timeout=10, lock=mininode_lock)
+        self.wait_for_test_nodes(lambda node: node.closed, timeout=10)
 
     def wait_for_verack(self):
         return all(node.wait_for_verack() for node in self.test_nodes)
 
     def wait_for_pings(self, counter):
-        def received_pongs():
-            return all(node.received_ping_response(counter) for node in self.test_nodes)
-        wait_until(received_pongs, lock=mininode_lock)
+        self.wait_for_test_nodes(
+            lambda node: node.received_ping_response(counter), command="pong")
 
     # sync_blocks: Wait for all connections to request the blockhash given
     # then send get_headers to find out the tip of each node, and synchronize
     # the response by using a ping (and waiting for pong with same nonce).
     def sync_blocks(self, blockhash, num_blocks):
-        def blocks_requested():
-            return all(
-                blockhash in node.block_request_map and node.block_request_map[blockhash]
-                for node in self.test_nodes
-            )
-
-        # --> error if not requested
-        wait_until(blocks_requested, attempts=20 *
-                   num_blocks, lock=mininode_lock)
+        # --> error if not requested within a second per block
+        self.wait_for_test_nodes(
+            lambda node: node.block_request_map.get(blockhash),
+            timeout=num_blocks, command="getdata")
 
         # Send getheaders message
         [c.cb.send_getheaders() for c in self.connections]
@@ -239,16 +242,10 @@ class TestManager():
 
     # Analogous to sync_block (see above)
     def sync_transaction(self, txhash, num_events):
-        # Wait for nodes to request transaction (50ms sleep * 20 tries * num_events)
-        def transaction_requested():
-            return all(
-                txhash in node.tx_request_map and node.tx_request_map[txhash]
-                for node in self.test_nodes
-            )
-
-        # --> error if not requested
-        wait_until(transaction_requested, attempts=20 *
-                   num_events, lock=mininode_lock)
+        # --> error if not requested within a second per event
+        self.wait_for_test_nodes(
+            lambda node: node.tx_request_map.get(txhash),
+            timeout=num_events, command="getdata")
 
         # Get the mempool
         [c.cb.send_mempool() for c in self.connections]
@@ -259,8 +256,9 @@ class TestManager():
         self.ping_counter += 1
 
         # Sort inv responses from each node
-        with mininode_lock:
-            [c.cb.lastInv.sort() for c in self.connections]
+        for c in self.connections:
+            with c.cb.lock:
+                c.cb.lastInv.sort()
 
     # Verify that the tip of each connection all agree with each other, and
     # with the expected outcome (if given)
@@ -49,8 +49,21 @@ class AuthServiceProxyWrapper():
         self._log_call()
         return return_val
 
-    def _log_call(self):
-        rpc_method = self.auth_service_proxy_instance._service_name
+    def pipeline(self, calls):
+        """
+        Delegates to AuthServiceProxy.pipeline, then writes each RPC method
+        called to a file.
+
+        """
+        calls = list(calls)
+        return_val = self.auth_service_proxy_instance.pipeline(calls)
+        for method, _ in calls:
+            self._log_call(method)
+        return return_val
+
+    def _log_call(self, rpc_method=None):
+        if rpc_method is None:
+            rpc_method = self.auth_service_proxy_instance._service_name
 
         if self.coverage_logfile:
             with open(self.coverage_logfile, 'a+', encoding='utf8') as f:
@@ -1,5 +1,14 @@
 # Copyright (c) 2011 Sam Rushing
-"""ECC secp256k1 OpenSSL wrapper.
+"""ECC secp256k1 keys for signing and verifying test transactions.
+
+CECKey delegates the elliptic curve operations to a key backend:
+
+- Secp256k1Backend: libsecp256k1 through ctypes, as built by the Dockerfile
+- PythonBackend: a pure Python implementation, used when libsecp256k1 can
+  not be loaded
+
+Both backends sign with RFC6979 deterministic nonces and always return low-S
+DER signatures, so a key signs a hash identically with either of them.
 
 WARNING: This module does not mlock() secrets; your private keys may end up on
 disk in swap! Use with caution!
@@ -10,197 +19,524 @@ This file is modified from python-bitcoinlib.
 import ctypes
 import ctypes.util
 import hashlib
+import hmac
 import sys
 
-ssl = ctypes.cdll.LoadLibrary(ctypes.util.find_library('ssl') or 'libeay32')
-
-ssl.BN_new.restype = ctypes.c_void_p
-ssl.BN_new.argtypes = []
-
-ssl.BN_bin2bn.restype = ctypes.c_void_p
-ssl.BN_bin2bn.argtypes = [ctypes.c_char_p, ctypes.c_int, ctypes.c_void_p]
-
-ssl.BN_CTX_free.restype = None
-ssl.BN_CTX_free.argtypes = [ctypes.c_void_p]
-
-ssl.BN_CTX_new.restype = ctypes.c_void_p
-ssl.BN_CTX_new.argtypes = []
+SECP256K1_P = 0xFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFEFFFFFC2F
+SECP256K1_G = (0x79BE667EF9DCBBAC55A06295CE870B07029BFCDB2DCE28D959F2815B16F81798,
+               0x483ADA7726A3C4655DA4FBFC0E1108A8FD17B448A68554199C47D08FFB10D4B8)
+SECP256K1_ORDER = 0xFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFEBAAEDCE6AF48A03BBFD25E8CD0364141
+SECP256K1_ORDER_HALF = SECP256K1_ORDER // 2
+# ECParameters naming the curve secp256k1, OID 1.3.132.0.10
+SECP256K1_DER_OID = b'\x06\x05\x2b\x81\x04\x00\x0a'
 
-ssl.ECDH_compute_key.restype = ctypes.c_int
-ssl.ECDH_compute_key.argtypes = [ctypes.c_void_p,
-                                 ctypes.c_int, ctypes.c_void_p, ctypes.c_void_p]
 
-ssl.ECDSA_sign.restype = ctypes.c_int
-ssl.ECDSA_sign.argtypes = [ctypes.c_int, ctypes.c_void_p,
-                           ctypes.c_int, ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p]
+class Secp256k1Backend():
+    """Signs and verifies with libsecp256k1 through ctypes.
 
-ssl.ECDSA_verify.restype = ctypes.c_int
-ssl.ECDSA_verify.argtypes = [ctypes.c_int, ctypes.c_void_p,
-                             ctypes.c_int, ctypes.c_void_p, ctypes.c_int, ctypes.c_void_p]
+    Public keys are kept as parsed secp256k1_pubkey structures. Raises
+    OSError if the library can not be loaded."""
 
-ssl.EC_KEY_free.restype = None
-ssl.EC_KEY_free.argtypes = [ctypes.c_void_p]
+    name = 'secp256k1'
 
-ssl.EC_KEY_new_by_curve_name.restype = ctypes.c_void_p
-ssl.EC_KEY_new_by_curve_name.argtypes = [ctypes.c_int]
+    CONTEXT_VERIFY = (1 << 0) | (1 << 8)
+    CONTEXT_SIGN = (1 << 0) | (1 << 9)
+    EC_COMPRESSED = (1 << 1) | (1 << 8)
+    EC_UNCOMPRESSED = (1 << 1)
 
-ssl.EC_KEY_get0_group.restype = ctypes.c_void_p
-ssl.EC_KEY_get0_group.argtypes = [ctypes.c_void_p]
+    def __init__(self, path=None):
+        path = path or ctypes.util.find_library('secp256k1')
+        if path is None:
+            raise OSError('libsecp256k1 not found')
+        lib = ctypes.cdll.LoadLibrary(path)
 
-ssl.EC_KEY_get0_public_key.restype = ctypes.c_void_p
-ssl.EC_KEY_get0_public_key.argtypes = [ctypes.c_void_p]
+        lib.secp256k1_context_create.restype = ctypes.c_void_p
+        lib.secp256k1_context_create.argtypes = [ctypes.c_uint]
 
-ssl.EC_KEY_set_private_key.restype = ctypes.c_int
-ssl.EC_KEY_set_private_key.argtypes = [ctypes.c_void_p, ctypes.c_void_p]
+        lib.secp256k1_ec_seckey_verify.restype = ctypes.c_int
+        lib.secp256k1_ec_seckey_verify.argtypes = [
+            ctypes.c_void_p, ctypes.c_char_p]
 
-ssl.EC_KEY_set_conv_form.restype = None
-ssl.EC_KEY_set_conv_form.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        lib.secp256k1_ec_pubkey_create.restype = ctypes.c_int
+        lib.secp256k1_ec_pubkey_create.argtypes = [
+            ctypes.c_void_p, ctypes.c_void_p, ctypes.c_char_p]
 
-ssl.EC_KEY_set_public_key.restype = ctypes.c_int
-ssl.EC_KEY_set_public_key.argtypes = [ctypes.c_void_p, ctypes.c_void_p]
+        lib.secp256k1_ec_pubkey_parse.restype = ctypes.c_int
+        lib.secp256k1_ec_pubkey_parse.argtypes = [
+            ctypes.c_void_p, ctypes.c_void_p, ctypes.c_char_p, ctypes.c_size_t]
 
-ssl.i2o_ECPublicKey.restype = ctypes.c_void_p
-ssl.i2o_ECPublicKey.argtypes = [ctypes.c_void_p, ctypes.c_void_p]
+        lib.secp256k1_ec_pubkey_serialize.restype = ctypes.c_int
+        lib.secp256k1_ec_pubkey_serialize.argtypes = [
+            ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p, ctypes.c_uint]
 
-ssl.EC_POINT_new.restype = ctypes.c_void_p
-ssl.EC_POINT_new.argtypes = [ctypes.c_void_p]
+        lib.secp256k1_ec_pubkey_tweak_mul.restype = ctypes.c_int
+        lib.secp256k1_ec_pubkey_tweak_mul.argtypes = [
+            ctypes.c_void_p, ctypes.c_void_p, ctypes.c_char_p]
 
-ssl.EC_POINT_free.restype = None
-ssl.EC_POINT_free.argtypes = [ctypes.c_void_p]
+        lib.secp256k1_ecdsa_sign.restype = ctypes.c_int
+        lib.secp256k1_ecdsa_sign.argtypes = [
+            ctypes.c_void_p, ctypes.c_void_p, ctypes.c_char_p, ctypes.c_char_p,
+            ctypes.c_void_p, ctypes.c_void_p]
 
-ssl.EC_POINT_mul.restype = ctypes.c_int
-ssl.EC_POINT_mul.argtypes = [ctypes.c_void_p, ctypes.c_void_p,
-                             ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p]
+        lib.secp256k1_ecdsa_signature_serialize_der.restype = ctypes.c_int
+        lib.secp256k1_ecdsa_signature_serialize_der.argtypes = [
+            ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p]
 
-# this specifies the curve used with ECDSA.
-NID_secp256k1 = 714  # from openssl/obj_mac.h
+        lib.secp256k1_ecdsa_signature_parse_der.restype = ctypes.c_int
+        lib.secp256k1_ecdsa_signature_parse_der.argtypes = [
+            ctypes.c_void_p, ctypes.c_void_p, ctypes.c_char_p, ctypes.c_size_t]
 
-SECP256K1_ORDER = 0xFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFEBAAEDCE6AF48A03BBFD25E8CD0364141
-SECP256K1_ORDER_HALF = SECP256K1_ORDER // 2
+        lib.secp256k1_ecdsa_signature_normalize.restype = ctypes.c_int
+        lib.secp256k1_ecdsa_signature_normalize.argtypes = [
+            ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p]
 
-# Thx to Sam Devlin for the ctypes magic 64-bit fix.
+        lib.secp256k1_ecdsa_verify.restype = ctypes.c_int
+        lib.secp256k1_ecdsa_verify.argtypes = [
+            ctypes.c_void_p, ctypes.c_void_p, ctypes.c_char_p, ctypes.c_void_p]
 
+        self.lib = lib
+        self.ctx = lib.secp256k1_context_create(
+            self.CONTEXT_SIGN | self.CONTEXT_VERIFY)
 
-def _check_result(val, func, args):
-    if val == 0:
-        raise ValueError
-    else:
-        return ctypes.c_void_p(val)
-
-
-ssl.EC_KEY_new_by_curve_name.restype = ctypes.c_void_p
-ssl.EC_KEY_new_by_curve_name.errcheck = _check_result
+    def create_pubkey(self, secret):
+        pubkey = ctypes.create_string_buffer(64)
+        if not self.lib.secp256k1_ec_pubkey_create(self.ctx, pubkey, secret):
+            raise ValueError(
+                "Could not derive public key from the supplied secret.")
+        return pubkey
+
+    def parse_pubkey(self, data):
+        pubkey = ctypes.create_string_buffer(64)
+        if not self.lib.secp256k1_ec_pubkey_parse(self.ctx, pubkey, data, len(data)):
+            return None
+        return pubkey
+
+    def serialize_pubkey(self, pubkey, compressed):
+        output = ctypes.create_string_buffer(65)
+        size = ctypes.c_size_t(65)
+        self.lib.secp256k1_ec_pubkey_serialize(
+            self.ctx, output, ctypes.byref(size), pubkey,
+            self.EC_COMPRESSED if compressed else self.EC_UNCOMPRESSED)
+        return output.raw[:size.value]
+
+    def sign(self, secret, hash):
+        return self.sign_many(secret, [hash])[0]
+
+    def sign_many(self, secret, hashes):
+        lib, ctx = self.lib, self.ctx
+        sig = ctypes.create_string_buffer(64)
+        output = ctypes.create_string_buffer(72)
+        size = ctypes.c_size_t()
+        sigs = []
+        for hash in hashes:
+            # A NULL nonce function selects RFC6979, which always gives a
+            # low-S signature
+            if not lib.secp256k1_ecdsa_sign(ctx, sig, hash, secret, None, None):
+                raise ValueError('secp256k1_ecdsa_sign failed')
+            size.value = 72
+            lib.secp256k1_ecdsa_signature_serialize_der(
+                ctx, output, ctypes.byref(size), sig)
+            sigs.append(output.raw[:size.value])
+        return sigs
+
+    def verify(self, pubkey, hash, sig):
+        return self.verify_many(pubkey, [hash], [sig])[0]
+
+    def verify_many(self, pubkey, hashes, sigs):
+        lib, ctx = self.lib, self.ctx
+        parsed = ctypes.create_string_buffer(64)
+        results = []
+        for hash, sig in zip(hashes, sigs):
+            if not lib.secp256k1_ecdsa_signature_parse_der(ctx, parsed, sig, len(sig)):
+                results.append(False)
+                continue
+            # Like OpenSSL, accept high-S signatures
+            lib.secp256k1_ecdsa_signature_normalize(ctx, parsed, parsed)
+            results.append(
+                lib.secp256k1_ecdsa_verify(ctx, parsed, hash, pubkey) == 1)
+        return results
+
+    def ecdh(self, secret, pubkey):
+        point = ctypes.create_string_buffer(pubkey.raw, 64)
+        if not self.lib.secp256k1_ec_pubkey_tweak_mul(self.ctx, point, secret):
+            raise ValueError('secp256k1_ec_pubkey_tweak_mul failed')
+        return self.serialize_pubkey(point, True)[1:]
+
+
+# Points are Jacobian (X, Y, Z) tuples, the point at infinity is None.
+
+def _jacobian_double(p):
+    if p is None or p[1] == 0:
+        return None
+    P = SECP256K1_P
+    X, Y, Z = p
+    YY = Y * Y % P
+    S = 4 * X * YY % P
+    M = 3 * X * X % P
+    X3 = (M * M - 2 * S) % P
+    return (X3, (M * (S - X3) - 8 * YY * YY) % P, 2 * Y * Z % P)
+
+
+def _jacobian_add(p, q):
+    if p is None:
+        return q
+    if q is None:
+        return p
+    P = SECP256K1_P
+    X1, Y1, Z1 = p
+    X2, Y2, Z2 = q
+    Z1Z1 = Z1 * Z1 % P
+    Z2Z2 = Z2 * Z2 % P
+    U1 = X1 * Z2Z2 % P
+    S1 = Y1 * Z2 * Z2Z2 % P
+    H = (X2 * Z1Z1 - U1) % P
+    R = (Y2 * Z1 * Z1Z1 - S1) % P
+    if H == 0:
+        return _jacobian_double(p) if R == 0 else None
+    HH = H * H % P
+    HHH = H * HH % P
+    V = U1 * HH % P
+    X3 = (R * R - HHH - 2 * V) % P
+    return (X3, (R * (V - X3) - S1 * HHH) % P, Z1 * Z2 * H % P)
+
+
+def _to_affine(p):
+    P = SECP256K1_P
+    X, Y, Z = p
+    zinv = pow(Z, P - 2, P)
+    zinv2 = zinv * zinv % P
+    return (X * zinv2 % P, Y * zinv2 * zinv % P)
+
+
+def _window_table(p):
+    """Returns [None, p, 2p, ..., 15p] for _window_mul."""
+    table = [None, p]
+    for i in range(14):
+        table.append(_jacobian_add(table[-1], p))
+    return table
+
+
+def _window_mul(table, k):
+    """Multiplies the point of table by k, four bits at a time."""
+    r = None
+    for shift in range(252, -4, -4):
+        r = _jacobian_double(_jacobian_double(
+            _jacobian_double(_jacobian_double(r))))
+        r = _jacobian_add(r, table[(k >> shift) & 15])
+    return r
+
+
+_generator_tables = []
+
+
+def _generator_mul(k):
+    """Multiplies G by k with no doublings, from a table of d * 16**i * G for
+    every digit d and nibble position i, built on first use."""
+    if not _generator_tables:
+        base = SECP256K1_G + (1,)
+        for i in range(64):
+            _generator_tables.append(
+                [p and _to_affine(p) + (1,) for p in _window_table(base)])
+            for j in range(4):
+                base = _jacobian_double(base)
+    r = None
+    for table in _generator_tables:
+        r = _jacobian_add(r, table[k & 15])
+        k >>= 4
+    return r
+
+
+def _rfc6979_nonces(secret, hash):
+    """Yields the RFC6979 HMAC-SHA256 nonces for secret and hash, the way
+    libsecp256k1's default nonce function generates them."""
+    def mac(key, data):
+        return hmac.new(key, data, hashlib.sha256).digest()
+    K = mac(b'\x00' * 32, b'\x01' * 32 + b'\x00' + secret + hash)
+    V = mac(K, b'\x01' * 32)
+    K = mac(K, V + b'\x01' + secret + hash)
+    V = mac(K, V)
+    while True:
+        V = mac(K, V)
+        k = int.from_bytes(V, 'big')
+        if 0 < k < SECP256K1_ORDER:
+            yield k
+        K = mac(K, V + b'\x00')
+        V = mac(K, V)
+
+
+def _ser_der_int(v):
+    # One more byte than needed for the bits keeps the sign bit clear
+    b = v.to_bytes((v.bit_length() + 8) // 8, 'big')
+    return b'\x02' + bytes([len(b)]) + b
+
+
+def _ser_der_sig(r, s):
+    r = _ser_der_int(r)
+    s = _ser_der_int(s)
+    return b'\x30' + bytes([len(r) + len(s)]) + r + s
+
+
+def _deser_der_sig(sig):
+    """Returns (r, s) of a DER signature, or None if it is malformed."""
+    if len(sig) < 8 or sig[0] != 0x30 or sig[1] != len(sig) - 2 or sig[2] != 2:
+        return None
+    r_size = sig[3]
+    if r_size == 0 or 6 + r_size >= len(sig) or sig[4 + r_size] != 2:
+        return None
+    s_size = sig[5 + r_size]
+    if s_size == 0 or 6 + r_size + s_size != len(sig):
+        return None
+    return (int.from_bytes(sig[4:4 + r_size], 'big'),
+            int.from_bytes(sig[6 + r_size:], 'big'))
+
+
+def _deser_der_privkey(key):
+    """Returns (secret, compressed) of a DER SEC1 ECPrivateKey, or None if
+    it is malformed. compressed is None if key holds no public key."""
+    def read(pos, end):
+        # Returns the tag, start and end of the contents of an element
+        if pos + 2 > end:
+            return None
+        tag, size = key[pos], key[pos + 1]
+        pos += 2
+        if size & 0x80:
+            n = size & 0x7f
+            if not 0 < n <= 2 or pos + n > end:
+                return None
+            size = int.from_bytes(key[pos:pos + n], 'big')
+            pos += n
+        if pos + size > end:
+            return None
+        return tag, pos, pos + size
+
+    seq = read(0, len(key))
+    if seq is None or seq[0] != 0x30:
+        return None
+    version = read(seq[1], seq[2])
+    if version is None or key[version[1]:version[2]] != b'\x01':
+        return None
+    secret = read(version[2], seq[2])
+    if secret is None or secret[0] != 0x04 or not 0 < secret[2] - secret[1] <= 32:
+        return None
+    compressed = None
+    pos = secret[2]
+    while pos < seq[2]:
+        element = read(pos, seq[2])
+        if element is None:
+            return None
+        if element[0] == 0xa1:
+            # [1] BIT STRING: no unused bits, then the encoded point
+            point = key[element[1] + 3:element[2]]
+            compressed = len(point) == 33
+        pos = element[2]
+    return key[secret[1]:secret[2]].rjust(32, b'\x00'), compressed
+
+
+class PythonBackend():
+    """Signs and verifies in pure Python.
+
+    Public keys are kept as affine (x, y) tuples. Much slower than
+    Secp256k1Backend, but needs no library at all."""
+
+    name = 'python'
+
+    def create_pubkey(self, secret):
+        d = int.from_bytes(secret, 'big')
+        if not 0 < d < SECP256K1_ORDER:
+            raise ValueError(
+                "Could not derive public key from the supplied secret.")
+        return _to_affine(_generator_mul(d))
+
+    def parse_pubkey(self, data):
+        P = SECP256K1_P
+        if len(data) == 33 and data[0] in (2, 3):
+            x = int.from_bytes(data[1:], 'big')
+            if x >= P:
+                return None
+            yy = (x * x * x + 7) % P
+            y = pow(yy, (P + 1) // 4, P)
+            if y * y % P != yy:
+                return None
+            if y & 1 != data[0] & 1:
+                y = P - y
+            return (x, y)
+        if len(data) == 65 and data[0] in (4, 6, 7):
+            x = int.from_bytes(data[1:33], 'big')
+            y = int.from_bytes(data[33:], 'big')
+            if x >= P or y >= P or (y * y - x * x * x - 7) % P != 0:
+                return None
+            if data[0] != 4 and y & 1 != data[0] & 1:
+                return None
+            return (x, y)
+        return None
+
+    def serialize_pubkey(self, pubkey, compressed):
+        x, y = pubkey
+        if compressed:
+            return bytes([2 + (y & 1)]) + x.to_bytes(32, 'big')
+        return b'\x04' + x.to_bytes(32, 'big') + y.to_bytes(32, 'big')
+
+    def sign(self, secret, hash):
+        n = SECP256K1_ORDER
+        d = int.from_bytes(secret, 'big')
+        z = int.from_bytes(hash, 'big') % n
+        for k in _rfc6979_nonces(secret, hash):
+            r = _to_affine(_generator_mul(k))[0] % n
+            s = pow(k, n - 2, n) * (z + r * d) % n
+            if r != 0 and s != 0:
+                break
+        if s > SECP256K1_ORDER_HALF:
+            s = n - s
+        return _ser_der_sig(r, s)
+
+    def sign_many(self, secret, hashes):
+        return [self.sign(secret, hash) for hash in hashes]
+
+    def verify(self, pubkey, hash, sig):
+        return self.verify_many(pubkey, [hash], [sig])[0]
+
+    def verify_many(self, pubkey, hashes, sigs):
+        n = SECP256K1_ORDER
+        table = _window_table(pubkey + (1,))
+        results = []
+        for hash, sig in zip(hashes, sigs):
+            rs = _deser_der_sig(sig)
+            if rs is None or not (0 < rs[0] < n and 0 < rs[1] < n):
+                results.append(False)
+                continue
+            r, s = rs
+            w = pow(s, n - 2, n)
+            u1 = int.from_bytes(hash, 'big') * w % n
+            R = _jacobian_add(_generator_mul(u1), _window_mul(table, r * w % n))
+            results.append(R is not None and _to_affine(R)[0] % n == r)
+        return results
+
+    def ecdh(self, secret, pubkey):
+        p = _window_mul(_window_table(pubkey + (1,)),
+                        int.from_bytes(secret, 'big'))
+        return _to_affine(p)[0].to_bytes(32, 'big')
+
+
+def _load_default_backend():
+    try:
+        return Secp256k1Backend()
+    except (OSError, AttributeError):
+        # AttributeError: a libsecp256k1 lacking one of the functions
+        return PythonBackend()
+
+
+_default_backend = _load_default_backend()
+
+
+def get_default_backend():
+    return _default_backend
+
+
+def set_default_backend(backend):
+    """Set the backend of CECKey objects created from now on."""
+    global _default_backend
+    _default_backend = backend
 
 
 class CECKey():
-    """Wrapper around OpenSSL's EC_KEY"""
+    """A secp256k1 key, backed by a Secp256k1Backend or PythonBackend"""
 
-    POINT_CONVERSION_COMPRESSED = 2
-    POINT_CONVERSION_UNCOMPRESSED = 4
-
-    def __init__(self):
-        self.k = ssl.EC_KEY_new_by_curve_name(NID_secp256k1)
-
-    def __del__(self):
-        if ssl:
-            ssl.EC_KEY_free(self.k)
-        self.k = None
+    def __init__(self, backend=None):
+        self.backend = get_default_backend() if backend is None else backend
+        self.secret = None
+        self.pubkey = None
+        self.compressed = False
 
     def set_secretbytes(self, secret):
-        priv_key = ssl.BN_bin2bn(secret, 32, ssl.BN_new())
-        group = ssl.EC_KEY_get0_group(self.k)
-        pub_key = ssl.EC_POINT_new(group)
-        ctx = ssl.BN_CTX_new()
-        if not ssl.EC_POINT_mul(group, pub_key, priv_key, None, None, ctx):
-            raise ValueError(
-                "Could not derive public key from the supplied secret.")
-        ssl.EC_POINT_mul(group, pub_key, priv_key, None, None, ctx)
-        ssl.EC_KEY_set_private_key(self.k, priv_key)
-        ssl.EC_KEY_set_public_key(self.k, pub_key)
-        ssl.EC_POINT_free(pub_key)
-        ssl.BN_CTX_free(ctx)
-        return self.k
+        # Secrets are 32 bytes; shorter ones, like the passphrases of the
+        # tests, are padded with zeros.
+        secret = secret[:32].ljust(32, b'\x00')
+        self.pubkey = self.backend.create_pubkey(secret)
+        self.secret = secret
 
     def set_privkey(self, key):
-        self.mb = ctypes.create_string_buffer(key)
-        return ssl.d2i_ECPrivateKey(ctypes.byref(self.k), ctypes.byref(ctypes.pointer(self.mb)), len(key))
+        """Sets the key from a DER SEC1 ECPrivateKey as get_privkey() or
+        OpenSSL return it. Returns whether key could be decoded."""
+        privkey = _deser_der_privkey(key)
+        if privkey is None:
+            return False
+        secret, compressed = privkey
+        try:
+            self.set_secretbytes(secret)
+        except ValueError:
+            return False
+        if compressed is not None:
+            self.compressed = compressed
+        return True
 
     def set_pubkey(self, key):
-        self.mb = ctypes.create_string_buffer(key)
-        return ssl.o2i_ECPublicKey(ctypes.byref(self.k), ctypes.byref(ctypes.pointer(self.mb)), len(key))
+        self.secret = None
+        self.pubkey = self.backend.parse_pubkey(key)
+        return self.pubkey is not None
 
     def get_privkey(self):
-        size = ssl.i2d_ECPrivateKey(self.k, 0)
-        mb_pri = ctypes.create_string_buffer(size)
-        ssl.i2d_ECPrivateKey(self.k, ctypes.byref(ctypes.pointer(mb_pri)))
-        return mb_pri.raw
+        """Returns the key as a DER SEC1 ECPrivateKey with the named curve
+        and the public key, like OpenSSL's i2d_ECPrivateKey()."""
+        point = b'\x00' + self.get_pubkey()
+        pubkey = b'\x03' + bytes([len(point)]) + point
+        body = (b'\x02\x01\x01' + b'\x04\x20' + self.secret +
+                b'\xa0' + bytes([len(SECP256K1_DER_OID)]) + SECP256K1_DER_OID +
+                b'\xa1' + bytes([len(pubkey)]) + pubkey)
+        return b'\x30' + bytes([len(body)]) + body
 
     def get_pubkey(self):
-        size = ssl.i2o_ECPublicKey(self.k, 0)
-        mb = ctypes.create_string_buffer(size)
-        ssl.i2o_ECPublicKey(self.k, ctypes.byref(ctypes.pointer(mb)))
-        return mb.raw
+        return self.backend.serialize_pubkey(self.pubkey, self.compressed)
 
     def get_raw_ecdh_key(self, other_pubkey):
-        ecdh_keybuffer = ctypes.create_string_buffer(32)
-        r = ssl.ECDH_compute_key(ctypes.pointer(ecdh_keybuffer), 32,
-                                 ssl.EC_KEY_get0_public_key(other_pubkey.k),
-                                 self.k, 0)
-        if r != 32:
-            raise Exception('CKey.get_ecdh_key(): ECDH_compute_key() failed')
-        return ecdh_keybuffer.raw
+        pubkey = other_pubkey.pubkey
+        if other_pubkey.backend is not self.backend:
+            # Each backend keeps public keys in its own representation
+            pubkey = self.backend.parse_pubkey(
+                other_pubkey.backend.serialize_pubkey(pubkey, True))
+        return self.backend.ecdh(self.secret, pubkey)
 
     def get_ecdh_key(self, other_pubkey, kdf=lambda k: hashlib.sha256(k).digest()):
         # FIXME: be warned it's not clear what the kdf should be as a default
         r = self.get_raw_ecdh_key(other_pubkey)
         return kdf(r)
 
-    def sign(self, hash, low_s=True):
-        # FIXME: need unit tests for below cases
+    def _check_hash(self, hash):
         if not isinstance(hash, bytes):
             raise TypeError('Hash must be bytes instance; got %r' %
                             hash.__class__)
         if len(hash) != 32:
             raise ValueError('Hash must be exactly 32 bytes long')
 
-        sig_size0 = ctypes.c_uint32()
-        sig_size0.value = ssl.ECDSA_size(self.k)
-        mb_sig = ctypes.create_string_buffer(sig_size0.value)
-        result = ssl.ECDSA_sign(0, hash, len(
-            hash), mb_sig, ctypes.byref(sig_size0), self.k)
-        assert 1 == result
-        assert mb_sig.raw[0] == 0x30
-        assert mb_sig.raw[1] == sig_size0.value - 2
-        total_size = mb_sig.raw[1]
-        assert mb_sig.raw[2] == 2
-        r_size = mb_sig.raw[3]
-        assert mb_sig.raw[4 + r_size] == 2
-        s_size = mb_sig.raw[5 + r_size]
-        s_value = int.from_bytes(
-            mb_sig.raw[6 + r_size:6 + r_size + s_size], byteorder='big')
-        if (not low_s) or s_value <= SECP256K1_ORDER_HALF:
-            return mb_sig.raw[:sig_size0.value]
-        else:
-            low_s_value = SECP256K1_ORDER - s_value
-            low_s_bytes = (low_s_value).to_bytes(33, byteorder='big')
-            while len(low_s_bytes) > 1 and low_s_bytes[0] == 0 and low_s_bytes[1] < 0x80:
-                low_s_bytes = low_s_bytes[1:]
-            new_s_size = len(low_s_bytes)
-            new_total_size_byte = (
-                total_size + new_s_size - s_size).to_bytes(1, byteorder='big')
-            new_s_size_byte = (new_s_size).to_bytes(1, byteorder='big')
-            return b'\x30' + new_total_size_byte + mb_sig.raw[2:5 + r_size] + new_s_size_byte + low_s_bytes
+    def sign(self, hash, low_s=True):
+        """Returns a DER signature of hash. It is low-S, or with low_s=False
+        high-S, e.g. to test that nodes reject those."""
+        self._check_hash(hash)
+        sig = self.backend.sign(self.secret, hash)
+        if low_s:
+            return sig
+        r, s = _deser_der_sig(sig)
+        return _ser_der_sig(r, SECP256K1_ORDER - s)
+
+    def sign_many(self, hashes):
+        """Returns the DER signatures of a list of hashes."""
+        for hash in hashes:
+            self._check_hash(hash)
+        return self.backend.sign_many(self.secret, hashes)
 
     def verify(self, hash, sig):
         """Verify a DER signature"""
-        return ssl.ECDSA_verify(0, hash, len(hash), sig, len(sig), self.k) == 1
+        if self.pubkey is None:
+            return False
+        return self.backend.verify(self.pubkey, hash, sig)
+
+    def verify_many(self, hashes, sigs):
+        """Verify a DER signature for each hash, returns a list of bools"""
+        if self.pubkey is None:
+            return [False] * len(hashes)
+        return self.backend.verify_many(self.pubkey, hashes, sigs)
 
     def set_compressed(self, compressed):
-        if compressed:
-            form = self.POINT_CONVERSION_COMPRESSED
-        else:
-            form = self.POINT_CONVERSION_UNCOMPRESSED
-        ssl.EC_KEY_set_conv_form(self.k, form)
+        self.compressed = compressed
 
 
 class CPubKey(bytes):
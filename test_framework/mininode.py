@@ -12,6 +12,7 @@ found in the mini-node branch of http://github.com/jgarzik/pynode.
 NodeConn: an object which manages p2p connectivity to a bitcoin node
 NodeConnCB: a base class that describes the interface for receiving
             callbacks with network messages from a NodeConn
+NetworkThread: runs the asyncio event loop of all NodeConns
 CBlock, CTransaction, CBlockHeader, CTxIn, CTxOut, etc....:
     data structures that should map to corresponding structures in
     bitcoin/primitives
@@ -20,19 +21,21 @@ msg_block, msg_tx, msg_headers, etc.:
 ser_*, deser_*: functions that handle serialization/deserialization
 """
 
-import asyncore
-from codecs import encode
-from collections import defaultdict
+import asyncio
+import atexit
+from collections import defaultdict, deque
+from contextlib import contextmanager
 import copy
 import hashlib
 from io import BytesIO
 import logging
+import multiprocessing
 import random
 import socket
 import struct
 import sys
 import time
-from threading import RLock, Thread
+from threading import Condition, Lock, RLock, Thread, get_ident
 
 from test_framework.siphash import siphash256
 from test_framework.cdefs import MAX_BLOCK_SIGOPS_PER_MB
@@ -55,23 +58,119 @@ NODE_WITNESS = (1 << 3)
 NODE_XTHIN = (1 << 4)
 NODE_BITCOIN_CASH = (1 << 5)
 
-# Howmuch data will be read from the network at once
+# Minimum amount of free space in the receive buffer for each read from the
+# network
 READ_BUFFER_SIZE = 8192
+# An idle receive buffer larger than this is released after a big message
+MAX_IDLE_RECV_BUFFER = 1024 * 1024
+# Largest message payload accepted from a node; a larger length in a header
+# is a protocol error. Leaves room for the 100 MB blocks of
+# abc-p2p-fullblocktest.
+MAX_PROTOCOL_MESSAGE_LENGTH = 256 * 1024 * 1024
+# Queued frames are joined into one transport write up to payloads of this
+# size. Larger payloads are written on their own, so they are not copied.
+MAX_COALESCED_PAYLOAD = 64 * 1024
 
 logger = logging.getLogger("TestFramework.mininode")
 
-# Keep our own socket map for asyncore, so that we can track disconnects
-# ourselves (to workaround an issue with closing an asyncore socket when
-# using select)
+# All open NodeConns. The network thread runs while this is not empty.
 mininode_socket_map = dict()
 
-# One lock for synchronizing all data access between the networking thread (see
-# NetworkThread below) and the thread running the test logic.  For simplicity,
-# NodeConn acquires this lock whenever delivering a message to a NodeConnCB,
-# and whenever adding anything to the send buffer (in send_message()).  This
-# lock should be acquired in the thread running the test logic to synchronize
-# access to any data shared with the NodeConnCB or NodeConn.
-mininode_lock = RLock()
+# Event loop of the running NetworkThread and its thread id, or None.
+# network_lock guards these and mininode_socket_map.
+network_loop = None
+network_thread_id = None
+network_lock = RLock()
+
+
+class MininodeLock():
+    """Compatibility shim for the former global lock of all connections.
+
+    Message delivery holds this lock shared, besides the lock of the
+    NodeConnCB it delivers to. Holding it in the thread running the test
+    logic therefore still keeps every NodeConnCB from receiving messages, as
+    test scripts expect. Framework code waits on NodeConnCB.lock instead,
+    which does not hold up delivery to other connections.
+
+    Acquire this lock before any NodeConnCB.lock. A thread may acquire it
+    again while it holds it, shared or not, but the shared holders of the
+    other threads must release it first."""
+
+    def __init__(self):
+        self._cond = Condition(Lock())
+        self._owner = None
+        self._count = 0
+        self._shared = defaultdict(int)
+        self._waiting = 0
+
+    def _exclusive_free(self, me):
+        return self._owner is None and all(t == me for t in self._shared)
+
+    def acquire(self, blocking=True, timeout=-1):
+        me = get_ident()
+        with self._cond:
+            if self._owner == me:
+                self._count += 1
+                return True
+            self._waiting += 1
+            try:
+                if not blocking:
+                    timeout = 0
+                if not self._cond.wait_for(lambda: self._exclusive_free(me),
+                                           None if timeout < 0 else timeout):
+                    return False
+            finally:
+                self._waiting -= 1
+            self._owner = me
+            self._count = 1
+            return True
+
+    def release(self):
+        with self._cond:
+            assert self._owner == get_ident(), "lock not held"
+            self._count -= 1
+            if self._count == 0:
+                self._owner = None
+                self._cond.notify_all()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+    def acquire_shared(self):
+        me = get_ident()
+        with self._cond:
+            # Waiting exclusive holders go first, unless this thread already
+            # holds the lock
+            self._cond.wait_for(lambda: self._owner == me or me in self._shared or
+                                (self._owner is None and not self._waiting))
+            self._shared[me] += 1
+
+    def release_shared(self):
+        me = get_ident()
+        with self._cond:
+            self._shared[me] -= 1
+            if self._shared[me] == 0:
+                del self._shared[me]
+                self._cond.notify_all()
+
+    @contextmanager
+    def shared(self):
+        self.acquire_shared()
+        try:
+            yield
+        finally:
+            self.release_shared()
+
+
+# Held shared whenever a NodeConn delivers a message to its NodeConnCB. Test
+# logic may hold it to synchronize access to the state of several
+# NodeConnCBs, or to data shared with their callbacks, at once; a single
+# NodeConnCB is better synchronized with its own lock.
+mininode_lock = MininodeLock()
 
 # Serialization/deserialization tools
 
@@ -88,27 +187,50 @@ def hash256(s):
     return sha256(sha256(s))
 
 
+# Precompiled little endian integer formats of the wire protocol
+_int8 = struct.Struct("<b")
+_uint8 = struct.Struct("<B")
+_uint16 = struct.Struct("<H")
+_int32 = struct.Struct("<i")
+_uint32 = struct.Struct("<I")
+_int64 = struct.Struct("<q")
+_uint64 = struct.Struct("<Q")
+# Port numbers are big endian
+_port = struct.Struct(">H")
+_compact_uint16 = struct.Struct("<BH")
+_compact_uint32 = struct.Struct("<BI")
+_compact_uint64 = struct.Struct("<BQ")
+# nVersion, hashPrevBlock, hashMerkleRoot, nTime, nBits, nNonce
+_block_header = struct.Struct("<i32s32sIII")
+# hash, n
+_outpoint = struct.Struct("<32sI")
+# announce, version
+_sendcmpct = struct.Struct("<?Q")
+
+_UINT256_MASK = (1 << 256) - 1
+
+
 def ser_compact_size(l):
-    r = b""
     if l < 253:
-        r = struct.pack("B", l)
+        return _uint8.pack(l)
     elif l < 0x10000:
-        r = struct.pack("<BH", 253, l)
+        return _compact_uint16.pack(253, l)
     elif l < 0x100000000:
-        r = struct.pack("<BI", 254, l)
+        return _compact_uint32.pack(254, l)
     else:
-        r = struct.pack("<BQ", 255, l)
-    return r
+        return _compact_uint64.pack(255, l)
 
 
 def deser_compact_size(f):
-    nit = struct.unpack("<B", f.read(1))[0]
-    if nit == 253:
-        nit = struct.unpack("<H", f.read(2))[0]
+    nit = _uint8.unpack(f.read(1))[0]
+    if nit < 253:
+        return nit
+    elif nit == 253:
+        nit = _uint16.unpack(f.read(2))[0]
     elif nit == 254:
-        nit = struct.unpack("<I", f.read(4))[0]
+        nit = _uint32.unpack(f.read(4))[0]
     elif nit == 255:
-        nit = struct.unpack("<Q", f.read(8))[0]
+        nit = _uint64.unpack(f.read(8))[0]
     return nit
 
 
@@ -122,27 +244,20 @@ def ser_string(s):
 
 
 def deser_uint256(f):
-    r = 0
-    for i in range(8):
-        t = struct.unpack("<I", f.read(4))[0]
-        r += t << (i * 32)
-    return r
+    s = f.read(32)
+    if len(s) != 32:
+        raise struct.error("unpack requires a buffer of 32 bytes")
+    return int.from_bytes(s, 'little')
 
 
 def ser_uint256(u):
-    rs = b""
-    for i in range(8):
-        rs += struct.pack("<I", u & 0xFFFFFFFF)
-        u >>= 32
-    return rs
+    return (u & _UINT256_MASK).to_bytes(32, 'little')
 
 
 def uint256_from_str(s):
-    r = 0
-    t = struct.unpack("<IIIIIIII", s[:32])
-    for i in range(8):
-        r += t[i] << (i * 32)
-    return r
+    if len(s) < 32:
+        raise struct.error("unpack requires a buffer of 32 bytes")
+    return int.from_bytes(s[:32], 'little')
 
 
 def uint256_from_compact(c):
@@ -164,13 +279,12 @@ def deser_vector(f, c):
 # ser_function_name: Allow for an alternate serialization function on the
 # entries in the vector.
 def ser_vector(l, ser_function_name=None):
-    r = ser_compact_size(len(l))
-    for i in l:
-        if ser_function_name:
-            r += getattr(i, ser_function_name)()
-        else:
-            r += i.serialize()
-    return r
+    r = [ser_compact_size(len(l))]
+    if ser_function_name:
+        r += [getattr(i, ser_function_name)() for i in l]
+    else:
+        r += [i.serialize() for i in l]
+    return b"".join(r)
 
 
 def deser_uint256_vector(f):
@@ -183,10 +297,7 @@ def deser_uint256_vector(f):
 
 
 def ser_uint256_vector(l):
-    r = ser_compact_size(len(l))
-    for i in l:
-        r += ser_uint256(i)
-    return r
+    return ser_compact_size(len(l)) + b"".join([ser_uint256(i) for i in l])
 
 
 def deser_string_vector(f):
@@ -199,26 +310,20 @@ def deser_string_vector(f):
 
 
 def ser_string_vector(l):
-    r = ser_compact_size(len(l))
-    for sv in l:
-        r += ser_string(sv)
-    return r
+    return ser_compact_size(len(l)) + b"".join([ser_string(sv) for sv in l])
 
 
 def deser_int_vector(f):
     nit = deser_compact_size(f)
     r = []
     for i in range(nit):
-        t = struct.unpack("<i", f.read(4))[0]
+        t = _int32.unpack(f.read(4))[0]
         r.append(t)
     return r
 
 
 def ser_int_vector(l):
-    r = ser_compact_size(len(l))
-    for i in l:
-        r += struct.pack("<i", i)
-    return r
+    return ser_compact_size(len(l)) + b"".join([_int32.pack(i) for i in l])
 
 # Deserialize from a hex string representation (eg from RPC)
 
@@ -233,6 +338,51 @@ def FromHex(obj, hex_string):
 def ToHex(obj):
     return bytes_to_hex_str(obj.serialize())
 
+
+class HexReader():
+    """File-like object decoding a hex string as it is read.
+
+    Unlike FromHex, this does not hold the decoded copy of a large block in
+    memory while it is deserialized."""
+
+    # Number of bytes decoded at a time
+    CHUNK_SIZE = 65536
+
+    def __init__(self, hex_string):
+        self.hex_string = hex_string
+        self.pos = 0
+        self.chunk = BytesIO()
+
+    def read(self, n=-1):
+        if n < 0:
+            n = len(self.hex_string)
+        r = self.chunk.read(n)
+        while len(r) < n and self.pos < len(self.hex_string):
+            end = self.pos + 2 * max(n - len(r), self.CHUNK_SIZE)
+            self.chunk = BytesIO(hex_str_to_bytes(self.hex_string[self.pos:end]))
+            self.pos = end
+            r += self.chunk.read(n - len(r))
+        return r
+
+
+# Read a block from a file-like object (a file, socket.makefile("rb"),
+# HexReader, ...) without buffering all of it. Yields the CBlockHeader, then
+# the transactions one at a time:
+#
+#     block_items = iter_block(f)
+#     header = next(block_items)
+#     for tx in block_items:
+#         ...
+def iter_block(f):
+    header = CBlockHeader()
+    header.deserialize(f)
+    header.calc_sha256()
+    yield header
+    for i in range(deser_compact_size(f)):
+        tx = CTransaction()
+        tx.deserialize(f)
+        yield tx
+
 # Objects that map to bitcoind objects, which can be serialized/deserialized
 
 
@@ -244,18 +394,14 @@ class CAddress():
         self.port = 0
 
     def deserialize(self, f):
-        self.nServices = struct.unpack("<Q", f.read(8))[0]
+        self.nServices = _uint64.unpack(f.read(8))[0]
         self.pchReserved = f.read(12)
         self.ip = socket.inet_ntoa(f.read(4))
-        self.port = struct.unpack(">H", f.read(2))[0]
+        self.port = _port.unpack(f.read(2))[0]
 
     def serialize(self):
-        r = b""
-        r += struct.pack("<Q", self.nServices)
-        r += self.pchReserved
-        r += socket.inet_aton(self.ip)
-        r += struct.pack(">H", self.port)
-        return r
+        return b"".join((_uint64.pack(self.nServices), self.pchReserved,
+                         socket.inet_aton(self.ip), _port.pack(self.port)))
 
     def __repr__(self):
         return "CAddress(nServices=%i ip=%s port=%i)" % (self.nServices,
@@ -263,6 +409,8 @@ class CAddress():
 
 
 class CInv():
+    __slots__ = ("type", "hash")
+
     typemap = {
         0: "Error",
         1: "TX",
@@ -275,14 +423,11 @@ class CInv():
         self.hash = h
 
     def deserialize(self, f):
-        self.type = struct.unpack("<i", f.read(4))[0]
+        self.type = _int32.unpack(f.read(4))[0]
         self.hash = deser_uint256(f)
 
     def serialize(self):
-        r = b""
-        r += struct.pack("<i", self.type)
-        r += ser_uint256(self.hash)
-        return r
+        return _int32.pack(self.type) + ser_uint256(self.hash)
 
     def __repr__(self):
         return "CInv(type=%s hash=%064x)" \
@@ -295,14 +440,11 @@ class CBlockLocator():
         self.vHave = []
 
     def deserialize(self, f):
-        self.nVersion = struct.unpack("<i", f.read(4))[0]
+        self.nVersion = _int32.unpack(f.read(4))[0]
         self.vHave = deser_uint256_vector(f)
 
     def serialize(self):
-        r = b""
-        r += struct.pack("<i", self.nVersion)
-        r += ser_uint256_vector(self.vHave)
-        return r
+        return _int32.pack(self.nVersion) + ser_uint256_vector(self.vHave)
 
     def __repr__(self):
         return "CBlockLocator(nVersion=%i vHave=%s)" \
@@ -310,25 +452,29 @@ class CBlockLocator():
 
 
 class COutPoint():
+    __slots__ = ("hash", "n")
+
     def __init__(self, hash=0, n=0):
         self.hash = hash
         self.n = n
 
+    def copy(self):
+        return COutPoint(self.hash, self.n)
+
     def deserialize(self, f):
-        self.hash = deser_uint256(f)
-        self.n = struct.unpack("<I", f.read(4))[0]
+        hash, self.n = _outpoint.unpack(f.read(36))
+        self.hash = uint256_from_str(hash)
 
     def serialize(self):
-        r = b""
-        r += ser_uint256(self.hash)
-        r += struct.pack("<I", self.n)
-        return r
+        return ser_uint256(self.hash) + _uint32.pack(self.n)
 
     def __repr__(self):
         return "COutPoint(hash=%064x n=%i)" % (self.hash, self.n)
 
 
 class CTxIn():
+    __slots__ = ("prevout", "scriptSig", "nSequence")
+
     def __init__(self, outpoint=None, scriptSig=b"", nSequence=0):
         if outpoint is None:
             self.prevout = COutPoint()
@@ -337,18 +483,19 @@ class CTxIn():
         self.scriptSig = scriptSig
         self.nSequence = nSequence
 
+    def copy(self):
+        # scriptSig is immutable, so only the outpoint needs copying
+        return CTxIn(self.prevout.copy(), self.scriptSig, self.nSequence)
+
     def deserialize(self, f):
         self.prevout = COutPoint()
         self.prevout.deserialize(f)
         self.scriptSig = deser_string(f)
-        self.nSequence = struct.unpack("<I", f.read(4))[0]
+        self.nSequence = _uint32.unpack(f.read(4))[0]
 
     def serialize(self):
-        r = b""
-        r += self.prevout.serialize()
-        r += ser_string(self.scriptSig)
-        r += struct.pack("<I", self.nSequence)
-        return r
+        return b"".join((self.prevout.serialize(), ser_string(self.scriptSig),
+                         _uint32.pack(self.nSequence)))
 
     def __repr__(self):
         return "CTxIn(prevout=%s scriptSig=%s nSequence=%i)" \
@@ -357,19 +504,21 @@ class CTxIn():
 
 
 class CTxOut():
+    __slots__ = ("nValue", "scriptPubKey")
+
     def __init__(self, nValue=0, scriptPubKey=b""):
         self.nValue = nValue
         self.scriptPubKey = scriptPubKey
 
+    def copy(self):
+        return CTxOut(self.nValue, self.scriptPubKey)
+
     def deserialize(self, f):
-        self.nValue = struct.unpack("<q", f.read(8))[0]
+        self.nValue = _int64.unpack(f.read(8))[0]
         self.scriptPubKey = deser_string(f)
 
     def serialize(self):
-        r = b""
-        r += struct.pack("<q", self.nValue)
-        r += ser_string(self.scriptPubKey)
-        return r
+        return _int64.pack(self.nValue) + ser_string(self.scriptPubKey)
 
     def __repr__(self):
         return "CTxOut(nValue=%i.%08i scriptPubKey=%s)" \
@@ -378,29 +527,65 @@ class CTxOut():
 
 
 class CTransaction():
+    # _txid is the hash256 of the serialization from which sha256 and hash
+    # were last computed. Only a frozen transaction reuses it, see
+    # calc_sha256(). _sha256_set is True while sha256 holds a value set from
+    # outside.
+    __slots__ = ("nVersion", "vin", "vout", "nLockTime", "_sha256", "_hash",
+                 "_txid", "_sha256_set", "serialized")
+
     def __init__(self, tx=None):
         if tx is None:
             self.nVersion = 1
             self.vin = []
             self.vout = []
             self.nLockTime = 0
-            self.sha256 = None
-            self.hash = None
+            self._sha256 = None
+            self._hash = None
+            self._txid = None
+            self._sha256_set = False
         else:
             self.nVersion = tx.nVersion
-            self.vin = copy.deepcopy(tx.vin)
-            self.vout = copy.deepcopy(tx.vout)
+            self.vin = [txin.copy() for txin in tx.vin]
+            self.vout = [txout.copy() for txout in tx.vout]
             self.nLockTime = tx.nLockTime
-            self.sha256 = tx.sha256
-            self.hash = tx.hash
+            self._sha256 = tx._sha256
+            self._hash = tx._hash
+            self._txid = tx._txid
+            self._sha256_set = tx._sha256_set
+        self.serialized = None
+
+    # A sha256 set from outside is kept by calc_sha256(), which only
+    # recomputes hash from the serialization, as it always did
+    @property
+    def sha256(self):
+        return self._sha256
+
+    @sha256.setter
+    def sha256(self, value):
+        self._sha256 = value
+        self._sha256_set = value is not None
+        self._txid = None
+
+    @property
+    def hash(self):
+        return self._hash
+
+    @hash.setter
+    def hash(self, value):
+        self._hash = value
+        self._txid = None
 
     def deserialize(self, f):
-        self.nVersion = struct.unpack("<i", f.read(4))[0]
+        self.nVersion = _int32.unpack(f.read(4))[0]
         self.vin = deser_vector(f, CTxIn)
         self.vout = deser_vector(f, CTxOut)
-        self.nLockTime = struct.unpack("<I", f.read(4))[0]
-        self.sha256 = None
-        self.hash = None
+        self.nLockTime = _uint32.unpack(f.read(4))[0]
+        self._sha256 = None
+        self._hash = None
+        self._txid = None
+        self._sha256_set = False
+        self.serialized = None
 
     def billable_size(self):
         """
@@ -409,24 +594,55 @@ class CTransaction():
         return len(self.serialize())
 
     def serialize(self):
-        r = b""
-        r += struct.pack("<i", self.nVersion)
-        r += ser_vector(self.vin)
-        r += ser_vector(self.vout)
-        r += struct.pack("<I", self.nLockTime)
-        return r
+        if self.serialized is not None:
+            return self.serialized
+        return b"".join((_int32.pack(self.nVersion), ser_vector(self.vin),
+                         ser_vector(self.vout), _uint32.pack(self.nLockTime)))
+
+    def freeze(self):
+        """Caches the serialization and txid of the transaction.
+
+        serialize(), billable_size() and calc_sha256() of a frozen
+        transaction return the cached values. Call rehash() after modifying
+        it, which also thaws it."""
+        self.serialized = None
+        self.serialized = self.serialize()
+        txid = hash256(self.serialized)
+        self._txid = txid
+        self._sha256 = uint256_from_str(txid)
+        self._sha256_set = False
+        self._hash = txid[::-1].hex()
+        return self
+
+    def thaw(self):
+        """Drops the cached serialization and txid, so the transaction can
+        be modified."""
+        self.serialized = None
+        self._sha256 = None
+        self._hash = None
+        self._txid = None
+        self._sha256_set = False
 
     # Recalculate the txid
     def rehash(self):
         self.sha256 = None
         self.calc_sha256()
 
-    # self.sha256 and self.hash -- those are expected to be the txid.
+    # self.sha256 and self.hash -- those are expected to be the txid. They
+    # are recomputed from the current serialization, unless the transaction
+    # is frozen, in which case they are cached until rehash().
     def calc_sha256(self):
-        if self.sha256 is None:
-            self.sha256 = uint256_from_str(hash256(self.serialize()))
-        self.hash = encode(
-            hash256(self.serialize())[::-1], 'hex_codec').decode('ascii')
+        if self._sha256 is None:
+            # rehash() after a modification, so a frozen serialization is
+            # out of date
+            self.serialized = None
+        elif self.serialized is not None and self._txid is not None:
+            return
+        txid = hash256(self.serialize())
+        self._txid = txid
+        if not self._sha256_set:
+            self._sha256 = uint256_from_str(txid)
+        self._hash = txid[::-1].hex()
 
     def get_id(self):
         # For now, just forward the hash.
@@ -446,6 +662,10 @@ class CTransaction():
 
 
 class CBlockHeader():
+    # CBlock and other subclasses still have a __dict__
+    __slots__ = ("nVersion", "hashPrevBlock", "hashMerkleRoot", "nTime",
+                 "nBits", "nNonce", "sha256", "hash")
+
     def __init__(self, header=None):
         if header is None:
             self.set_null()
@@ -471,36 +691,27 @@ class CBlockHeader():
         self.hash = None
 
     def deserialize(self, f):
-        self.nVersion = struct.unpack("<i", f.read(4))[0]
-        self.hashPrevBlock = deser_uint256(f)
-        self.hashMerkleRoot = deser_uint256(f)
-        self.nTime = struct.unpack("<I", f.read(4))[0]
-        self.nBits = struct.unpack("<I", f.read(4))[0]
-        self.nNonce = struct.unpack("<I", f.read(4))[0]
+        (self.nVersion, hashPrevBlock, hashMerkleRoot, self.nTime,
+         self.nBits, self.nNonce) = _block_header.unpack(f.read(80))
+        self.hashPrevBlock = uint256_from_str(hashPrevBlock)
+        self.hashMerkleRoot = uint256_from_str(hashMerkleRoot)
         self.sha256 = None
         self.hash = None
 
+    def serialize_header(self):
+        return _block_header.pack(self.nVersion,
+                                  ser_uint256(self.hashPrevBlock),
+                                  ser_uint256(self.hashMerkleRoot),
+                                  self.nTime, self.nBits, self.nNonce)
+
     def serialize(self):
-        r = b""
-        r += struct.pack("<i", self.nVersion)
-        r += ser_uint256(self.hashPrevBlock)
-        r += ser_uint256(self.hashMerkleRoot)
-        r += struct.pack("<I", self.nTime)
-        r += struct.pack("<I", self.nBits)
-        r += struct.pack("<I", self.nNonce)
-        return r
+        return self.serialize_header()
 
     def calc_sha256(self):
         if self.sha256 is None:
-            r = b""
-            r += struct.pack("<i", self.nVersion)
-            r += ser_uint256(self.hashPrevBlock)
-            r += ser_uint256(self.hashMerkleRoot)
-            r += struct.pack("<I", self.nTime)
-            r += struct.pack("<I", self.nBits)
-            r += struct.pack("<I", self.nNonce)
-            self.sha256 = uint256_from_str(hash256(r))
-            self.hash = encode(hash256(r)[::-1], 'hex_codec').decode('ascii')
+            h = hash256(self.serialize_header())
+            self.sha256 = uint256_from_str(h)
+            self.hash = h[::-1].hex()
 
     def rehash(self):
         self.sha256 = None
@@ -513,21 +724,197 @@ class CBlockHeader():
                time.ctime(self.nTime), self.nBits, self.nNonce)
 
 
+class MerkleTree():
+    """Merkle tree of 32 byte hashes which keeps all its levels.
+
+    Replacing or appending a leaf only rehashes its path to the root.
+    Removing a leaf rehashes the paths of all the leaves after it."""
+
+    def __init__(self, leaves=()):
+        self.levels = [[]]
+        self.update(leaves)
+
+    def __len__(self):
+        return len(self.levels[0])
+
+    def __getitem__(self, index):
+        return self.levels[0][index]
+
+    def __setitem__(self, index, leaf):
+        leaves = self.levels[0]
+        leaves[index] = leaf
+        index = range(len(leaves))[index]
+        self._rehash(index, index + 1)
+
+    def __delitem__(self, index):
+        leaves = self.levels[0]
+        index = range(len(leaves))[index]
+        del leaves[index]
+        self._rehash(index, len(leaves))
+
+    def append(self, leaf):
+        self.levels[0].append(leaf)
+        self._rehash(len(self) - 1, len(self))
+
+    def update(self, leaves):
+        """Replaces the leaves, only rehashing the paths of the leaves which
+        differ from the old ones."""
+        old = self.levels[0]
+        self.levels[0] = leaves = list(leaves)
+        n = min(len(old), len(leaves))
+        changed = [i for i in range(n) if old[i] != leaves[i]]
+        if len(changed) > 16:
+            self._rehash(changed[0], len(leaves))
+            return
+        # Fix the size of every level first, so that each path below is
+        # rehashed against complete levels
+        if len(old) != len(leaves):
+            self._rehash(n, len(leaves))
+        for i in changed:
+            self._rehash(i, i + 1)
+
+    def _rehash(self, start, end):
+        # Recomputes the parents of the leaves start..end-1 up to the root.
+        # An odd node at the end of a level is hashed with itself.
+        d = 0
+        while len(self.levels[d]) > 1:
+            level = self.levels[d]
+            if d + 1 == len(self.levels):
+                self.levels.append([])
+            parents = self.levels[d + 1]
+            del parents[(len(level) + 1) // 2:]
+            start -= start % 2
+            end = min(end + end % 2, len(level))
+            for i in range(start, end, 2):
+                h = hash256(level[i] + level[min(i + 1, len(level) - 1)])
+                if i // 2 < len(parents):
+                    parents[i // 2] = h
+                else:
+                    parents.append(h)
+            start //= 2
+            end = (end + 1) // 2
+            d += 1
+        del self.levels[d + 1:]
+
+    def root(self):
+        if not self.levels[0]:
+            return 0
+        return uint256_from_str(self.levels[-1][0])
+
+    def branch(self, index):
+        """Returns the hashes needed to compute the root from leaf index."""
+        r = []
+        for level in self.levels[:-1]:
+            r.append(level[min(index ^ 1, len(level) - 1)])
+            index //= 2
+        return r
+
+
+def merkle_root_from_branch(leaf, branch, index):
+    """Returns the merkle root of leaf at index with the given branch."""
+    h = leaf
+    for sibling in branch:
+        if index & 1:
+            h = hash256(sibling + h)
+        else:
+            h = hash256(h + sibling)
+        index //= 2
+    return uint256_from_str(h)
+
+
+# Nonces tried by each task of a solver pool
+SOLVE_CHUNK_SIZE = 1 << 16
+
+# multiprocessing pools used by CBlock.solve(), by number of processes
+solver_pools = {}
+
+
+def search_nonce(header, target, start, stop):
+    """Returns the first nonce in start..stop-1 for which the hash of the
+    block header is at most target, or None.
+
+    header holds the first 76 bytes of the serialized header, everything but
+    the nonce. The SHA256 state after its first 64 bytes is computed once, so
+    each try only hashes the last 16 bytes and the second round."""
+    midstate = hashlib.sha256(header[:64])
+    tail = header[64:76]
+    pack = _uint32.pack
+    hash_sha256 = hashlib.sha256
+    from_bytes = int.from_bytes
+    for nonce in range(start, stop):
+        h = midstate.copy()
+        h.update(tail + pack(nonce))
+        if from_bytes(hash_sha256(h.digest()).digest(), 'little') <= target:
+            return nonce
+    return None
+
+
+def _search_nonce_task(args):
+    return search_nonce(*args)
+
+
+def get_solver_pool(processes):
+    if processes not in solver_pools:
+        if not solver_pools:
+            # Runs before the exit handler of multiprocessing, which would
+            # terminate the pools
+            atexit.register(close_solver_pools)
+        # Forking would copy the network thread's locks and event loop in
+        # whatever state they are in, so the workers are spawned
+        context = multiprocessing.get_context('spawn')
+        solver_pools[processes] = context.Pool(processes)
+    return solver_pools[processes]
+
+
+def close_solver_pools():
+    """Lets the workers of the solver pools exit and waits for them."""
+    pools = list(solver_pools.values())
+    solver_pools.clear()
+    for pool in pools:
+        pool.close()
+    for pool in pools:
+        pool.join()
+
+
 class CBlock(CBlockHeader):
 
     def __init__(self, header=None):
         super(CBlock, self).__init__(header)
         self.vtx = []
+        # Kept by calc_merkle_root() to rehash only what changed since the
+        # previous call
+        self.merkle_tree = None
 
-    def deserialize(self, f):
+    def deserialize(self, f, lazy=False):
+        """Deserializes a block from f.
+
+        With lazy, only the header is decoded and the rest of f is kept as
+        the raw transaction vector. The transactions are decoded when vtx is
+        first accessed; until then serialize() re-emits the raw bytes."""
         super(CBlock, self).deserialize(f)
-        self.vtx = deser_vector(f, CTransaction)
+        if lazy:
+            self.vtx = None
+            self._raw_vtx = f.read()
+        else:
+            self.vtx = deser_vector(f, CTransaction)
+
+    @property
+    def vtx(self):
+        if self._vtx is None:
+            self._vtx = deser_vector(BytesIO(self._raw_vtx), CTransaction)
+            # The caller may modify the decoded transactions
+            self._raw_vtx = None
+        return self._vtx
+
+    @vtx.setter
+    def vtx(self, vtx):
+        self._vtx = vtx
+        self._raw_vtx = None
 
     def serialize(self):
-        r = b""
-        r += super(CBlock, self).serialize()
-        r += ser_vector(self.vtx)
-        return r
+        if self._vtx is None:
+            return self.serialize_header() + self._raw_vtx
+        return self.serialize_header() + ser_vector(self._vtx)
 
     # Calculate the merkle root given a vector of transaction hashes
     def get_merkle_root(self, hashes):
@@ -544,7 +931,17 @@ class CBlock(CBlockHeader):
         for tx in self.vtx:
             tx.calc_sha256()
             hashes.append(ser_uint256(tx.sha256))
-        return self.get_merkle_root(hashes)
+        if self.merkle_tree is None:
+            self.merkle_tree = MerkleTree(hashes)
+        else:
+            self.merkle_tree.update(hashes)
+        return self.merkle_tree.root()
+
+    def get_merkle_branch(self, index):
+        """Returns the merkle branch of transaction index, see
+        merkle_root_from_branch()."""
+        self.calc_merkle_root()
+        return self.merkle_tree.branch(index)
 
     def is_valid(self):
         self.calc_sha256()
@@ -558,12 +955,33 @@ class CBlock(CBlockHeader):
             return False
         return True
 
-    def solve(self):
-        self.rehash()
+    def solve(self, processes=None):
+        """Increments nNonce until the block hash is at most the target of
+        nBits.
+
+        With processes > 1 the nonces are searched in chunks by a pool of
+        that many processes. The chunks are checked in order, so the same
+        nonce is found either way."""
         target = uint256_from_compact(self.nBits)
-        while self.sha256 > target:
-            self.nNonce += 1
-            self.rehash()
+        header = self.serialize_header()[:76]
+        if processes is not None and processes > 1:
+            pool = get_solver_pool(processes)
+            nonce = None
+            start = self.nNonce
+            while nonce is None and start < 1 << 32:
+                tasks = []
+                for i in range(processes):
+                    stop = min(start + SOLVE_CHUNK_SIZE, 1 << 32)
+                    tasks.append((header, target, start, stop))
+                    start = stop
+                nonce = next((n for n in pool.map(_search_nonce_task, tasks)
+                              if n is not None), None)
+        else:
+            nonce = search_nonce(header, target, self.nNonce, 1 << 32)
+        if nonce is None:
+            raise ValueError("No nonce from %d solves the block" % self.nNonce)
+        self.nNonce = nonce
+        self.rehash()
 
     def __repr__(self):
         return "CBlock(nVersion=%i hashPrevBlock=%064x hashMerkleRoot=%064x nTime=%s nBits=%08x nNonce=%08x vtx=%s)" \
@@ -582,10 +1000,7 @@ class PrefilledTransaction():
         self.tx.deserialize(f)
 
     def serialize(self):
-        r = b""
-        r += ser_compact_size(self.index)
-        r += self.tx.serialize()
-        return r
+        return ser_compact_size(self.index) + self.tx.serialize()
 
     def __repr__(self):
         return "PrefilledTransaction(index=%d, tx=%s)" % (self.index, repr(self.tx))
@@ -604,26 +1019,23 @@ class P2PHeaderAndShortIDs():
 
     def deserialize(self, f):
         self.header.deserialize(f)
-        self.nonce = struct.unpack("<Q", f.read(8))[0]
+        self.nonce = _uint64.unpack(f.read(8))[0]
         self.shortids_length = deser_compact_size(f)
         for i in range(self.shortids_length):
             # shortids are defined to be 6 bytes in the spec, so append
             # two zero bytes and read it in as an 8-byte number
             self.shortids.append(
-                struct.unpack("<Q", f.read(6) + b'\x00\x00')[0])
+                _uint64.unpack(f.read(6) + b'\x00\x00')[0])
         self.prefilled_txn = deser_vector(f, PrefilledTransaction)
         self.prefilled_txn_length = len(self.prefilled_txn)
 
     def serialize(self):
-        r = b""
-        r += self.header.serialize()
-        r += struct.pack("<Q", self.nonce)
-        r += ser_compact_size(self.shortids_length)
-        for x in self.shortids:
-            # We only want the first 6 bytes
-            r += struct.pack("<Q", x)[0:6]
-        r += ser_vector(self.prefilled_txn)
-        return r
+        r = [self.header.serialize(), _uint64.pack(self.nonce),
+             ser_compact_size(self.shortids_length)]
+        # We only want the first 6 bytes
+        r += [_uint64.pack(x)[0:6] for x in self.shortids]
+        r.append(ser_vector(self.prefilled_txn))
+        return b"".join(r)
 
     def __repr__(self):
         return "P2PHeaderAndShortIDs(header=%s, nonce=%d, shortids_length=%d, shortids=%s, prefilled_txn_length=%d, prefilledtxn=%s" % (repr(self.header), self.nonce, self.shortids_length, repr(self.shortids), self.prefilled_txn_length, repr(self.prefilled_txn))
@@ -673,11 +1085,10 @@ class HeaderAndShortIDs():
         return ret
 
     def get_siphash_keys(self):
-        header_nonce = self.header.serialize()
-        header_nonce += struct.pack("<Q", self.nonce)
+        header_nonce = self.header.serialize() + _uint64.pack(self.nonce)
         hash_header_nonce_as_str = sha256(header_nonce)
-        key0 = struct.unpack("<Q", hash_header_nonce_as_str[0:8])[0]
-        key1 = struct.unpack("<Q", hash_header_nonce_as_str[8:16])[0]
+        key0 = _uint64.unpack(hash_header_nonce_as_str[0:8])[0]
+        key1 = _uint64.unpack(hash_header_nonce_as_str[8:16])[0]
         return [key0, key1]
 
     # Version 2 compact blocks use wtxid in shortids (rather than txid)
@@ -710,12 +1121,9 @@ class BlockTransactionsRequest():
             self.indexes.append(deser_compact_size(f))
 
     def serialize(self):
-        r = b""
-        r += ser_uint256(self.blockhash)
-        r += ser_compact_size(len(self.indexes))
-        for x in self.indexes:
-            r += ser_compact_size(x)
-        return r
+        r = [ser_uint256(self.blockhash), ser_compact_size(len(self.indexes))]
+        r += [ser_compact_size(x) for x in self.indexes]
+        return b"".join(r)
 
     # helper to set the differentially encoded indexes from absolute ones
     def from_absolute(self, absolute_indexes):
@@ -748,10 +1156,7 @@ class BlockTransactions():
         self.transactions = deser_vector(f, CTransaction)
 
     def serialize(self):
-        r = b""
-        r += ser_uint256(self.blockhash)
-        r += ser_vector(self.transactions)
-        return r
+        return ser_uint256(self.blockhash) + ser_vector(self.transactions)
 
     def __repr__(self):
         return "BlockTransactions(hash=%064x transactions=%s)" % (self.blockhash, repr(self.transactions))
@@ -773,18 +1178,18 @@ class msg_version():
         self.nRelay = MY_RELAY
 
     def deserialize(self, f):
-        self.nVersion = struct.unpack("<i", f.read(4))[0]
+        self.nVersion = _int32.unpack(f.read(4))[0]
         if self.nVersion == 10300:
             self.nVersion = 300
-        self.nServices = struct.unpack("<Q", f.read(8))[0]
-        self.nTime = struct.unpack("<q", f.read(8))[0]
+        self.nServices = _uint64.unpack(f.read(8))[0]
+        self.nTime = _int64.unpack(f.read(8))[0]
         self.addrTo = CAddress()
         self.addrTo.deserialize(f)
 
         if self.nVersion >= 106:
             self.addrFrom = CAddress()
             self.addrFrom.deserialize(f)
-            self.nNonce = struct.unpack("<Q", f.read(8))[0]
+            self.nNonce = _uint64.unpack(f.read(8))[0]
             self.strSubVer = deser_string(f)
         else:
             self.addrFrom = None
@@ -793,31 +1198,29 @@ class msg_version():
             self.nStartingHeight = None
 
         if self.nVersion >= 209:
-            self.nStartingHeight = struct.unpack("<i", f.read(4))[0]
+            self.nStartingHeight = _int32.unpack(f.read(4))[0]
         else:
             self.nStartingHeight = None
 
         if self.nVersion >= 70001:
             # Relay field is optional for version 70001 onwards
             try:
-                self.nRelay = struct.unpack("<b", f.read(1))[0]
+                self.nRelay = _int8.unpack(f.read(1))[0]
             except:
                 self.nRelay = 0
         else:
             self.nRelay = 0
 
     def serialize(self):
-        r = b""
-        r += struct.pack("<i", self.nVersion)
-        r += struct.pack("<Q", self.nServices)
-        r += struct.pack("<q", self.nTime)
-        r += self.addrTo.serialize()
-        r += self.addrFrom.serialize()
-        r += struct.pack("<Q", self.nNonce)
-        r += ser_string(self.strSubVer)
-        r += struct.pack("<i", self.nStartingHeight)
-        r += struct.pack("<b", self.nRelay)
-        return r
+        return b"".join((_int32.pack(self.nVersion),
+                         _uint64.pack(self.nServices),
+                         _int64.pack(self.nTime),
+                         self.addrTo.serialize(),
+                         self.addrFrom.serialize(),
+                         _uint64.pack(self.nNonce),
+                         ser_string(self.strSubVer),
+                         _int32.pack(self.nStartingHeight),
+                         _int8.pack(self.nRelay)))
 
     def __repr__(self):
         return 'msg_version(nVersion=%i nServices=%i nTime=%s addrTo=%s addrFrom=%s nNonce=0x%016X strSubVer=%s nStartingHeight=%i nRelay=%i)' \
@@ -905,10 +1308,7 @@ class msg_getblocks():
         self.hashstop = deser_uint256(f)
 
     def serialize(self):
-        r = b""
-        r += self.locator.serialize()
-        r += ser_uint256(self.hashstop)
-        return r
+        return self.locator.serialize() + ser_uint256(self.hashstop)
 
     def __repr__(self):
         return "msg_getblocks(locator=%s hashstop=%064x)" \
@@ -941,7 +1341,7 @@ class msg_block():
             self.block = block
 
     def deserialize(self, f):
-        self.block.deserialize(f)
+        self.block.deserialize(f, lazy=True)
 
     def serialize(self):
         return self.block.serialize()
@@ -1004,12 +1404,10 @@ class msg_ping():
         self.nonce = nonce
 
     def deserialize(self, f):
-        self.nonce = struct.unpack("<Q", f.read(8))[0]
+        self.nonce = _uint64.unpack(f.read(8))[0]
 
     def serialize(self):
-        r = b""
-        r += struct.pack("<Q", self.nonce)
-        return r
+        return _uint64.pack(self.nonce)
 
     def __repr__(self):
         return "msg_ping(nonce=%08x)" % self.nonce
@@ -1022,12 +1420,10 @@ class msg_pong():
         self.nonce = nonce
 
     def deserialize(self, f):
-        self.nonce = struct.unpack("<Q", f.read(8))[0]
+        self.nonce = _uint64.unpack(f.read(8))[0]
 
     def serialize(self):
-        r = b""
-        r += struct.pack("<Q", self.nonce)
-        return r
+        return _uint64.pack(self.nonce)
 
     def __repr__(self):
         return "msg_pong(nonce=%08x)" % self.nonce
@@ -1082,10 +1478,7 @@ class msg_getheaders():
         self.hashstop = deser_uint256(f)
 
     def serialize(self):
-        r = b""
-        r += self.locator.serialize()
-        r += ser_uint256(self.hashstop)
-        return r
+        return self.locator.serialize() + ser_uint256(self.hashstop)
 
     def __repr__(self):
         return "msg_getheaders(locator=%s, stop=%064x)" \
@@ -1107,8 +1500,9 @@ class msg_headers():
             self.headers.append(CBlockHeader(x))
 
     def serialize(self):
-        blocks = [CBlock(x) for x in self.headers]
-        return ser_vector(blocks)
+        # Each header is followed by an empty transaction count
+        return ser_compact_size(len(self.headers)) + b"".join(
+            [x.serialize_header() + b"\x00" for x in self.headers])
 
     def __repr__(self):
         return "msg_headers(headers=%s)" % repr(self.headers)
@@ -1126,20 +1520,19 @@ class msg_reject():
 
     def deserialize(self, f):
         self.message = deser_string(f)
-        self.code = struct.unpack("<B", f.read(1))[0]
+        self.code = _uint8.unpack(f.read(1))[0]
         self.reason = deser_string(f)
         if (self.code != self.REJECT_MALFORMED and
                 (self.message == b"block" or self.message == b"tx")):
             self.data = deser_uint256(f)
 
     def serialize(self):
-        r = ser_string(self.message)
-        r += struct.pack("<B", self.code)
-        r += ser_string(self.reason)
+        r = [ser_string(self.message), _uint8.pack(self.code),
+             ser_string(self.reason)]
         if (self.code != self.REJECT_MALFORMED and
                 (self.message == b"block" or self.message == b"tx")):
-            r += ser_uint256(self.data)
-        return r
+            r.append(ser_uint256(self.data))
+        return b"".join(r)
 
     def __repr__(self):
         return "msg_reject: %s %d %s [%064x]" \
@@ -1153,12 +1546,10 @@ class msg_feefilter():
         self.feerate = feerate
 
     def deserialize(self, f):
-        self.feerate = struct.unpack("<Q", f.read(8))[0]
+        self.feerate = _uint64.unpack(f.read(8))[0]
 
     def serialize(self):
-        r = b""
-        r += struct.pack("<Q", self.feerate)
-        return r
+        return _uint64.pack(self.feerate)
 
     def __repr__(self):
         return "msg_feefilter(feerate=%08x)" % self.feerate
@@ -1172,14 +1563,10 @@ class msg_sendcmpct():
         self.version = 1
 
     def deserialize(self, f):
-        self.announce = struct.unpack("<?", f.read(1))[0]
-        self.version = struct.unpack("<Q", f.read(8))[0]
+        self.announce, self.version = _sendcmpct.unpack(f.read(9))
 
     def serialize(self):
-        r = b""
-        r += struct.pack("<?", self.announce)
-        r += struct.pack("<Q", self.version)
-        return r
+        return _sendcmpct.pack(self.announce, self.version)
 
     def __repr__(self):
         return "msg_sendcmpct(announce=%s, version=%lu)" % (self.announce, self.version)
@@ -1196,9 +1583,7 @@ class msg_cmpctblock():
         self.header_and_shortids.deserialize(f)
 
     def serialize(self):
-        r = b""
-        r += self.header_and_shortids.serialize()
-        return r
+        return self.header_and_shortids.serialize()
 
     def __repr__(self):
         return "msg_cmpctblock(HeaderAndShortIDs=%s)" % repr(self.header_and_shortids)
@@ -1215,9 +1600,7 @@ class msg_getblocktxn():
         self.block_txn_request.deserialize(f)
 
     def serialize(self):
-        r = b""
-        r += self.block_txn_request.serialize()
-        return r
+        return self.block_txn_request.serialize()
 
     def __repr__(self):
         return "msg_getblocktxn(block_txn_request=%s)" % (repr(self.block_txn_request))
@@ -1233,9 +1616,7 @@ class msg_blocktxn():
         self.block_transactions.deserialize(f)
 
     def serialize(self):
-        r = b""
-        r += self.block_transactions.serialize()
-        return r
+        return self.block_transactions.serialize()
 
     def __repr__(self):
         return "msg_blocktxn(block_transactions=%s)" % (repr(self.block_transactions))
@@ -1269,6 +1650,15 @@ class NodeConnCB():
         # Remember the services our peer has advertised
         self.peer_services = None
 
+        # Held while a message is delivered to this NodeConnCB. Acquire it to
+        # access the state of this NodeConnCB from the test logic.
+        self.lock = RLock()
+        # Notified after every delivered message and when the connection
+        # closes; see wait_for()
+        self.message_received = Condition(self.lock)
+        # Notified after each delivered message of the command used as key
+        self.command_received = {}
+
     # Message receiving methods
 
     def deliver(self, conn, message):
@@ -1283,9 +1673,9 @@ class NodeConnCB():
         deliver_sleep = self.get_deliver_sleep_time()
         if deliver_sleep is not None:
             time.sleep(deliver_sleep)
-        with mininode_lock:
+        with mininode_lock.shared(), self.lock:
+            command = message.command.decode('ascii')
             try:
-                command = message.command.decode('ascii')
                 self.message_count[command] += 1
                 self.last_message[command] = message
                 getattr(self, 'on_' + command)(conn, message)
@@ -1293,13 +1683,39 @@ class NodeConnCB():
                 print("ERROR delivering %s (%s)" % (repr(message),
                                                     sys.exc_info()[0]))
                 raise
+            finally:
+                self.notify_waiters(command)
+
+    def notify_waiters(self, command=None):
+        """Wake up wait_for() calls waiting for a message of type command,
+        or for any message. The caller must hold self.lock."""
+        if command in self.command_received:
+            self.command_received[command].notify_all()
+        self.message_received.notify_all()
+
+    def wait_for(self, test_function, timeout=60, command=None):
+        """Waits until test_function returns True.
+
+        test_function is called under self.lock, first right away and then
+        whenever a message of type command (or any message, if command is
+        None) has been delivered. This returns as soon as the message that
+        makes it True arrives, instead of polling like util.wait_until()."""
+        with self.lock:
+            if command is None:
+                condition = self.message_received
+            else:
+                condition = self.command_received.setdefault(
+                    command, Condition(self.lock))
+            if not condition.wait_for(test_function, timeout):
+                raise AssertionError("wait_for %s timed out after %s s" %
+                                     (command or "message", timeout))
 
     def set_deliver_sleep_time(self, value):
-        with mininode_lock:
+        with self.lock:
             self.deliver_sleep_time = value
 
     def get_deliver_sleep_time(self):
-        with mininode_lock:
+        with self.lock:
             return self.deliver_sleep_time
 
     # Callback methods. Can be overridden by subclasses in individual test
@@ -1377,22 +1793,22 @@ class NodeConnCB():
 
     def wait_for_disconnect(self, timeout=60):
         def test_function(): return not self.connected
-        wait_until(test_function, timeout=timeout, lock=mininode_lock)
+        self.wait_for(test_function, timeout=timeout)
 
     # Message receiving helper methods
 
     def wait_for_block(self, blockhash, timeout=60):
         def test_function(): return self.last_message.get(
             "block") and self.last_message["block"].block.rehash() == blockhash
-        wait_until(test_function, timeout=timeout, lock=mininode_lock)
+        self.wait_for(test_function, timeout=timeout, command="block")
 
     def wait_for_getdata(self, timeout=60):
         def test_function(): return self.last_message.get("getdata")
-        wait_until(test_function, timeout=timeout, lock=mininode_lock)
+        self.wait_for(test_function, timeout=timeout, command="getdata")
 
     def wait_for_getheaders(self, timeout=60):
         def test_function(): return self.last_message.get("getheaders")
-        wait_until(test_function, timeout=timeout, lock=mininode_lock)
+        self.wait_for(test_function, timeout=timeout, command="getheaders")
 
     def wait_for_inv(self, expected_inv, timeout=60):
         """Waits for an INV message and checks that the first inv object in the message was as expected."""
@@ -1403,11 +1819,11 @@ class NodeConnCB():
         def test_function(): return self.last_message.get("inv") and \
             self.last_message["inv"].inv[0].type == expected_inv[0].type and \
             self.last_message["inv"].inv[0].hash == expected_inv[0].hash
-        wait_until(test_function, timeout=timeout, lock=mininode_lock)
+        self.wait_for(test_function, timeout=timeout, command="inv")
 
     def wait_for_verack(self, timeout=60):
         def test_function(): return self.message_count["verack"]
-        wait_until(test_function, timeout=timeout, lock=mininode_lock)
+        self.wait_for(test_function, timeout=timeout, command="verack")
 
     # Message sending helper functions
 
@@ -1429,14 +1845,14 @@ class NodeConnCB():
             if not self.last_message.get("pong"):
                 return False
             return self.last_message["pong"].nonce == self.ping_counter
-        wait_until(test_function, timeout=timeout, lock=mininode_lock)
+        self.wait_for(test_function, timeout=timeout, command="pong")
         self.ping_counter += 1
 
 # The actual NodeConn class
 # This class provides an interface for a p2p connection to a specified node
 
 
-class NodeConn(asyncore.dispatcher):
+class NodeConn(asyncio.BufferedProtocol):
     messagemap = {
         b"version": msg_version,
         b"verack": msg_verack,
@@ -1468,13 +1884,22 @@ class NodeConn(asyncore.dispatcher):
     }
 
     def __init__(self, dstaddr, dstport, rpc, callback, net="regtest", services=NODE_NETWORK, send_version=True):
-        asyncore.dispatcher.__init__(self, map=mininode_socket_map)
         self.dstaddr = dstaddr
         self.dstport = dstport
-        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
-        self.sendbuf = b""
-        self.recvbuf = b""
+        self.transport = None
+        # Guards the send state of this connection
+        self.lock = RLock()
+        # Messages waiting to be written, as (header, payload). They are
+        # written by _flush() on the network thread, which is scheduled once
+        # for all messages sent in between.
+        self.sendqueue = deque()
+        self.flush_scheduled = False
+        # Received data is read into recvbuf[recvlen:] and messages are
+        # framed from recvbuf[recvpos:recvlen]
+        self.recvbuf = bytearray(READ_BUFFER_SIZE)
+        self.recvpos = 0
+        self.recvlen = 0
+        self.recvview = None
         self.ver_send = 209
         self.ver_recv = 209
         self.last_sent = 0
@@ -1483,9 +1908,10 @@ class NodeConn(asyncore.dispatcher):
         self.cb = callback
         self.disconnect = False
         self.nServices = 0
+        self.rpc = rpc
 
         if send_version:
-            # stuff version msg into sendbuf
+            # stuff version msg into sendqueue
             vt = msg_version()
             vt.nServices = services
             vt.addrTo.ip = self.dstaddr
@@ -1497,36 +1923,74 @@ class NodeConn(asyncore.dispatcher):
         logger.info('Connecting to Bitcoin Node: %s:%d' %
                     (self.dstaddr, self.dstport))
 
+        # The connection is made by the network thread, either now if it is
+        # running or once it is started
+        with network_lock:
+            mininode_socket_map[id(self)] = self
+            if network_loop is not None:
+                network_loop.call_soon_threadsafe(self._connect)
+
+    def _connect(self):
+        """Start connecting on the network thread."""
+        if self.disconnect:
+            self._closed()
+            return
+        connect = network_loop.create_connection(
+            lambda: self, self.dstaddr, self.dstport)
+        network_loop.create_task(self._await_connection(connect))
+
+    async def _await_connection(self, connect):
         try:
-            self.connect((dstaddr, dstport))
-        except:
-            self.handle_close()
-        self.rpc = rpc
-
-    def handle_connect(self):
-        if self.state != "connected":
-            logger.debug("Connected & Listening: %s:%d" %
-                         (self.dstaddr, self.dstport))
+            await connect
+        except OSError as e:
+            logger.debug("Connecting to %s:%d failed: %r" %
+                         (self.dstaddr, self.dstport, e))
+            self._closed()
+
+    def _in_network_thread(self):
+        return network_thread_id == get_ident()
+
+    # asyncio.BufferedProtocol interface, called on the network thread
+
+    def connection_made(self, transport):
+        self.transport = transport
+        transport.get_extra_info('socket').setsockopt(
+            socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        logger.debug("Connected & Listening: %s:%d" %
+                     (self.dstaddr, self.dstport))
+        with self.lock:
             self.state = "connected"
+        self._flush()
+        with mininode_lock.shared(), self.cb.lock:
             self.cb.on_open(self)
+            self.cb.notify_waiters()
+        if self.disconnect:
+            self.handle_close()
 
-    def handle_close(self):
-        logger.debug("Closing connection to: %s:%d" %
-                     (self.dstaddr, self.dstport))
-        self.state = "closed"
-        self.recvbuf = b""
-        self.sendbuf = b""
-        try:
-            self.close()
-        except:
-            pass
-        self.cb.on_close(self)
-
-    def handle_read(self):
-        with mininode_lock:
-            t = self.recv(READ_BUFFER_SIZE)
-            if len(t) > 0:
-                self.recvbuf += t
+    def connection_lost(self, exc):
+        self._closed()
+
+    def get_buffer(self, sizehint):
+        buf = self.recvbuf
+        # Make room for the rest of a message whose header has been
+        # received, so it can be read in as few calls as the kernel allows
+        needed = max(self.recvlen + READ_BUFFER_SIZE, self._pending_message_end())
+        if len(buf) < needed:
+            # Grow by at most doubling, so memory is only committed as the
+            # message arrives and a big one costs a logarithmic number of
+            # copies
+            size = max(min(needed, 2 * len(buf)), self.recvlen + READ_BUFFER_SIZE)
+            buf.extend(bytes(size - len(buf)))
+        # Released in buffer_updated(), so that recvbuf can be resized
+        self.recvview = memoryview(buf)[self.recvlen:]
+        return self.recvview
+
+    def buffer_updated(self, nbytes):
+        # Only the network thread touches the receive buffer, so data is read
+        # and framed without holding any lock.
+        self.recvview.release()
+        self.recvview = None
+        self.recvlen += nbytes
 
         while True:
             msg = self.got_data()
@@ -1534,73 +1998,110 @@ class NodeConn(asyncore.dispatcher):
                 break
             self.got_message(msg)
 
-    def readable(self):
-        return True
+        # Drop the framed messages from the front of the buffer. Deleting a
+        # prefix of a bytearray does not move the remaining data.
+        if self.recvpos == self.recvlen and len(self.recvbuf) > MAX_IDLE_RECV_BUFFER:
+            self.recvbuf = bytearray(READ_BUFFER_SIZE)
+        elif self.recvpos > 0:
+            del self.recvbuf[:self.recvpos]
+        self.recvlen -= self.recvpos
+        self.recvpos = 0
+
+    def _pending_message_end(self):
+        """Returns the end offset in recvbuf of the message at recvpos if its
+        header has been received, or 0."""
+        header_len = 4 + 12 + 4 + (4 if self.ver_recv >= 209 else 0)
+        if self.recvlen - self.recvpos < header_len:
+            return 0
+        msglen = _int32.unpack_from(self.recvbuf, self.recvpos + 4 + 12)[0]
+        # got_data() rejects lengths out of range
+        return self.recvpos + header_len + min(max(msglen, 0), MAX_PROTOCOL_MESSAGE_LENGTH)
 
-    def writable(self):
-        with mininode_lock:
-            pre_connection = self.state == "connecting"
-            length = len(self.sendbuf)
-        return (length > 0 or pre_connection)
-
-    def handle_write(self):
-        with mininode_lock:
-            # asyncore does not expose socket connection, only the first read/write
-            # event, thus we must check connection manually here to know when we
-            # actually connect
-            if self.state == "connecting":
-                self.handle_connect()
-            if not self.writable():
-                return
+    def handle_close(self):
+        """Close the connection. May be called from any thread."""
+        if not self._in_network_thread():
+            with network_lock:
+                if network_loop is not None:
+                    network_loop.call_soon_threadsafe(self.handle_close)
+                    return
+            self._closed()
+            return
+        logger.debug("Closing connection to: %s:%d" %
+                     (self.dstaddr, self.dstport))
+        if self.transport is not None:
+            # connection_lost() follows
+            self.transport.close()
+        else:
+            self._closed()
 
-            try:
-                sent = self.send(self.sendbuf)
-            except:
-                self.handle_close()
-                return
-            self.sendbuf = self.sendbuf[sent:]
+    def _closed(self):
+        global network_loop
+        if self.state == "closed":
+            return
+        self.state = "closed"
+        self.recvbuf = bytearray()
+        self.recvpos = 0
+        self.recvlen = 0
+        with self.lock:
+            self.sendqueue = deque()
+            self.transport = None
+        with mininode_lock.shared(), self.cb.lock:
+            self.cb.on_close(self)
+            self.cb.notify_waiters()
+        with network_lock:
+            mininode_socket_map.pop(id(self), None)
+            if not mininode_socket_map and network_loop is not None and self._in_network_thread():
+                # The last connection is gone, let the network thread exit.
+                # Connections made from now on wait for the next one.
+                network_loop.stop()
+                network_loop = None
 
     def got_data(self):
+        """Frame and deserialize the next message in the receive buffer.
+
+        Returns None if the buffer does not yet hold a complete message."""
         try:
-            with mininode_lock:
-                if len(self.recvbuf) < 4:
-                    return None
-                if self.recvbuf[:4] != self.MAGIC_BYTES[self.network]:
-                    raise ValueError("got garbage %s" % repr(self.recvbuf))
-                if self.ver_recv < 209:
-                    if len(self.recvbuf) < 4 + 12 + 4:
-                        return None
-                    command = self.recvbuf[4:4 + 12].split(b"\x00", 1)[0]
-                    msglen = struct.unpack(
-                        "<i", self.recvbuf[4 + 12:4 + 12 + 4])[0]
-                    checksum = None
-                    if len(self.recvbuf) < 4 + 12 + 4 + msglen:
-                        return None
-                    msg = self.recvbuf[4 + 12 + 4:4 + 12 + 4 + msglen]
-                    self.recvbuf = self.recvbuf[4 + 12 + 4 + msglen:]
-                else:
-                    if len(self.recvbuf) < 4 + 12 + 4 + 4:
-                        return None
-                    command = self.recvbuf[4:4 + 12].split(b"\x00", 1)[0]
-                    msglen = struct.unpack(
-                        "<i", self.recvbuf[4 + 12:4 + 12 + 4])[0]
-                    checksum = self.recvbuf[4 + 12 + 4:4 + 12 + 4 + 4]
-                    if len(self.recvbuf) < 4 + 12 + 4 + 4 + msglen:
-                        return None
-                    msg = self.recvbuf[4 + 12 + 4 + 4:4 + 12 + 4 + 4 + msglen]
-                    h = sha256(sha256(msg))
-                    if checksum != h[:4]:
-                        raise ValueError(
-                            "got bad checksum " + repr(self.recvbuf))
-                    self.recvbuf = self.recvbuf[4+12+4+4+msglen:]
-                if command not in self.messagemap:
-                    logger.warning("Received unknown command from %s:%d: '%s' %s" % (
-                        self.dstaddr, self.dstport, command, repr(msg)))
-                    raise ValueError("Unknown command: '%s'" % (command))
-                f = BytesIO(msg)
-                m = self.messagemap[command]()
-                m.deserialize(f)
-                return m
+            buf = self.recvbuf
+            start = self.recvpos
+            available = self.recvlen - start
+            if available < 4:
+                return None
+            if buf[start:start + 4] != self.MAGIC_BYTES[self.network]:
+                raise ValueError("got garbage %s" % repr(bytes(buf[start:self.recvlen])))
+            if self.ver_recv < 209:
+                header_len = 4 + 12 + 4
+            else:
+                header_len = 4 + 12 + 4 + 4
+            if available < header_len:
+                return None
+            command = bytes(buf[start + 4:start + 4 + 12]).split(b"\x00", 1)[0]
+            msglen = _int32.unpack_from(buf, start + 4 + 12)[0]
+            if not 0 <= msglen <= MAX_PROTOCOL_MESSAGE_LENGTH:
+                raise ValueError("got bad message length %d for %r" % (msglen, command))
+            if available < header_len + msglen:
+                return None
+            # The body is copied out of the buffer once; BytesIO shares the
+            # bytes object instead of copying it again
+            view = memoryview(buf)[start + header_len:start + header_len + msglen]
+            try:
+                msg = view.tobytes()
+            finally:
+                view.release()
+            if self.ver_recv >= 209:
+                checksum = buf[start + 4 + 12 + 4:start + 4 + 12 + 4 + 4]
+                h = sha256(sha256(msg))
+                if checksum != h[:4]:
+                    raise ValueError(
+                        "got bad checksum " + repr(bytes(buf[start:self.recvlen])))
+            self.recvpos = start + header_len + msglen
+            if command not in self.messagemap:
+                logger.warning("Received unknown command from %s:%d: '%s' %s" % (
+                    self.dstaddr, self.dstport, command, repr(msg)))
+                raise ValueError("Unknown command: '%s'" % (command))
+            f = BytesIO(msg)
+            m = self.messagemap[command]()
+            m.deserialize(f)
+            return m
 
         except Exception as e:
             logger.exception('got_data:', repr(e))
@@ -1612,26 +2113,49 @@ class NodeConn(asyncore.dispatcher):
         self._log_message("send", message)
         command = message.command
         data = message.serialize()
-        tmsg = self.MAGIC_BYTES[self.network]
-        tmsg += command
-        tmsg += b"\x00" * (12 - len(command))
-        tmsg += struct.pack("<I", len(data))
+        header = self.MAGIC_BYTES[self.network] + command.ljust(12, b"\x00")
+        header += _uint32.pack(len(data))
         if self.ver_send >= 209:
             th = sha256(data)
             h = sha256(th)
-            tmsg += h[:4]
-        tmsg += data
-        with mininode_lock:
-            if (len(self.sendbuf) == 0 and not pushbuf):
-                try:
-                    sent = self.send(tmsg)
-                    self.sendbuf = tmsg[sent:]
-                except BlockingIOError:
-                    self.sendbuf = tmsg
-            else:
-                self.sendbuf += tmsg
+            header += h[:4]
+        with self.lock:
+            self.sendqueue.append((header, data))
+            loop = network_loop
+            if self.state == "connected" and not self.flush_scheduled and loop is not None:
+                self.flush_scheduled = True
+                if self._in_network_thread():
+                    loop.call_soon(self._flush)
+                else:
+                    # Wake the network thread right away
+                    loop.call_soon_threadsafe(self._flush)
             self.last_sent = time.time()
 
+    def _flush(self):
+        """Write the queued messages. Runs on the network thread.
+
+        Small messages are joined, so a burst of them goes out in one send
+        call. A large payload is written separately rather than joined, so
+        the transport sends it straight from the serialized bytes when it
+        can."""
+        with self.lock:
+            self.flush_scheduled = False
+            queue, self.sendqueue = self.sendqueue, deque()
+            transport = self.transport
+        if transport is None or transport.is_closing():
+            return
+        pending = []
+        for header, data in queue:
+            pending.append(header)
+            if len(data) > MAX_COALESCED_PAYLOAD:
+                transport.write(b"".join(pending))
+                transport.write(data)
+                pending = []
+            else:
+                pending.append(data)
+        if pending:
+            transport.write(b"".join(pending))
+
     def got_message(self, message):
         if message.command == b"version":
             if message.nVersion <= BIP0031_VERSION:
@@ -1642,6 +2166,9 @@ class NodeConn(asyncore.dispatcher):
         self.cb.deliver(self, message)
 
     def _log_message(self, direction, msg):
+        # repr() of a big block is expensive, and decodes a lazy one
+        if not logger.isEnabledFor(logging.DEBUG):
+            return
         if direction == "send":
             log_message = "Send message to "
         elif direction == "receive":
@@ -1654,21 +2181,33 @@ class NodeConn(asyncore.dispatcher):
 
     def disconnect_node(self):
         self.disconnect = True
+        self.handle_close()
 
 
 class NetworkThread(Thread):
+    """Runs the asyncio event loop of all NodeConns until the last of them
+    is closed."""
 
     def run(self):
-        while mininode_socket_map:
-            # We check for whether to disconnect outside of the asyncore
-            # loop to workaround the behavior of asyncore when using
-            # select
-            disconnected = []
-            for fd, obj in mininode_socket_map.items():
-                if obj.disconnect:
-                    disconnected.append(obj)
-            [obj.handle_close() for obj in disconnected]
-            asyncore.loop(0.1, use_poll=True, map=mininode_socket_map, count=1)
+        global network_loop, network_thread_id
+        loop = asyncio.new_event_loop()
+        with network_lock:
+            if not mininode_socket_map:
+                loop.close()
+                return
+            network_loop = loop
+            network_thread_id = get_ident()
+            for conn in list(mininode_socket_map.values()):
+                loop.call_soon(conn._connect)
+        try:
+            loop.run_forever()
+        finally:
+            with network_lock:
+                if network_loop is loop:
+                    network_loop = None
+                if network_thread_id == get_ident():
+                    network_thread_id = None
+            loop.close()
         logger.debug("Network thread closing")
 
 
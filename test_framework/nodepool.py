@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+# Copyright (c) 2018 The Bitcoin developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Pool of running bitcoinds shared between test scripts.
+
+Starting bitcoinds and waiting for their RPC server dominates the runtime of
+short test scripts. With --nodepool, test_runner keeps a NodePool of started
+nodes and hands them out to test scripts which set reuse_nodes.
+
+NodePool: runs in test_runner, starts nodes from the cache snapshot and
+          leases them to test scripts over a unix socket
+NodePoolClient: used by BitcoinTestFramework to lease and release nodes
+
+Nodes are leased as a NodeSet: up to MAX_NODES nodes with indices 0..n-1
+sharing one port seed, so p2p_port() and rpc_port() work unchanged in the
+test script. A set is reused for leases with the same network whose
+extra_args are a prefix of the ones it was started with; extra nodes of a
+larger set are left alone.
+
+Sets are started ahead of demand. test_runner prestarts one set per job, and
+a released set is restored in the background: its nodes are stopped, their
+datadirs are cloned afresh from the cache snapshot and the nodes are
+restarted. So no chain, mempool, wallet, ban list or other node state leaks
+from one test script into the next.
+
+The pool runs at most max_sets sets, one per job in test_runner. A lease
+which no set matches stops the least recently used idle set to make room
+for a new one, or waits for a set to be released or restored.
+"""
+
+import logging
+from multiprocessing.connection import Client, Listener
+import os
+import shutil
+import threading
+
+from .test_node import TestNode
+from .util import (
+    MAX_NODES,
+    PortSeed,
+    clone_tree,
+    get_cache_snapshot_dir,
+    initialize_datadir,
+)
+
+logger = logging.getLogger("TestFramework.nodepool")
+
+SOCKET_NAME = "nodepool.sock"
+
+# initialize_datadir() derives ports from the global PortSeed, so node sets
+# must not initialize their datadirs concurrently.
+datadir_lock = threading.Lock()
+
+
+class NodeSet():
+    """A group of running nodes sharing a port seed."""
+
+    def __init__(self, dirname, port_seed, extra_args, network):
+        self.dirname = dirname
+        self.port_seed = port_seed
+        self.extra_args = extra_args
+        self.network = network
+        self.nodes = []
+
+    def matches(self, num_nodes, extra_args, network):
+        return (network == self.network and
+                num_nodes <= len(self.extra_args) and
+                self.extra_args[:num_nodes] == extra_args)
+
+    def start(self, snapshot_dir, binary):
+        """Start the nodes on fresh clones of the cache snapshot."""
+        with datadir_lock:
+            PortSeed.n = self.port_seed
+            os.makedirs(self.dirname, exist_ok=True)
+            for i, args in enumerate(self.extra_args):
+                datadir = os.path.join(self.dirname, "node" + str(i))
+                shutil.rmtree(datadir, ignore_errors=True)
+                clone_tree(os.path.join(snapshot_dir, "node" + str(i)), datadir)
+                initialize_datadir(self.dirname, i, logger)
+                self.nodes.append(TestNode(i, self.dirname, args, None, None,
+                                           binary, None, 0, None))
+        try:
+            for node in self.nodes:
+                node.start(node.extra_args, self.network)
+            for node in self.nodes:
+                node.wait_for_rpc_connection()
+        except:
+            self.stop()
+            raise
+
+    def stop(self):
+        for node in self.nodes:
+            try:
+                node.stop_node()
+            except Exception:
+                logger.exception("Stopping pooled node failed")
+        for node in self.nodes:
+            try:
+                node.wait_until_stopped()
+            except Exception:
+                if node.process is not None:
+                    node.process.kill()
+                    node.process.wait()
+        self.nodes = []
+        shutil.rmtree(self.dirname, ignore_errors=True)
+
+
+class NodePool():
+    """Leases running nodes to test scripts.
+
+    Each test script connection is served by its own thread. The connection
+    stays open for the life of the lease, so a test script which dies without
+    releasing its nodes still returns them to the pool."""
+
+    def __init__(self, dirname, cachedir, binary, first_port_seed, max_sets):
+        self.dirname = dirname
+        self.snapshot_dir = get_cache_snapshot_dir(cachedir, binary)
+        self.binary = binary
+        self.next_port_seed = first_port_seed
+        self.max_sets = max_sets
+        # Least recently used first
+        self.idle = []
+        self.leased = []
+        # Sets being started or restored in the background
+        self.starting = []
+        self.closed = False
+        self.cond = threading.Condition()
+        os.makedirs(self.dirname, exist_ok=True)
+        self.address = os.path.join(self.dirname, SOCKET_NAME)
+        self.listener = Listener(self.address, family='AF_UNIX')
+        self.thread = threading.Thread(target=self._accept, daemon=True)
+        self.thread.start()
+
+    def flag(self):
+        return "--nodepool={}".format(self.address)
+
+    def prestart(self, num_nodes, count, network='regtest'):
+        """Start count sets of num_nodes nodes without extra arguments in
+        the background."""
+        with self.cond:
+            count = min(count, self.max_sets - self._num_sets())
+            node_sets = [self._new_set([[]] * num_nodes, network)
+                         for _ in range(count)]
+            self.starting.extend(node_sets)
+        for node_set in node_sets:
+            self._restart_in_background(node_set)
+
+    def shutdown(self):
+        self.listener.close()
+        with self.cond:
+            self.closed = True
+            # Sets still starting are stopped by their thread when done
+            while self.starting:
+                self.cond.wait()
+            node_sets = self.idle + self.leased
+            self.idle = []
+            self.leased = []
+        for node_set in node_sets:
+            node_set.stop()
+
+    def _accept(self):
+        while True:
+            try:
+                conn = self.listener.accept()
+            except OSError:
+                # Listener closed by shutdown()
+                return
+            threading.Thread(target=self._serve, args=(conn,),
+                             daemon=True).start()
+
+    def _serve(self, conn):
+        node_set = None
+        try:
+            request = conn.recv()
+            node_set = self.lease(
+                request['num_nodes'], request['extra_args'], request['network'])
+            conn.send({'dirname': node_set.dirname,
+                       'port_seed': node_set.port_seed})
+            # Block until the test script releases the nodes or goes away
+            conn.recv()
+        except EOFError:
+            pass
+        except Exception as e:
+            logger.exception("Serving node pool request failed")
+            try:
+                conn.send({'error': repr(e)})
+            except OSError:
+                pass
+        finally:
+            if node_set is not None:
+                self.release(node_set)
+            conn.close()
+
+    def _num_sets(self):
+        # Called with self.cond held
+        return len(self.idle) + len(self.leased) + len(self.starting)
+
+    def _new_set(self, extra_args, network):
+        # Called with self.cond held
+        port_seed = self.next_port_seed
+        self.next_port_seed += 1
+        return NodeSet(os.path.join(self.dirname, "set%d" % port_seed),
+                       port_seed, extra_args, network)
+
+    def lease(self, num_nodes, extra_args, network):
+        assert num_nodes <= MAX_NODES
+        evicted = None
+        with self.cond:
+            while True:
+                for node_set in self.idle:
+                    if node_set.matches(num_nodes, extra_args, network):
+                        self.idle.remove(node_set)
+                        self.leased.append(node_set)
+                        return node_set
+                # Wait for a matching set which is being started or restored
+                if any(node_set.matches(num_nodes, extra_args, network)
+                       for node_set in self.starting):
+                    self.cond.wait()
+                    continue
+                if self._num_sets() < self.max_sets:
+                    break
+                if self.idle:
+                    evicted = self.idle.pop(0)
+                    break
+                # Wait for a set to be released or restored
+                self.cond.wait()
+            node_set = self._new_set(extra_args, network)
+            self.leased.append(node_set)
+        try:
+            if evicted is not None:
+                evicted.stop()
+            node_set.start(self.snapshot_dir, self.binary)
+        except:
+            with self.cond:
+                self.leased.remove(node_set)
+                self.cond.notify_all()
+            raise
+        return node_set
+
+    def release(self, node_set):
+        with self.cond:
+            if node_set not in self.leased:
+                return
+            self.leased.remove(node_set)
+            if not self.closed:
+                self.starting.append(node_set)
+                self._restart_in_background(node_set)
+                return
+        node_set.stop()
+
+    def _restart_in_background(self, node_set):
+        threading.Thread(target=self._restart, args=(node_set,),
+                         daemon=True).start()
+
+    def _restart(self, node_set):
+        """Restore node_set from the cache snapshot and make it idle."""
+        try:
+            node_set.stop()
+            node_set.start(self.snapshot_dir, self.binary)
+            started = True
+        except Exception:
+            logger.exception("Starting pooled nodes failed")
+            started = False
+        with self.cond:
+            self.starting.remove(node_set)
+            reusable = started and not self.closed
+            if reusable:
+                self.idle.append(node_set)
+            self.cond.notify_all()
+        if not reusable:
+            node_set.stop()
+
+
+class NodePoolClient():
+    """Leases nodes from the NodePool of test_runner."""
+
+    def __init__(self, address):
+        self.conn = Client(address, family='AF_UNIX')
+
+    def lease(self, num_nodes, extra_args, network):
+        """Returns (dirname, port_seed) of the leased nodes."""
+        self.conn.send({'num_nodes': num_nodes,
+                        'extra_args': extra_args,
+                        'network': network})
+        response = self.conn.recv()
+        if 'error' in response:
+            raise RuntimeError("Leasing nodes failed: %s" % response['error'])
+        return response['dirname'], response['port_seed']
+
+    def release(self):
+        try:
+            self.conn.send({})
+        finally:
+            self.conn.close()
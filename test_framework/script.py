@@ -7,7 +7,7 @@
 This file is modified from python-bitcoinlib.
 """
 
-from .mininode import CTransaction, CTxOut, sha256, hash256, uint256_from_str, ser_uint256, ser_string
+from .mininode import CTransaction, CTxOut, sha256, hash256, uint256_from_str, ser_compact_size, ser_uint256, ser_string
 from binascii import hexlify
 import hashlib
 
@@ -886,90 +886,109 @@ def SignatureHash(script, txTo, inIdx, hashtype):
 
     if inIdx >= len(txTo.vin):
         return (HASH_ONE, "inIdx %d out of range (%d)" % (inIdx, len(txTo.vin)))
-    txtmp = CTransaction(txTo)
 
-    for txin in txtmp.vin:
-        txin.scriptSig = b''
-    txtmp.vin[inIdx].scriptSig = FindAndDelete(
-        script, CScript([OP_CODESEPARATOR]))
+    # The transaction is modified as it is written into the hash, without
+    # copying it: all scriptSigs are emptied except the one of the signed
+    # input, which is replaced by the script, and vout and the nSequence of
+    # the other inputs depend on the hashtype.
+    vin = txTo.vin
+    vout = txTo.vout
+    scriptIdx = range(len(vin))[inIdx]
+    blankSequences = False
 
     if (hashtype & 0x1f) == SIGHASH_NONE:
-        txtmp.vout = []
-
-        for i in range(len(txtmp.vin)):
-            if i != inIdx:
-                txtmp.vin[i].nSequence = 0
+        vout = []
+        blankSequences = True
 
     elif (hashtype & 0x1f) == SIGHASH_SINGLE:
         outIdx = inIdx
-        if outIdx >= len(txtmp.vout):
-            return (HASH_ONE, "outIdx %d out of range (%d)" % (outIdx, len(txtmp.vout)))
-
-        tmp = txtmp.vout[outIdx]
-        txtmp.vout = []
-        for i in range(outIdx):
-            txtmp.vout.append(CTxOut(-1))
-        txtmp.vout.append(tmp)
+        if outIdx >= len(txTo.vout):
+            return (HASH_ONE, "outIdx %d out of range (%d)" % (outIdx, len(txTo.vout)))
 
-        for i in range(len(txtmp.vin)):
-            if i != inIdx:
-                txtmp.vin[i].nSequence = 0
+        vout = [CTxOut(-1)] * len(range(outIdx)) + [txTo.vout[outIdx]]
+        blankSequences = True
 
+    vinIdxs = range(len(vin))
     if hashtype & SIGHASH_ANYONECANPAY:
-        tmp = txtmp.vin[inIdx]
-        txtmp.vin = []
-        txtmp.vin.append(tmp)
+        vinIdxs = [scriptIdx]
+
+    # Inputs with an empty scriptSig, as prevout + 0x00 + nSequence
+    inputs = [vin[i].prevout.serialize() +
+              (b"\x00\x00\x00\x00\x00" if blankSequences and i != inIdx
+               else b"\x00" + struct.pack("<I", vin[i].nSequence))
+              for i in vinIdxs]
+    pos = vinIdxs.index(scriptIdx)
+    inputs[pos] = b"".join((inputs[pos][:36],
+                            ser_string(FindAndDelete(
+                                script, CScript([OP_CODESEPARATOR]))),
+                            inputs[pos][37:]))
+
+    h = hashlib.sha256()
+    h.update(struct.pack("<i", txTo.nVersion))
+    h.update(ser_compact_size(len(inputs)))
+    h.update(b"".join(inputs))
+    h.update(ser_compact_size(len(vout)))
+    h.update(b"".join([txout.serialize() for txout in vout]))
+    h.update(struct.pack("<I", txTo.nLockTime))
+    h.update(struct.pack(b"<I", hashtype))
+
+    hash = sha256(h.digest())
 
-    s = txtmp.serialize()
-    s += struct.pack(b"<I", hashtype)
+    return (hash, None)
 
-    hash = hash256(s)
 
-    return (hash, None)
+class PrecomputedTransactionData():
+    """The hashPrevouts, hashSequence and hashOutputs of a transaction.
 
-# TODO: Allow cached hashPrevouts/hashSequence/hashOutputs to be provided.
-# Performance optimization probably not necessary for python tests, however.
-# Note that this corresponds to sigversion == 1 in EvalScript, which is used
-# for version 0 witnesses.
+    SignatureHashForkId needs them for every input, and computing them
+    serializes all inputs and outputs. Compute them once and pass them to
+    SignatureHashForkId for each input, which makes signing all the inputs
+    linear instead of quadratic. They do not cover the scriptSigs, so they
+    stay valid while the inputs are signed."""
 
+    def __init__(self, txTo):
+        self.hashPrevouts = uint256_from_str(hash256(
+            b"".join([i.prevout.serialize() for i in txTo.vin])))
+        self.hashSequence = uint256_from_str(hash256(
+            b"".join([struct.pack("<I", i.nSequence) for i in txTo.vin])))
+        self.hashOutputs = uint256_from_str(hash256(
+            b"".join([o.serialize() for o in txTo.vout])))
 
-def SignatureHashForkId(script, txTo, inIdx, hashtype, amount):
+
+# Note that this corresponds to sigversion == 1 in EvalScript, which is used
+# for version 0 witnesses.
+def SignatureHashForkId(script, txTo, inIdx, hashtype, amount, txdata=None):
 
     hashPrevouts = 0
     hashSequence = 0
     hashOutputs = 0
 
+    if txdata is None and not (hashtype & SIGHASH_ANYONECANPAY and
+                               (hashtype & 0x1f) in (SIGHASH_SINGLE, SIGHASH_NONE)):
+        txdata = PrecomputedTransactionData(txTo)
+
     if not (hashtype & SIGHASH_ANYONECANPAY):
-        serialize_prevouts = bytes()
-        for i in txTo.vin:
-            serialize_prevouts += i.prevout.serialize()
-        hashPrevouts = uint256_from_str(hash256(serialize_prevouts))
+        hashPrevouts = txdata.hashPrevouts
 
     if (not (hashtype & SIGHASH_ANYONECANPAY) and (hashtype & 0x1f) != SIGHASH_SINGLE and (hashtype & 0x1f) != SIGHASH_NONE):
-        serialize_sequence = bytes()
-        for i in txTo.vin:
-            serialize_sequence += struct.pack("<I", i.nSequence)
-        hashSequence = uint256_from_str(hash256(serialize_sequence))
+        hashSequence = txdata.hashSequence
 
     if ((hashtype & 0x1f) != SIGHASH_SINGLE and (hashtype & 0x1f) != SIGHASH_NONE):
-        serialize_outputs = bytes()
-        for o in txTo.vout:
-            serialize_outputs += o.serialize()
-        hashOutputs = uint256_from_str(hash256(serialize_outputs))
+        hashOutputs = txdata.hashOutputs
     elif ((hashtype & 0x1f) == SIGHASH_SINGLE and inIdx < len(txTo.vout)):
         serialize_outputs = txTo.vout[inIdx].serialize()
         hashOutputs = uint256_from_str(hash256(serialize_outputs))
 
-    ss = bytes()
-    ss += struct.pack("<i", txTo.nVersion)
-    ss += ser_uint256(hashPrevouts)
-    ss += ser_uint256(hashSequence)
-    ss += txTo.vin[inIdx].prevout.serialize()
-    ss += ser_string(script)
-    ss += struct.pack("<q", amount)
-    ss += struct.pack("<I", txTo.vin[inIdx].nSequence)
-    ss += ser_uint256(hashOutputs)
-    ss += struct.pack("<i", txTo.nLockTime)
-    ss += struct.pack("<I", hashtype)
+    ss = b"".join((
+        struct.pack("<i", txTo.nVersion),
+        ser_uint256(hashPrevouts),
+        ser_uint256(hashSequence),
+        txTo.vin[inIdx].prevout.serialize(),
+        ser_string(script),
+        struct.pack("<q", amount),
+        struct.pack("<I", txTo.vin[inIdx].nSequence),
+        ser_uint256(hashOutputs),
+        struct.pack("<i", txTo.nLockTime),
+        struct.pack("<I", hashtype)))
 
     return hash256(ss)
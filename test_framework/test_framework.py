@@ -8,6 +8,7 @@ from collections import deque
 from enum import Enum
 import logging
 import argparse
+import json
 import os
 import pdb
 import shutil
@@ -16,19 +17,23 @@ import tempfile
 import time
 import traceback
 
-from .authproxy import JSONRPCException
+from .authproxy import JSONRPCException, SimpleJSONCodec, set_default_codec
 from . import coverage
+from .nodepool import NodePoolClient
 from .test_node import TestNode
 from .util import (
     MAX_NODES,
     PortSeed,
     assert_equal,
     check_json_precision,
+    clone_tree,
     connect_nodes_bi,
     disconnect_nodes,
+    get_cache_snapshot_dir,
     initialize_datadir,
     log_filename,
     p2p_port,
+    rusage_to_dict,
     set_node_times,
     sync_blocks,
     sync_mempools,
@@ -60,6 +65,13 @@ class BitcoinTestFramework():
     - setup_network()
     - setup_nodes()
 
+    Tests which use the cached chain, the default setup_chain() and
+    setup_nodes(), and never stop or restart their nodes can set reuse_nodes
+    in set_test_params(). When run by test_runner with --nodepool, such tests
+    lease already running nodes instead of starting their own. The pool
+    restores leased nodes from the cache snapshot once they are released, so
+    tests may change any node state.
+
     The __init__() and main() methods should not be overridden.
 
     This class also contains various public and private helper methods."""
@@ -67,8 +79,10 @@ class BitcoinTestFramework():
     def __init__(self):
         """Sets test framework defaults. Do not override this method. Instead, override the set_test_params() method"""
         self.setup_clean_chain = False
+        self.reuse_nodes = False
         self.nodes = []
         self.mocktime = 0
+        self.node_pool = None
 
     def main(self):
         """Main function. This should not be overridden by the subclass test scripts."""
@@ -98,6 +112,12 @@ class BitcoinTestFramework():
                           help="Attach a python debugger if test fails")
         parser.add_argument("--net", dest="network", default="regtest", choices=['regtest', 'testnet'],
                           help="regtest or testnet")
+        parser.add_argument("--nodepool", dest="nodepool",
+                          help="Address of the test_runner node pool to lease nodes from")
+        parser.add_argument("--rusagefile", dest="rusagefile",
+                          help="Write the resource usage of the test and its bitcoinds to this file as JSON")
+        parser.add_argument("--rpccodec", dest="rpccodec", default="json", choices=['json', 'simplejson'],
+                          help="JSON codec for RPC requests and responses. simplejson parses large responses faster but must be installed")
 
         self.add_options(parser)
         self.options = parser.parse_args()
@@ -113,6 +133,9 @@ class BitcoinTestFramework():
 
         check_json_precision()
 
+        if self.options.rpccodec == 'simplejson':
+            set_default_codec(SimpleJSONCodec())
+
         self.options.cachedir = os.path.abspath(self.options.cachedir)
 
         # Set up temp directory and start logging
@@ -149,7 +172,11 @@ class BitcoinTestFramework():
             print("Testcase failed. Attaching python debugger. Enter ? for help")
             pdb.set_trace()
 
-        if not self.options.noshutdown:
+        if self.node_pool is not None:
+            self.log.info("Releasing nodes to the node pool")
+            self.node_pool.release()
+            self.nodes = []
+        elif not self.options.noshutdown:
             self.log.info("Stopping nodes")
             if self.nodes:
                 try:
@@ -187,6 +214,9 @@ class BitcoinTestFramework():
                         print("Opening file %s failed." % fn)
                         traceback.print_exc()
 
+        if self.options.rusagefile:
+            self._write_rusage()
+
         if success == TestStatus.PASSED:
             self.log.info("Tests successful")
             sys.exit(TEST_EXIT_PASSED)
@@ -211,7 +241,9 @@ class BitcoinTestFramework():
     def setup_chain(self):
         """Override this method to customize blockchain setup"""
         self.log.info("Initializing test directory " + self.options.tmpdir)
-        if self.setup_clean_chain:
+        if self.options.nodepool and self.reuse_nodes and not self.setup_clean_chain:
+            self._lease_nodes()
+        elif self.setup_clean_chain:
             self._initialize_chain_clean()
         else:
             self._initialize_chain()
@@ -229,6 +261,9 @@ class BitcoinTestFramework():
 
     def setup_nodes(self):
         """Override this method to customize test node setup"""
+        if self.node_pool is not None:
+            # Leased nodes are already running
+            return
         extra_args = None
         if hasattr(self, "extra_args"):
             extra_args = self.extra_args
@@ -408,73 +443,149 @@ class BitcoinTestFramework():
             rpc_handler.setLevel(logging.DEBUG)
             rpc_logger.addHandler(rpc_handler)
 
+    def _lease_nodes(self):
+        """Lease running nodes on the cached chain from the node pool."""
+        extra_args = getattr(self, "extra_args", [[]] * self.num_nodes)
+        self.node_pool = NodePoolClient(self.options.nodepool)
+        dirname, PortSeed.n = self.node_pool.lease(
+            self.num_nodes, extra_args, self.options.network)
+        self.log.debug("Leased %d nodes in %s" % (self.num_nodes, dirname))
+        for i in range(self.num_nodes):
+            node = TestNode(i, dirname, extra_args[i], None, timewait=None, binary=None,
+                            stderr=None, mocktime=self.mocktime, coverage_dir=self.options.coveragedir)
+            node.attach()
+            self.nodes.append(node)
+        if self.options.coveragedir is not None:
+            for node in self.nodes:
+                coverage.write_all_rpc_commands(
+                    self.options.coveragedir, node.rpc)
+
+    def _write_rusage(self):
+        """Write the resource usage of this process and of the reaped bitcoinds.
+
+        The test runner uses this to tell harness overhead from node overhead."""
+        import resource
+
+        usage = {'harness': rusage_to_dict(resource.getrusage(resource.RUSAGE_SELF)),
+                 'nodes': rusage_to_dict(resource.getrusage(resource.RUSAGE_CHILDREN))}
+        try:
+            with open(self.options.rusagefile, 'w', encoding='utf8') as f:
+                json.dump(usage, f)
+        except OSError:
+            self.log.exception("Writing resource usage failed")
+
     def _initialize_chain(self):
         """Initialize a pre-mined blockchain for use by the test.
 
         Create a cache of a 200-block-long chain (with wallet) for MAX_NODES
-        Afterward, create num_nodes copies from the cache."""
+        Afterward, create num_nodes copies from the cache.
+
+        The cache is stored in a snapshot directory keyed by the hash of the
+        bitcoind binary, so it is rebuilt whenever the binary changes."""
 
         assert self.num_nodes <= MAX_NODES
+        snapshot_dir = get_cache_snapshot_dir(
+            self.options.cachedir, os.getenv("BITCOIND", "bitcoind"))
         create_cache = False
         for i in range(MAX_NODES):
-            if not os.path.isdir(os.path.join(self.options.cachedir, 'node' + str(i))):
+            if not os.path.isdir(os.path.join(snapshot_dir, 'node' + str(i))):
                 create_cache = True
                 break
 
         if create_cache:
-            self.log.debug("Creating data directories from cached datadir")
-
-            # find and delete old cache directories if any exist
-            for i in range(MAX_NODES):
-                if os.path.isdir(os.path.join(self.options.cachedir, "node" + str(i))):
-                    shutil.rmtree(os.path.join(
-                        self.options.cachedir, "node" + str(i)))
-
-            # Create cache directories, run bitcoinds:
-            for i in range(MAX_NODES):
-                initialize_datadir(self.options.cachedir, i, self.log)
-                self.nodes.append(TestNode(i, self.options.cachedir, extra_args=[
-                ], rpchost=None, timewait=None, binary=None, stderr=None, mocktime=self.mocktime,
-                                           coverage_dir=None))
-                self.start_node(i)
-                if i > 0:
-                    connect_nodes(self.nodes[i], 0)
-
-            # Wait for RPC connections to be ready
-            for node in self.nodes:
-                node.wait_for_rpc_connection()
-
-            # Create a 200-block-long chain; each of the 4 first nodes
-            # gets 25 mature blocks and 25 immature.
-            # Note: To preserve compatibility with older versions of
-            # initialize_chain, only 4 nodes will generate coins.
-            #
-            # blocks are created with timestamps 10 minutes apart
-            # starting from 2010 minutes in the past
-            self.enable_mocktime(int(time.time()) - (201 * 10 * 60))
-            for i in range(2):
-                for peer in range(4):
-                    for j in range(25):
-                        set_node_times(self.nodes, self.mocktime)
-                        self.nodes[peer].generate(1)
-                        self.mocktime += 10 * 60
-                    # Must sync before next peer starts generating blocks
-                    sync_blocks(self.nodes)
+            self.log.debug("Creating cache snapshot %s" % snapshot_dir)
+
+            # Build the cache in a private directory and publish it with a
+            # rename, so concurrent tests never see a partial snapshot
+            build_dir = os.path.join(
+                self.options.cachedir, "build-%d" % os.getpid())
+            shutil.rmtree(build_dir, ignore_errors=True)
+            built = False
+            try:
+                self._build_cache(build_dir)
+                built = True
+            finally:
+                if not built:
+                    # Kill the cache nodes, which may be half started, and
+                    # drop the half built cache
+                    for node in self.nodes:
+                        if node.process is not None:
+                            node.process.kill()
+                            node.process.wait()
+                    self.nodes = []
+                    self.disable_mocktime()
+                    shutil.rmtree(build_dir, ignore_errors=True)
 
-            # Shut them down, and clean up cache directories:
-            self.stop_nodes()
-            self.nodes = []
-            self.disable_mocktime()
-            # for i in range(MAX_NODES):
-                # shutil.rmtree(log_filename(self.options.cachedir, i, "logs"))
+            try:
+                os.rename(build_dir, snapshot_dir)
+            except OSError:
+                # Another test published the snapshot first. Tests may be
+                # cloning it already, so keep it and drop this build.
+                if not os.path.isdir(snapshot_dir):
+                    raise
+                shutil.rmtree(build_dir, ignore_errors=True)
+
+            # Remove the snapshots built for other binaries
+            for old_dir in os.listdir(self.options.cachedir):
+                old_dir = os.path.join(self.options.cachedir, old_dir)
+                if os.path.basename(old_dir).startswith("snapshot-") and old_dir != snapshot_dir:
+                    shutil.rmtree(old_dir, ignore_errors=True)
 
         for i in range(self.num_nodes):
-            from_dir = os.path.join(self.options.cachedir, "node" + str(i))
+            from_dir = os.path.join(snapshot_dir, "node" + str(i))
             to_dir = os.path.join(self.options.tmpdir, "node" + str(i))
-            shutil.copytree(from_dir, to_dir)
+            clone_tree(from_dir, to_dir)
             # Overwrite port/rpcport in bitcoin.conf
             initialize_datadir(self.options.tmpdir, i, self.log)
 
+    def _build_cache(self, build_dir):
+        """Create a 200-block-long chain with MAX_NODES wallets in build_dir."""
+        # Create cache directories, run bitcoinds. All nodes are started
+        # before waiting for any of them to be ready for RPC.
+        for i in range(MAX_NODES):
+            initialize_datadir(build_dir, i, self.log)
+            self.nodes.append(TestNode(i, build_dir, extra_args=[
+            ], rpchost=None, timewait=None, binary=None, stderr=None, mocktime=self.mocktime,
+                                       coverage_dir=None))
+        for node in self.nodes:
+            node.start([], self.options.network)
+        for node in self.nodes:
+            node.wait_for_rpc_connection()
+        for i in range(1, MAX_NODES):
+            connect_nodes(self.nodes[i], 0)
+
+        # Create a 200-block-long chain; each of the 4 first nodes
+        # gets 25 mature blocks and 25 immature.
+        # Note: To preserve compatibility with older versions of
+        # initialize_chain, only 4 nodes will generate coins.
+        #
+        # blocks are created with timestamps 10 minutes apart
+        # starting from 2010 minutes in the past. Each block still needs
+        # its own setmocktime on the miner, so a peer's 25 blocks go out
+        # as one batch of setmocktime/generate pairs, which the node runs
+        # in order. The other nodes are set to the time of the last block
+        # first so that none of the blocks is too far in their future.
+        self.enable_mocktime(int(time.time()) - (201 * 10 * 60))
+        for i in range(2):
+            for peer in range(4):
+                end_time = self.mocktime + 24 * 10 * 60
+                set_node_times([node for n, node in enumerate(self.nodes) if n != peer], end_time)
+                with self.nodes[peer].batch() as batch:
+                    calls = []
+                    for j in range(25):
+                        calls.append(batch.setmocktime(self.mocktime))
+                        calls.append(batch.generate(1))
+                        self.mocktime += 10 * 60
+                for call in calls:
+                    call.result()
+                # Must sync before next peer starts generating blocks
+                sync_blocks(self.nodes)
+
+        # Shut them down
+        self.stop_nodes()
+        self.nodes = []
+        self.disable_mocktime()
+
     def _initialize_chain_clean(self):
         """Initialize empty blockchain for use by the test.
 
@@ -20,12 +20,15 @@ from .mininode import COIN, ToHex, FromHex, CTransaction
 from .util import (
     assert_equal,
     get_rpc_proxy,
+    rpc_port_open,
     rpc_url,
     wait_until,
 )
-from .authproxy import JSONRPCException
+from .authproxy import JSONRPCException, RPCBatch
 
 BITCOIND_PROC_WAIT_TIMEOUT = 60
+# Upper bound of the backoff between RPC readiness probes, in seconds
+RPC_POLL_MAX_INTERVAL = 0.1
 
 
 class TestNode():
@@ -73,6 +76,9 @@ class TestNode():
         self.rpc_connected = False
         self.rpc = None
         self.url = None
+        self.start_time = None
+        # Seconds from process start until RPC answered, see wait_for_rpc_connection()
+        self.rpc_ready_time = None
         self.relay_fee_cache = None
         self.log = logging.getLogger('TestFramework.node%d' % i)
 
@@ -94,27 +100,34 @@ class TestNode():
         self.args.append('--datadir')
         self.args.append(self.datadir)
 
+        self.start_time = time.time()
         self.process = subprocess.Popen(self.args + extra_args, stdout=open(os.devnull, 'w'), stderr=stderr)
         self.running = True
         self.log.debug("bitcoind started, waiting for RPC to come up")
 
     def wait_for_rpc_connection(self):
         """Sets up an RPC connection to the bitcoind process. Returns False if unable to connect."""
-        # Poll at a rate of four times per second
-        poll_per_s = 4
-        for _ in range(poll_per_s * self.rpc_timeout):
+        # Probe the RPC port with a plain TCP connect, backing off
+        # exponentially from 1 ms, before issuing the first RPC.
+        delay = 0.001
+        deadline = time.time() + self.rpc_timeout
+        while time.time() < deadline:
             assert self.process.poll(
             ) is None, "bitcoind exited with status %i during initialization" % self.process.returncode
             try:
                 scheme = 'http' if self.configData['P2PNet']['DisableTLS'] else 'https'
-                self.rpc = get_rpc_proxy(rpc_url(self.datadir, self.index, self.rpchost, scheme),
-                                         self.index, timeout=self.rpc_timeout, coveragedir=self.coverage_dir)
-                self.rpc.getblockcount()
-                # If the call to getblockcount() succeeds then the RPC connection is up
-                self.rpc_connected = True
-                self.url = self.rpc.url
-                self.log.debug("RPC successfully started")
-                return
+                url = rpc_url(self.datadir, self.index, self.rpchost, scheme)
+                if rpc_port_open(url):
+                    self.rpc = get_rpc_proxy(url, self.index, timeout=self.rpc_timeout,
+                                             coveragedir=self.coverage_dir)
+                    self.rpc.getblockcount()
+                    # If the call to getblockcount() succeeds then the RPC connection is up
+                    self.rpc_connected = True
+                    self.url = self.rpc.url
+                    self.rpc_ready_time = time.time() - self.start_time
+                    self.log.debug("RPC successfully started after %.3f s" %
+                                   self.rpc_ready_time)
+                    return
             except IOError as e:
                 if e.errno != errno.ECONNREFUSED:  # Port not yet open?
                     raise  # unknown IO error
@@ -124,9 +137,36 @@ class TestNode():
             except ValueError as e:  # cookie file not found and no rpcuser or rpcassword. bitcoind still starting
                 if "No RPC credentials" not in str(e):
                     raise
-            time.sleep(1.0 / poll_per_s)
+            time.sleep(delay)
+            delay = min(delay * 2, RPC_POLL_MAX_INTERVAL)
         raise AssertionError("Unable to connect to bitcoind")
 
+    def attach(self):
+        """Sets up an RPC connection to a bitcoind which is already running and
+        not owned by this TestNode, e.g. one leased from the node pool."""
+        scheme = 'http' if self.configData['P2PNet']['DisableTLS'] else 'https'
+        self.rpc = get_rpc_proxy(rpc_url(self.datadir, self.index, self.rpchost, scheme),
+                                 self.index, timeout=self.rpc_timeout, coveragedir=self.coverage_dir)
+        self.rpc_connected = True
+        self.url = self.rpc.url
+
+    def batch(self, rpc_call_list=None):
+        """Returns an RPCBatch which queues calls to this node and sends them
+        as one JSON-RPC batch request, see authproxy.RPCBatch.
+
+        If rpc_call_list is given, sends those raw requests instead and
+        returns the raw responses, like AuthServiceProxy.batch()."""
+        assert self.rpc_connected, "Error: No RPC connection"
+        if rpc_call_list is not None:
+            return self.rpc.batch(rpc_call_list)
+        return RPCBatch(self.rpc)
+
+    def pipeline(self, calls):
+        """Sends calls, a list of (method, params) tuples, back to back on one
+        connection and returns their results, see AuthServiceProxy.pipeline()."""
+        assert self.rpc_connected, "Error: No RPC connection"
+        return self.rpc.pipeline(calls)
+
     def get_wallet_rpc(self, wallet_name):
         assert self.rpc_connected
         assert self.rpc
@@ -160,6 +200,8 @@ class TestNode():
         assert_equal(return_code, 0)
         self.running = False
         self.process = None
+        if self.rpc is not None:
+            self.rpc.close()
         self.rpc_connected = False
         self.rpc = None
         self.log.debug("Node stopped")
@@ -13,11 +13,15 @@ import logging
 import os
 import random
 import re
+import shutil
+import subprocess
 from subprocess import CalledProcessError
+import sys
 import time
+import urllib.parse
 
 from . import coverage
-from .authproxy import AuthServiceProxy, JSONRPCException
+from .authproxy import AuthServiceProxy, JSONRPCException, gather
 
 logger = logging.getLogger("TestFramework.utils")
 
@@ -325,6 +329,19 @@ def rpc_url(datadir, i, rpchost=None, scheme='https'):
             host = rpchost
     return f"{scheme}://{rpc_u}:{rpc_p}@{host}:{port}"
 
+
+def rpc_port_open(url):
+    """
+    Return whether something accepts TCP connections on the host and port
+    of the RPC url. This is much cheaper than a failing RPC call.
+    """
+    parsed = urllib.parse.urlparse(url)
+    try:
+        with socket.create_connection((parsed.hostname, parsed.port), timeout=1):
+            return True
+    except OSError:
+        return False
+
 # Node functions
 ################
 
@@ -412,6 +429,86 @@ Wallet:
     return datadir
 
 
+def rusage_to_dict(rusage):
+    """
+    Return the CPU time, peak memory in KiB, block I/O and context switches
+    of a resource.getrusage() result as a dict.
+    """
+    # ru_maxrss is reported in bytes on macOS and in KiB elsewhere
+    max_rss = rusage.ru_maxrss
+    if sys.platform == 'darwin':
+        max_rss //= 1024
+    return {'cpu_user': round(rusage.ru_utime, 3),
+            'cpu_sys': round(rusage.ru_stime, 3),
+            'max_rss': max_rss,
+            'blocks_in': rusage.ru_inblock,
+            'blocks_out': rusage.ru_oublock,
+            'ctx_voluntary': rusage.ru_nvcsw,
+            'ctx_involuntary': rusage.ru_nivcsw}
+
+
+def get_binary_hash(binary, cachedir):
+    """
+    Return the sha256 hex digest of the binary.
+
+    The digest is memoized in cachedir, keyed by the size and modification
+    time of the binary, so the binary is only hashed when it changes.
+    """
+    path = shutil.which(binary) or binary
+    try:
+        st = os.stat(path)
+    except OSError:
+        # Let starting the node report the missing binary
+        return hashlib.sha256(binary.encode('utf-8')).hexdigest()
+    key = [os.path.realpath(path), st.st_size, st.st_mtime_ns]
+    memo_file = os.path.join(cachedir, "binary_hash.json")
+    try:
+        with open(memo_file, 'r', encoding='utf8') as f:
+            memo = json.load(f)
+        if memo['key'] == key:
+            return memo['sha256']
+    except (OSError, ValueError, KeyError):
+        pass
+
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha256.update(chunk)
+    digest = sha256.hexdigest()
+
+    os.makedirs(cachedir, exist_ok=True)
+    tmp_file = "%s.%d" % (memo_file, os.getpid())
+    with open(tmp_file, 'w', encoding='utf8') as f:
+        json.dump({'key': key, 'sha256': digest}, f)
+    os.replace(tmp_file, memo_file)
+    return digest
+
+
+def get_cache_snapshot_dir(cachedir, binary):
+    """
+    Return the directory of the cached chain built with binary.
+    """
+    return os.path.join(cachedir, "snapshot-" + get_binary_hash(binary, cachedir)[:16])
+
+
+def clone_tree(from_dir, to_dir):
+    """
+    Copy the directory tree from_dir to to_dir.
+
+    On Linux the files are cloned with reflinks where the filesystem supports
+    it (btrfs, xfs, ...), so file data is shared copy-on-write and the copy
+    takes milliseconds. Otherwise this falls back to a full copy.
+    """
+    if sys.platform.startswith('linux') and shutil.which('cp'):
+        try:
+            subprocess.check_call(
+                ['cp', '-a', '--reflink=auto', from_dir, to_dir])
+            return
+        except CalledProcessError:
+            shutil.rmtree(to_dir, ignore_errors=True)
+    shutil.copytree(from_dir, to_dir)
+
+
 def get_datadir_path(dirname, n):
     return os.path.join(dirname, "node" + str(n))
 
@@ -449,9 +546,30 @@ def get_bip9_status(node, key):
     return info['bip9_softforks'][key]
 
 
+def rpc_gather(calls):
+    """
+    Make RPCs to several nodes concurrently, so that they cost one
+    round-trip regardless of the number of nodes.
+
+    calls is a list of (rpc_connection, method, args) tuples. Returns the
+    results in the same order, raising the first JSONRPCException.
+    """
+    coroutines = []
+    for rpc, method, args in calls:
+        rpc_method = getattr(rpc, method)
+        coroutines.append(rpc_method.async_request(rpc_method.get_request(*args)))
+    return gather(coroutines)
+
+
+def rpc_gather_all(rpc_connections, method, *args):
+    """
+    Make the same RPC to every node concurrently, see rpc_gather().
+    """
+    return rpc_gather([(rpc, method, args) for rpc in rpc_connections])
+
+
 def set_node_times(nodes, t):
-    for node in nodes:
-        node.setmocktime(t)
+    rpc_gather_all(nodes, 'setmocktime', t)
 
 
 def disconnect_nodes(from_connection, node_num):
@@ -493,11 +611,11 @@ def sync_blocks(rpc_connections, *, wait=1, timeout=200):
     # initial max height because the two RPCs look at different internal global
     # variables (chainActive vs latestBlock) and the former gets updated
     # earlier.
-    maxheight = max(x.getblockcount() for x in rpc_connections)
+    maxheight = max(rpc_gather_all(rpc_connections, 'getblockcount'))
     start_time = cur_time = time.time()
     while cur_time <= start_time + timeout:
-        tips = [r.waitforblockheight(maxheight, int(wait * 1000))
-                for r in rpc_connections]
+        tips = rpc_gather_all(rpc_connections, 'waitforblockheight',
+                              maxheight, int(wait * 1000))
         if all(t["height"] == maxheight for t in tips):
             if all(t["hash"] == tips[0]["hash"] for t in tips):
                 return
@@ -513,7 +631,7 @@ def sync_chain(rpc_connections, *, wait=1, timeout=60):
     Wait until everybody has the same best block
     """
     while timeout > 0:
-        best_hash = [x.getbestblockhash() for x in rpc_connections]
+        best_hash = rpc_gather_all(rpc_connections, 'getbestblockhash')
         if best_hash == [best_hash[0]] * len(best_hash):
             return
         time.sleep(wait)
@@ -527,10 +645,10 @@ def sync_mempools(rpc_connections, *, wait=1, timeout=60):
     pools
     """
     while timeout > 0:
-        pool = set(rpc_connections[0].getrawmempool())
+        pools = [set(p) for p in rpc_gather_all(rpc_connections, 'getrawmempool')]
         num_match = 1
         for i in range(1, len(rpc_connections)):
-            if set(rpc_connections[i].getrawmempool()) == pool:
+            if pools[i] == pools[0]:
                 num_match = num_match + 1
         if num_match == len(rpc_connections):
             return
@@ -688,24 +806,51 @@ def create_tx(node, coinbase, to_address, amount):
     assert_equal(signresult["complete"], True)
     return signresult["hex"]
 
+
+def send_raw_transactions(node, txs, *args):
+    """
+    Send the signed transactions txs in one batch and return their txids.
+
+    The calls of a batch are not guaranteed to be handled in order, so a
+    transaction spending an output of an earlier one in txs may be rejected
+    for missing inputs. Calls which failed are retried one at a time, in
+    order, once the batch is done; an error of the retry is raised.
+    """
+    batch = node.batch()
+    sent = [batch.sendrawtransaction(tx, *args) for tx in txs]
+    batch.send()
+    txids = []
+    for tx, txid in zip(txs, sent):
+        if txid.exception() is None:
+            txids.append(txid.result())
+        else:
+            txids.append(node.sendrawtransaction(tx, *args))
+    return txids
+
+
 # Create a spend of each passed-in utxo, splicing in "txouts" to each raw
 # transaction to make it large.  See gen_return_txouts() above.
 
 
 def create_lots_of_big_transactions(node, txouts, utxos, num, fee):
     addr = node.getnewaddress()
-    txids = []
+    # One round-trip each to create, sign and send all transactions
+    batch = node.batch()
+    rawtxs = []
+    signresults = []
     for _ in range(num):
         t = utxos.pop()
         inputs = [{"txid": t["txid"], "vout": t["vout"]}]
         outputs = {}
         change = t['amount'] - fee
         outputs[addr] = satoshi_round(change)
-        rawtx = node.createrawtransaction(inputs, outputs)
-        newtx = rawtx[0:92]
+        rawtxs.append(batch.createrawtransaction(inputs, outputs))
+    batch.send()
+    for rawtx in rawtxs:
+        newtx = rawtx.result()[0:92]
         newtx = newtx + txouts
-        newtx = newtx + rawtx[94:]
-        signresult = node.signrawtransaction(newtx, None, None, "NONE|FORKID")
-        txid = node.sendrawtransaction(signresult["hex"], True)
-        txids.append(txid)
-    return txids
+        newtx = newtx + rawtx.result()[94:]
+        signresults.append(batch.signrawtransaction(newtx, None, None, "NONE|FORKID"))
+    batch.send()
+    return send_raw_transactions(
+        node, [signresult.result()["hex"] for signresult in signresults], True)
@@ -26,9 +26,13 @@ import sys
 import subprocess
 import tempfile
 import re
+import select
 import logging
 import xml.etree.ElementTree as ET
 import json
+import heapq
+
+from test_framework.util import rusage_to_dict
 
 # Formatting. Default colors to empty strings.
 BOLD, BLUE, RED, GREY = ("", ""), ("", ""), ("", ""), ("", "")
@@ -80,6 +84,14 @@ TEST_PARAMS = {
 # we only run a test if its execution time in seconds does not exceed EXTENDED_CUTOFF
 EXTENDED_CUTOFF = 40
 
+# Number of nodes in the sets the node pool starts ahead of demand. Larger
+# sets also serve test scripts which lease fewer nodes.
+NODE_POOL_SET_SIZE = 4
+
+# Estimated execution time in seconds of a test without recorded timings,
+# used for scheduling when no other test has a recorded timing either.
+UNKNOWN_TEST_TIME = 30
+
 
 def on_ci():
     return os.getenv('TRAVIS') == 'true' or os.getenv('TEAMCITY_VERSION') != None
@@ -117,8 +129,12 @@ def main():
                         help='how many test scripts to run in parallel. Default=4.')
     parser.add_argument('--keepcache', '-k', action='store_true',
                         help='the default behavior is to flush the cache directory on startup. --keepcache retains the cache from the previous testrun.')
+    parser.add_argument('--nodepool', action='store_true',
+                        help='keep a pool of running nodes and hand them to test scripts which set reuse_nodes.')
     parser.add_argument('--quiet', '-q', action='store_true',
                         help='only print results summary and failure logs')
+    parser.add_argument('--schedule', choices=['lpt', 'name'], default='lpt',
+                        help='order in which test scripts are dispatched: longest recorded duration first (lpt) or by name. Default=lpt.')
     parser.add_argument('--tmpdirprefix', '-t',
                         default=tempfile.gettempdir(), help="Root directory for datadirs")
     parser.add_argument('--junitouput', '-ju',
@@ -185,19 +201,16 @@ def main():
             if exclude_test + ".py" in test_list:
                 test_list.remove(exclude_test + ".py")
 
-    # Use and update timings from build_dir only if separate
-    # build directory is used. We do not want to pollute source directory.
-    build_timings = None
-    if (src_dir != build_dir):
-        build_timings = Timings(os.path.join(build_dir, 'timing.json'))
+    # Use and update timings from build_dir. The scheduler needs recorded
+    # timings, so they are kept even if build_dir is the source directory.
+    build_timings = Timings(os.path.join(build_dir, 'timing.json'))
 
-    # Always use timings from scr_dir if present
-    src_timings = Timings(os.path.join(
-        src_dir, "test", "functional", 'timing.json'))
+    # Always use timings from tests_dir if present
+    src_timings = Timings(os.path.join(tests_dir, 'timing.json'))
 
     # Add test parameters and remove long running tests if needed
     test_list = get_tests_to_run(
-        test_list, TEST_PARAMS, cutoff, src_timings, build_timings)
+        test_list, TEST_PARAMS, cutoff, src_timings, build_timings, args.schedule)
 
     if not test_list:
         print("No valid test scripts specified. Check that your test is in one "
@@ -217,10 +230,11 @@ def main():
                                    "cache"), ignore_errors=True)
 
     run_tests(test_list, build_dir, tests_dir, args.junitouput,
-              config["environment"]["EXEEXT"], tmpdir, args.jobs, args.coverage, passon_args, build_timings)
+              config["environment"]["EXEEXT"], tmpdir, args.jobs, args.coverage, passon_args, build_timings,
+              TimingEstimator(src_timings, build_timings), args.nodepool)
 
 
-def run_tests(test_list, build_dir, tests_dir, junitouput, exeext, tmpdir, jobs=1, enable_coverage=False, args=[], build_timings=None):
+def run_tests(test_list, build_dir, tests_dir, junitouput, exeext, tmpdir, jobs=1, enable_coverage=False, args=[], build_timings=None, estimator=None, enable_node_pool=False):
     # Warn if bitcoind is already running (unix only)
     try:
         pidofOutput = subprocess.check_output(["pidof", "bitcoind"])
@@ -253,7 +267,7 @@ def run_tests(test_list, build_dir, tests_dir, junitouput, exeext, tmpdir, jobs=
     else:
         coverage = None
 
-    if len(test_list) > 1 and jobs > 1:
+    if (len(test_list) > 1 and jobs > 1) or enable_node_pool:
         # Populate cache
         cache_tmpdir = os.path.join("--tmpdir=%s", "cache") % tmpdir
         create_cache_py = [os.path.join(tests_dir, 'create_cache.py')] + flags + [cache_tmpdir]
@@ -267,8 +281,30 @@ def run_tests(test_list, build_dir, tests_dir, junitouput, exeext, tmpdir, jobs=
                 shutil.rmtree(cache_tmpdir, ignore_errors=True)
                 subprocess.check_output(create_cache_py)
 
+    if estimator is not None:
+        makespan, critical_path = estimator.predict_makespan(test_list, jobs)
+        logging.debug("Predicted runtime: %s s with %d jobs, critical path: %s" % (
+            makespan, jobs, ", ".join(critical_path)))
+
     # Run Tests
     job_queue = TestHandler(jobs, tests_dir, tmpdir, test_list, flags)
+
+    if enable_node_pool:
+        # Imported here, so test_runner works without the test framework's
+        # dependencies unless the node pool is used
+        from test_framework.nodepool import NodePool
+        # Use the binary the test framework runs, and port seeds above
+        # those of the test scripts
+        node_pool = NodePool(os.path.join(tmpdir, "nodepool"), cache_dir,
+                             os.path.join(os.getcwd(), "copernicus"),
+                             job_queue.portseed_offset + len(test_list),
+                             max_sets=jobs)
+        # Have a set ready for every job before the first script asks
+        node_pool.prestart(NODE_POOL_SET_SIZE, jobs)
+        job_queue.flags = flags + [node_pool.flag()]
+        logging.debug("Node pool listening at %s" % node_pool.address)
+    else:
+        node_pool = None
     time0 = time.time()
     test_results = []
 
@@ -291,7 +327,12 @@ def run_tests(test_list, build_dir, tests_dir, junitouput, exeext, tmpdir, jobs=
             print(BOLD[1] + 'stderr:\n' + BOLD[0] + test_result.stderr + '\n')
 
     runtime = int(time.time() - time0)
+    if node_pool is not None:
+        node_pool.shutdown()
+        shutil.rmtree(node_pool.dirname, ignore_errors=True)
     print_results(test_results, max_len_name, runtime)
+    if estimator is not None:
+        print_critical_path(test_results, makespan, critical_path)
     save_results_as_junit(test_results, junitouput, runtime)
 
     if (build_timings is not None):
@@ -314,8 +355,8 @@ def run_tests(test_list, build_dir, tests_dir, junitouput, exeext, tmpdir, jobs=
 
 
 def print_results(test_results, max_len_name, runtime):
-    results = "\n" + BOLD[1] + "%s | %s | %s\n\n" % (
-        "TEST".ljust(max_len_name), "STATUS   ", "DURATION") + BOLD[0]
+    results = "\n" + BOLD[1] + "%s | %s | %s | %s\n\n" % (
+        "TEST".ljust(max_len_name), "STATUS   ", "DURATION", "RESOURCES (harness + node)") + BOLD[0]
 
     test_results.sort(key=lambda result: result.name.lower())
     all_passed = True
@@ -334,6 +375,24 @@ def print_results(test_results, max_len_name, runtime):
     print(results)
 
 
+def print_critical_path(test_results, predicted_makespan, predicted_path):
+    """
+    Print the predicted critical path next to the actual one, i.e. the
+    sequence of tests run by the job slot that finished last.
+    """
+    if not test_results:
+        return
+    last = max(test_results, key=lambda result: result.started + result.time)
+    actual_path = sorted([t for t in test_results if t.slot == last.slot],
+                         key=lambda result: result.started)
+    actual_makespan = last.started + last.time - \
+        min(t.started for t in test_results)
+    print("Critical path (predicted): %s s | %s" %
+          (predicted_makespan, ", ".join(predicted_path)))
+    print("Critical path (actual):    %s s | %s\n" %
+          (int(actual_makespan), ", ".join(t.name for t in actual_path)))
+
+
 class TestHandler:
 
     """
@@ -353,6 +412,19 @@ class TestHandler:
         # (625 is PORT_RANGE/MAX_NODES)
         self.portseed_offset = int(time.time() * 1000) % 625
         self.jobs = []
+        # Each running test occupies a job slot, so the tests which ran
+        # back to back can be reconstructed afterwards.
+        self.free_slots = list(range(num_tests_parallel))
+        # Wake up as soon as a test script exits instead of polling: SIGCHLD
+        # is routed to a self-pipe which get_next() can select() on.
+        self.wakeup_fd = None
+        if hasattr(signal, 'SIGCHLD'):
+            self.wakeup_fd, wakeup_w = os.pipe()
+            os.set_blocking(self.wakeup_fd, False)
+            os.set_blocking(wakeup_w, False)
+            signal.set_wakeup_fd(wakeup_w)
+            # A Python-level handler is required for the wakeup fd to fire
+            signal.signal(signal.SIGCHLD, lambda signum, frame: None)
 
     def get_next(self):
         while self.num_running < self.num_jobs and self.test_list:
@@ -366,26 +438,36 @@ class TestHandler:
             test_argv = t.split()
             tmpdir = [os.path.join("--tmpdir=%s", "%s_%s") %
                       (self.tmpdir, re.sub(".py$", "", t), portseed)]
+            # The test writes its own and its nodes' resource usage next to
+            # (not into) its tmpdir, which is removed when the test passes.
+            rusage_file = os.path.join(self.tmpdir, "%s_%s.rusage.json" % (
+                re.sub(".py$", "", t), portseed))
+            rusage_arg = ["--rusagefile=%s" % rusage_file]
             self.jobs.append((t,
+                              self.free_slots.pop(0),
                               time.time(),
-                              subprocess.Popen([os.path.join(self.tests_dir, test_argv[0])] + test_argv[1:] + self.flags + portseed_arg + tmpdir,
+                              subprocess.Popen([os.path.join(self.tests_dir, test_argv[0])] + test_argv[1:] + self.flags + portseed_arg + tmpdir + rusage_arg,
                                                universal_newlines=True,
                                                stdout=log_stdout,
                                                stderr=log_stderr),
                               log_stdout,
-                              log_stderr))
+                              log_stderr,
+                              rusage_file))
         if not self.jobs:
             raise IndexError('pop from empty list')
         while True:
+            # Drain pending wakeups before scanning, so that a child exiting
+            # after the scan still interrupts the wait below.
+            self._drain_wakeups()
             # Return first proc that finishes
-            time.sleep(.5)
             for j in self.jobs:
-                (name, time0, proc, log_out, log_err) = j
+                (name, slot, time0, proc, log_out, log_err, rusage_file) = j
                 if on_ci() and int(time.time() - time0) > 20 * 60:
                     # In travis, timeout individual tests after 20 minutes (to stop tests hanging and not
                     # providing useful output.
                     proc.send_signal(signal.SIGINT)
-                if proc.poll() is not None:
+                usage = self._reap(proc)
+                if usage is not None:
                     log_out.seek(0), log_err.seek(0)
                     [stdout, stderr] = [l.read().decode('utf-8')
                                         for l in (log_out, log_err)]
@@ -398,16 +480,112 @@ class TestHandler:
                         status = "Failed"
                     self.num_running -= 1
                     self.jobs.remove(j)
+                    self.free_slots.append(slot)
+
+                    harness_usage, node_usage = ResourceUsage.load_split(
+                        rusage_file)
+                    return TestResult(name, status, int(time.time() - time0), stdout, stderr,
+                                      started=time0, slot=slot, usage=usage,
+                                      harness_usage=harness_usage, node_usage=node_usage)
+            if not self._wait_for_child(.5):
+                print('.', end='', flush=True)
+
+    def _reap(self, proc):
+        """
+        Reap proc if it has exited and return the ResourceUsage of it and
+        its reaped children (the nodes it ran). Returns None while proc is
+        still running.
+        """
+        if not hasattr(os, 'wait4'):
+            return ResourceUsage() if proc.poll() is not None else None
+        if proc.returncode is not None:
+            return ResourceUsage()
+        pid, status, rusage = os.wait4(proc.pid, os.WNOHANG)
+        if pid == 0:
+            return None
+        if os.WIFSIGNALED(status):
+            proc.returncode = -os.WTERMSIG(status)
+        else:
+            proc.returncode = os.WEXITSTATUS(status)
+        return ResourceUsage.from_rusage(rusage)
 
-                    return TestResult(name, status, int(time.time() - time0), stdout, stderr)
-            print('.', end='', flush=True)
+    def _drain_wakeups(self):
+        if self.wakeup_fd is None:
+            return
+        try:
+            while os.read(self.wakeup_fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def _wait_for_child(self, timeout):
+        """
+        Block until a child process may have exited or timeout expires.
+        Returns False on timeout.
+        """
+        if self.wakeup_fd is None:
+            time.sleep(timeout)
+            return False
+        readable, _, _ = select.select([self.wakeup_fd], [], [], timeout)
+        return bool(readable)
+
+
+class ResourceUsage():
+    """
+    CPU time, peak memory, block I/O and context switches of a process,
+    including the children it has reaped.
+    """
+
+    FIELDS = ['cpu_user', 'cpu_sys', 'max_rss', 'blocks_in',
+              'blocks_out', 'ctx_voluntary', 'ctx_involuntary']
+
+    def __init__(self, **kwargs):
+        for field in self.FIELDS:
+            setattr(self, field, kwargs.get(field, 0))
+
+    @classmethod
+    def from_rusage(cls, rusage):
+        return cls(**rusage_to_dict(rusage))
+
+    @classmethod
+    def load_split(cls, file_name):
+        """
+        Load the (harness, node) usage written by the test framework.
+        Returns (None, None) if the test did not write it.
+        """
+        try:
+            with open(file_name) as f:
+                usage = json.load(f)
+            os.remove(file_name)
+        except (OSError, ValueError):
+            return None, None
+        return cls(**usage['harness']), cls(**usage['nodes'])
+
+    def cpu(self):
+        return self.cpu_user + self.cpu_sys
+
+    def as_dict(self, prefix=""):
+        return {prefix + field: getattr(self, field) for field in self.FIELDS}
+
+    def __repr__(self):
+        return "cpu %.1f+%.1f s, rss %d MB, io %d/%d blk, ctx %d/%d" % (
+            self.cpu_user, self.cpu_sys, self.max_rss // 1024, self.blocks_in,
+            self.blocks_out, self.ctx_voluntary, self.ctx_involuntary)
 
 
 class TestResult():
-    def __init__(self, name, status, time, stdout, stderr):
+    def __init__(self, name, status, time, stdout, stderr, started=0, slot=0,
+                 usage=None, harness_usage=None, node_usage=None):
         self.name = name
         self.status = status
         self.time = time
+        self.started = started
+        self.slot = slot
+        # usage covers the test script and all of its nodes; the split into
+        # harness and node usage is only known if the script reported it.
+        self.usage = usage if usage is not None else ResourceUsage()
+        self.harness_usage = harness_usage
+        self.node_usage = node_usage
         self.padding = 0
         self.stdout = stdout
         self.stderr = stderr
@@ -423,7 +601,27 @@ class TestResult():
             color = GREY
             glyph = CIRCLE
 
-        return color[1] + "%s | %s%s | %s s\n" % (self.name.ljust(self.padding), glyph, self.status.ljust(7), self.time) + color[0]
+        return color[1] + "%s | %s%s | %s s | %s\n" % (self.name.ljust(self.padding), glyph, self.status.ljust(7), self.time, self.usage_summary()) + color[0]
+
+    def usage_summary(self):
+        summary = "cpu %.1f s, rss %d MB" % (
+            self.usage.cpu(), self.usage.max_rss // 1024)
+        if self.harness_usage is not None:
+            summary += " (%.1f + %.1f s cpu, %d + %d MB)" % (
+                self.harness_usage.cpu(), self.node_usage.cpu(),
+                self.harness_usage.max_rss // 1024, self.node_usage.max_rss // 1024)
+        return summary
+
+    def usage_dict(self):
+        """
+        Flatten the resource usage into a dict, prefixing the harness and
+        node parts with 'harness_' and 'node_'.
+        """
+        usage = self.usage.as_dict()
+        if self.harness_usage is not None:
+            usage.update(self.harness_usage.as_dict("harness_"))
+            usage.update(self.node_usage.as_dict("node_"))
+        return usage
 
 
 def get_all_scripts_from_disk(test_dir, non_scripts):
@@ -434,23 +632,19 @@ def get_all_scripts_from_disk(test_dir, non_scripts):
     return list(python_files - set(non_scripts))
 
 
-def get_tests_to_run(test_list, test_params, cutoff, src_timings, build_timings=None):
+def get_tests_to_run(test_list, test_params, cutoff, src_timings, build_timings=None, schedule='lpt'):
     """
     Returns only test that will not run longer that cutoff.
-    Long running tests are returned first to favor running tests in parallel
+    With the 'lpt' schedule, long running tests are returned first to favor
+    running tests in parallel, otherwise tests are returned by name.
     Timings from build directory override those from src directory
     """
+    estimator = TimingEstimator(src_timings, build_timings)
 
     def get_test_time(test):
-        if build_timings is not None:
-            timing = next(
-                (x['time'] for x in build_timings.existing_timings if x['name'] == test), None)
-            if timing is not None:
-                return timing
-
-        # try source directory. Return 0 if test is unknown to always run it
-        return next(
-            (x['time'] for x in src_timings.existing_timings if x['name'] == test), 0)
+        # Return 0 if test is unknown to always run it
+        timing = estimator.recorded_time(test)
+        return timing if timing is not None else 0
 
     # Some tests must also be run with additional parameters. Add them to the list.
     tests_with_params = []
@@ -463,10 +657,53 @@ def get_tests_to_run(test_list, test_params, cutoff, src_timings, build_timings=
                 [test_name + " " + " ".join(p) for p in params])
 
     result = [t for t in tests_with_params if get_test_time(t) <= cutoff]
-    result.sort(key=lambda x:  (-get_test_time(x), x))
+    if schedule == 'lpt':
+        result.sort(key=lambda x:  (-estimator.estimate(x), x))
+    else:
+        result.sort()
     return result
 
 
+class TimingEstimator():
+    """
+    Estimates test execution times from recorded Timings.
+
+    Tests without a recorded timing are assumed to take the median of the
+    known timings, so they are neither started first nor left for last.
+    """
+
+    def __init__(self, src_timings, build_timings=None):
+        self.timings = {}
+        for timings in (src_timings, build_timings):
+            if timings is not None:
+                self.timings.update(
+                    (x['name'], x['time']) for x in timings.existing_timings)
+        known = sorted(self.timings.values())
+        self.fallback = known[len(known) // 2] if known else UNKNOWN_TEST_TIME
+
+    def recorded_time(self, test):
+        return self.timings.get(test)
+
+    def estimate(self, test):
+        timing = self.recorded_time(test)
+        return timing if timing is not None else self.fallback
+
+    def predict_makespan(self, test_list, jobs):
+        """
+        Simulate dispatching test_list in order to the first free of jobs
+        slots. Returns the estimated total runtime and the tests of the slot
+        which finishes last.
+        """
+        slots = [(0, i) for i in range(max(jobs, 1))]
+        slot_tests = [[] for _ in slots]
+        for test in test_list:
+            load, i = heapq.heappop(slots)
+            slot_tests[i].append(test)
+            heapq.heappush(slots, (load + self.estimate(test), i))
+        makespan, i = max(slots)
+        return makespan, slot_tests[i]
+
+
 class RPCCoverage():
     """
     Coverage reporting utilities for test_runner.
@@ -559,6 +796,10 @@ def save_results_as_junit(test_results, file_name, time):
                                      "time": str(test_result.time)
                                      }
                                     )
+        e_properties = ET.SubElement(e_test_case, "properties")
+        for name, value in sorted(test_result.usage_dict().items()):
+            ET.SubElement(e_properties, "property",
+                          {"name": name, "value": str(value)})
         if test_result.status == "Skipped":
             ET.SubElement(e_test_case, "skipped")
         elif test_result.status == "Failed":
@@ -611,7 +852,7 @@ class Timings():
         # we only save test that have passed - timings for failed test might be
         # wrong (timeouts or early fails)
         passed_results = [t for t in test_results if t.status == 'Passed']
-        new_timings = list(map(lambda t: {'name':  t.name, 'time': t.time},
+        new_timings = list(map(lambda t: dict({'name':  t.name, 'time': t.time}, **t.usage_dict()),
                                passed_results))
         merged_timings = self.get_merged_timings(new_timings)
 